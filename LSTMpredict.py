@@ -8,40 +8,14 @@ Created on Thu Feb 18 12:13:12 2021
 import torch
 from argparse import Namespace
 import json
-import os
-import glob
+from models import get_latest_file_with_path
+from loggers import benchmark
 
 from RNNModule import RNNModule
 
-def get_latest_file_with_path(path, *paths):
-    '''
-    Method to get the full path name for the latest file for the input parameter in paths.
-    This method uses the os.path.getctime function to get the most recently created file that matches the filename pattern in the provided path.
-
-    Parameters
-    ----------
-    path : string
-        Root pathname for the files.
-    *paths : string list
-        These are the var args field, the optional set of strings to denote the full path to the file names.
-
-    Returns
-    -------
-    latest_file : string
-        Full path name for the latest file provided in the paths parameter.
-
-    '''
-
-    fullpath = os.path.join(path, *paths)
-    list_of_files = glob.iglob(fullpath)
-    if not list_of_files:
-        return None
-    latest_file = max(list_of_files, key=os.path.getctime)
-    return latest_file
-
 class LSTMpredict:
 
-    def __init__(self, model_file_path, ground_truth_file_path, topk):
+    def __init__(self, model_file_path, ground_truth_file_path, topk, files=None):
 
         flags = Namespace(
             seq_size_u=3,
@@ -54,12 +28,19 @@ class LSTMpredict:
             predict_top_k=5,
             checkpoint_path=model_file_path,
         )
-        # PATH for model file
-        PATH = get_latest_file_with_path(model_file_path, 'model_lstm_interp_*.pth')
-        PATH_UNITS = get_latest_file_with_path(model_file_path, 'model_lstm_units_*.pth')
-        MODEL_TOKEN_INFO_PATH = get_latest_file_with_path(model_file_path, 'model_token_info_*.txt')
-        MODEL_TOKEN_UNITS_INFO_PATH = get_latest_file_with_path(model_file_path, 'model_token_units_info_*.txt')
-        GROUND_TRUTH_FILE_PATH = get_latest_file_with_path(ground_truth_file_path, 'ground_truth_label_*.json')
+        # PATH for model file. files, by their name in models.ARTIFACTS, pins the exact files to load.
+        if files:
+            PATH = files['lstm']
+            PATH_UNITS = files['lstm_units']
+            MODEL_TOKEN_INFO_PATH = files['token_info']
+            MODEL_TOKEN_UNITS_INFO_PATH = files['token_units_info']
+            GROUND_TRUTH_FILE_PATH = files['ground_truth']
+        else:
+            PATH = get_latest_file_with_path(model_file_path, 'model_lstm_interp_*.pth')
+            PATH_UNITS = get_latest_file_with_path(model_file_path, 'model_lstm_units_*.pth')
+            MODEL_TOKEN_INFO_PATH = get_latest_file_with_path(model_file_path, 'model_token_info_*.txt')
+            MODEL_TOKEN_UNITS_INFO_PATH = get_latest_file_with_path(model_file_path, 'model_token_units_info_*.txt')
+            GROUND_TRUTH_FILE_PATH = get_latest_file_with_path(ground_truth_file_path, 'ground_truth_label_*.json')
 
         # Initialize device to load model onto
         # device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -162,6 +143,7 @@ class LSTMpredict:
 
         return output
 
+    @benchmark("LSTMpredict.predictForSentence")
     def predictForSentence(self, sentence, isInferred = False):
         '''
         This method is used from the Flask Server Code API.
@@ -8,38 +8,12 @@ Created on Tue Jan 19 17:21:35 2021
 import json
 from heapq import heappop, heappush, heapify 
 
-import os
-import glob
-
-def get_latest_file_with_path(path, *paths):
-    '''
-    Method to get the full path name for the latest file for the input parameter in paths.
-    This method uses the os.path.getctime function to get the most recently created file that matches the filename pattern in the provided path. 
-
-    Parameters
-    ----------
-    path : string
-        Root pathname for the files.
-    *paths : string list
-        These are the var args field, the optional set of strings to denote the full path to the file names.
-
-    Returns
-    -------
-    latest_file : string
-        Full path name for the latest file provided in the paths parameter.
-
-    '''
-
-    fullpath = os.path.join(path, *paths)
-    list_of_files = glob.iglob(fullpath)
-    if not list_of_files:                
-        return None
-    latest_file = max(list_of_files, key=os.path.getctime)
-    return latest_file
+from models import get_latest_file_with_path
+from loggers import benchmark
 
 class MCpredict:
 
-    def __init__(self, chain_length, top_k, model_file_path, ground_truth_path):
+    def __init__(self, chain_length, top_k, model_file_path, ground_truth_path, files=None):
         '''
         Constructor to define object of Predict class.
         Thus we will have to read the model only once instead of having to read it every time we call the predict function.
@@ -51,17 +25,22 @@ class MCpredict:
             There are 2 chain types:
             archive -> proxyObservationType -> units, 
             archive -> proxyObservationType -> interpretation/variable, interpretation/variableDetail, inferredVariable, inferredVarUnits
+        files : dict, optional
+            Files to load, by their name in models.ARTIFACTS. The latest files in the paths are used when not given.
 
         Returns
         -------
         None.
 
         '''
-        model_file_path = get_latest_file_with_path(model_file_path, 'model_mc_*.txt')
+        if files:
+            model_file_path, ground_truth_path = files['mc'], files['ground_truth']
+        else:
+            model_file_path = get_latest_file_with_path(model_file_path, 'model_mc_*.txt')
+            ground_truth_path = get_latest_file_with_path(ground_truth_path, 'ground_truth_label_*.json')
         with open(model_file_path, 'r') as f:
             model = json.load(f)
         
-        ground_truth_path = get_latest_file_with_path(ground_truth_path, 'ground_truth_label_*.json')
         with open(ground_truth_path, 'r') as f:
             ground_truth = json.load(f)
          
@@ -258,6 +237,7 @@ class MCpredict:
                 # call API to add new word to the data
         return (output_list, sentence)
     
+    @benchmark("MCpredict.predict_seq")
     def predict_seq(self, sentence, isInferred = False):
         '''
         Predict the top 5 elements at each stage for every item in the chain
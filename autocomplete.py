@@ -0,0 +1,428 @@
+import hashlib
+import heapq
+import json
+import os
+import threading
+from bisect import bisect_left
+from types import MappingProxyType
+
+import numpy as np
+
+from editdistance import StringArray
+from cache import ByteLRU
+from models import get_latest_file_with_path
+from loggers import create_logger
+
+logger_autocomplete = create_logger("autocomplete")
+
+AUTOCOMPLETE_FILES = 'autocomplete_file_*.json'
+
+# Queries up to this long are worked out for every prefix of the values when a SuggestionCache is built
+SHORT_PREFIX = 2
+# How a suggestion matches what has been typed, best first
+EXACT, PREFIX, FUZZY = 0, 1, 2
+
+
+def load_names_set_from_file(file_name):
+    '''
+    Method to load the dict containing the list of all possible values for each fieldType, used for autocomplete suggestions.
+
+    Parameters
+    ----------
+    file_name : string
+        File containing the data for autocomplete suggestions.
+
+    Returns
+    -------
+    names_set : dict
+        List of all possible values for each fieldType.
+
+    '''
+    with open(file_name, 'r', encoding='utf-8') as autocomplete_file_:
+        return json.load(autocomplete_file_)
+
+
+def _file_key(path):
+    '''
+    Identify a version of the autocomplete file by its path, modification time and size.
+
+    '''
+    if not path:
+        return None
+    try:
+        _stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, _stat.st_mtime_ns, _stat.st_size)
+
+
+def build_prefix_index(words):
+    '''
+    Index a list of values for prefix lookups: the values lowercased and sorted, with where each one is in the list.
+
+    Parameters
+    ----------
+    words : tuple
+        Values of one fieldType.
+
+    Returns
+    -------
+    tuple
+        Sorted lowercased values, and the position in words of each one.
+
+    '''
+    pairs = sorted((word.lower(), i) for i, word in enumerate(words))
+    return tuple(key for key, _ in pairs), tuple(i for _, i in pairs)
+
+
+def rank(candidates, counts=None, limit=None, offset=0):
+    '''
+    Order autocomplete candidates, best first: exact matches, then values starting with the query, then the fuzzy
+    matches from the closest out. Within each, the more common values come first, then the order they came in.
+    With a limit, only the best offset + limit are kept while going through them, in a bounded heap, so the cost
+    and the size of the result don't grow with the number of candidates.
+
+    Parameters
+    ----------
+    candidates : iterable
+        (value, EXACT, PREFIX or FUZZY, edit distance) for each candidate.
+    counts : dict
+        How common each value is, by its lowercased value. Values not in it count as 0.
+    limit : int, optional
+        Most values to return. All of them when not given.
+    offset : int
+        Best values to skip, for the next page.
+
+    Returns
+    -------
+    list
+        Values, best first.
+
+    '''
+    counts = counts or {}
+    keyed = (((match, distance, -counts.get(word.lower(), 0), i), word)
+             for i, (word, match, distance) in enumerate(candidates))
+    if limit is None:
+        ranked = sorted(keyed)
+    else:
+        ranked = heapq.nsmallest(offset + limit, keyed)
+    return [word for _, word in ranked[offset:]]
+
+
+class Vocabulary(object):
+    '''
+    One version of the autocomplete data. It is never changed once built, so any number of requests can read it while
+    a newer one is being built.
+
+    '''
+
+    def __init__(self, names_set, key=None):
+        '''
+        Parameters
+        ----------
+        names_set : dict
+            List of all possible values for each fieldType.
+        key : tuple
+            Path, modification time and size of the file the data was read from.
+
+        '''
+        self.key = key
+        self.path = key[0] if key else None
+        # Short id for the file the data was read from, for the ETags of the responses built from it
+        self.version = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:12]
+        self.names_set = MappingProxyType({field: tuple(words) for field, words in names_set.items()})
+        self._prefix_index = {field: build_prefix_index(words) for field, words in self.names_set.items()}
+        # Fuzzy index of each fieldType: its distinct lowercased values, ready to be compared to a query all at once,
+        # and where each one is in the file
+        self._positions = {}
+        self._fuzzy_index = {}
+        for field, words in self.names_set.items():
+            positions = {}
+            for i, word in enumerate(words):
+                positions.setdefault(word.lower(), []).append(i)
+            self._positions[field] = list(positions.values())
+            self._fuzzy_index[field] = StringArray(positions)
+
+    @classmethod
+    def from_file(cls, key):
+        return cls(load_names_set_from_file(key[0]), key)
+
+    def words(self, fieldType):
+        '''
+        Parameters
+        ----------
+        fieldType : string
+            Field to get the values of.
+
+        Returns
+        -------
+        tuple
+            All possible values for the fieldType, empty if it has none.
+
+        '''
+        return self.names_set.get(fieldType, ())
+
+    def starting_with(self, fieldType, prefix):
+        '''
+        Values of a fieldType that start with a prefix, ignoring case. Found with a binary search of the prefix index,
+        in O(log n + k) for k values found, then put back in the order of the autocomplete file.
+
+        Parameters
+        ----------
+        fieldType : string
+            Field to search the values of.
+        prefix : string
+            Start of the values to find.
+
+        Returns
+        -------
+        list
+            Values starting with prefix.
+
+        '''
+        words = self.words(fieldType)
+        if not words:
+            return []
+        keys, positions = self._prefix_index[fieldType]
+        prefix = prefix.lower()
+        found = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            found.append(positions[i])
+            i += 1
+        found.sort()
+        return [words[i] for i in found]
+
+    def within(self, fieldType, query, max_distance):
+        '''
+        Values of a fieldType within an edit distance of a query, ignoring case. The query is compared to every
+        distinct value at once, skipping the ones whose length is too far from it, then the matches are put back in
+        the order of the autocomplete file.
+
+        Parameters
+        ----------
+        fieldType : string
+            Field to search the values of.
+        query : string
+            String to compare the values to.
+        max_distance : int
+            Largest edit distance to return.
+
+        Returns
+        -------
+        list
+            (value, distance) for every value within max_distance of query.
+
+        '''
+        words = self.words(fieldType)
+        if not words:
+            return []
+        positions = self._positions[fieldType]
+        distances = self._fuzzy_index[fieldType].distances(query.lower(), max_distance)
+        found = []
+        for k in np.flatnonzero(distances <= max_distance):
+            d = int(distances[k])
+            found.extend((i, d) for i in positions[k])
+        found.sort()
+        return [(words[i], d) for i, d in found]
+
+
+class SuggestionCache(object):
+    '''
+    Ranked autocomplete results for one version of the autocomplete data and the models, by fieldType and lowercased
+    query. Most calls are for the first one to SHORT_PREFIX characters of a value, so the results of those prefixes
+    are worked out when it is built, the most common first, up to max_bytes per fieldType. Other queries are kept in a
+    least recently used cache per fieldType once asked for, also up to max_bytes.
+
+    Only the best depth results of a query are kept. A page past them is worked out on the spot. A new version of
+    either the data or the models gets a new SuggestionCache, so nothing in it is ever stale.
+
+    '''
+
+    def __init__(self, version, vocabulary, compute, max_bytes, depth):
+        '''
+        Parameters
+        ----------
+        version : string
+            Versions of the autocomplete data and the models the results are for.
+        vocabulary : Vocabulary
+            Autocomplete data, for the prefixes to work out ahead.
+        compute : callable
+            compute(fieldType, query, limit, offset) gives the results of a query, best first.
+        max_bytes : int
+            Total length of the precomputed results of each fieldType, and of its cached ones.
+        depth : int
+            Results kept for each query.
+
+        '''
+        self.version = version
+        self.depth = depth
+        self._compute = compute
+        self._short = {}
+        self._recent = {}
+        for field, words in vocabulary.names_set.items():
+            counts = {}
+            for word in words:
+                for n in range(1, min(len(word), SHORT_PREFIX) + 1):
+                    prefix = word[:n].lower()
+                    counts[prefix] = counts.get(prefix, 0) + 1
+            short = {}
+            size = 0
+            # Shortest, then most common first, so a small max_bytes keeps the prefixes asked for most
+            for prefix in sorted(counts, key=lambda p: (len(p), -counts[p], p)):
+                found = self._top(field, prefix)
+                size += _results_size(prefix, found[0])
+                if size > max_bytes:
+                    break
+                short[prefix] = found
+            self._short[field] = short
+            self._recent[field] = ByteLRU(max_bytes)
+
+    def _top(self, fieldType, query):
+        # One more than depth, to know whether there are more
+        found = tuple(self._compute(fieldType, query, self.depth + 1, 0))
+        return found[:self.depth], len(found) <= self.depth
+
+    def get(self, fieldType, query, limit, offset=0):
+        '''
+        Parameters
+        ----------
+        fieldType : string
+            Field being typed in.
+        query : string
+            What has been typed so far.
+        limit : int
+            Most results to return.
+        offset : int
+            Best results to skip.
+
+        Returns
+        -------
+        list
+            Results for the query, best first.
+        string
+            Where it came from: "precomputed", "cached" or "computed".
+
+        '''
+        query = query.lower()
+        found = self._short.get(fieldType, {}).get(query)
+        outcome = "precomputed"
+        if found is None:
+            recent = self._recent.get(fieldType)
+            if recent is None:
+                return list(self._compute(fieldType, query, limit, offset)), "computed"
+            found = recent.get(query)
+            outcome = "cached"
+            if found is None:
+                found = self._top(fieldType, query)
+                recent.put(query, found, _results_size(query, found[0]))
+                outcome = "computed"
+        results, complete = found
+        if offset + limit > len(results) and not complete:
+            return list(self._compute(fieldType, query, limit, offset)), "computed"
+        return list(results[offset:offset + limit]), outcome
+
+    def stats(self):
+        '''
+        Returns
+        -------
+        dict
+            For each fieldType, the prefixes worked out ahead, and the hits, misses and size of its cache.
+
+        '''
+        return {field: dict(self._recent[field].stats(), precomputed=len(self._short[field])) for field in self._short}
+
+
+def _results_size(query, results):
+    return len(query) + sum(len(word) for word in results)
+
+
+class VocabularyWatcher(object):
+    '''
+    Keeps the latest autocomplete data loaded. A background thread checks for a new or changed autocomplete file, and
+    builds a new Vocabulary from it off the request path. Requests only ever read the current Vocabulary.
+
+    '''
+
+    def __init__(self, data_dir, interval=5):
+        '''
+        Parameters
+        ----------
+        data_dir : string
+            Directory with the autocomplete_file_* files.
+        interval : float
+            Seconds between checks for a new autocomplete file. 0 to never check after the first load.
+
+        '''
+        self.data_dir = data_dir
+        self.interval = interval
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        '''
+        Returns
+        -------
+        Vocabulary
+            The latest autocomplete data. Loaded on first use.
+
+        '''
+        _current = self._current
+        if _current is None:
+            self.check()
+            _current = self._current
+        return _current
+
+    def start(self):
+        '''
+        Start checking for a new autocomplete file in the background, every interval seconds.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="autocomplete-watch", daemon=True)
+            self._thread.start()
+        return
+
+    def stop(self):
+        self._stop.set()
+        return
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            # Nothing to keep fresh until a request has needed the data
+            if self._current is None:
+                continue
+            try:
+                self.check()
+            except Exception as e:
+                logger_autocomplete.error("watch: {}".format(e))
+        return
+
+    def check(self):
+        '''
+        Build a new Vocabulary if the latest autocomplete file is a different file, or has changed since it was read.
+
+        Returns
+        -------
+        bool
+            True if a new Vocabulary was swapped in.
+
+        '''
+        with self._lock:
+            key = _file_key(get_latest_file_with_path(self.data_dir, AUTOCOMPLETE_FILES))
+            if self._current is not None and self._current.key == key:
+                return False
+            if key is None:
+                logger_autocomplete.error("check: no autocomplete file in {}".format(self.data_dir))
+                vocabulary = Vocabulary({})
+            else:
+                vocabulary = Vocabulary.from_file(key)
+            self._current = vocabulary
+        logger_autocomplete.info("check: loaded autocomplete data from {}".format(vocabulary.path))
+        return True
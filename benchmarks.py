@@ -0,0 +1,173 @@
+"""
+Benchmark the LiPD to NOAA conversion stages on synthetic datasets of growing size.
+
+Each stage is timed on its own, then run again under tracemalloc for its peak memory. The growth column is the
+exponent of the time between one size and the next: about 1 for a stage that scales linearly, 2 for quadratic.
+
+    python benchmarks.py --rows 100 1000 10000 100000 1000000 --paleo-tables 2 --chron-tables 1 --ensemble-tables 1
+"""
+import argparse
+import copy
+import json
+import math
+import sys
+import time
+import tracemalloc
+
+from jsons import idx_num_to_name
+from csvs import merge_csv_metadata
+from inferred_data import get_inferred_data_table
+from convert import lpd_to_noaa
+from misc import is_ensemble
+from synthetic import synthetic_lipd
+from loggers import create_logger
+
+logger_benchmarks = create_logger("benchmarks")
+
+STAGES = ["idx_num_to_name", "merge_csv_metadata", "get_inferred_data_table", "lpd_to_noaa"]
+# Growth exponents above this are flagged as worse than linear
+SUPERLINEAR = 1.3
+
+
+def _tables(d):
+    """
+    Every non-ensemble table in index-by-name metadata, with its paleo or chron type.
+
+    :param dict d: Metadata
+    :return list: (table, "paleo" or "chron")
+    """
+    out = []
+    for pc, key in (("paleo", "paleoData"), ("chron", "chronData")):
+        for section in (d.get(key) or {}).values():
+            groups = [section.get("measurementTable") or {}]
+            for model in (section.get("model") or {}).values():
+                groups.extend(model.get(k) or {} for k in ("summaryTable", "ensembleTable", "distributionTable"))
+            for tables in groups:
+                for table in tables.values():
+                    if "columns" in table and not is_ensemble(table["columns"]):
+                        out.append((table, pc))
+    return out
+
+
+def _stage_inputs(payload):
+    """
+    The input of each stage, made ahead of time so building it isn't counted.
+
+    :param dict payload: {"metadata": ..., "csvs": ...}
+    :return dict: Function that runs each stage on a fresh copy of its input
+    """
+    named = idx_num_to_name(copy.deepcopy(payload["metadata"]))
+    merged = merge_csv_metadata(copy.deepcopy(named), payload["csvs"])
+    # get_inferred_data_table runs inside merge_csv_metadata. It is also timed on its own, over the merged tables.
+    # Running it again just recalculates the inferred data already there.
+    return {
+        "idx_num_to_name": lambda: (idx_num_to_name, (copy.deepcopy(payload["metadata"]),)),
+        "merge_csv_metadata": lambda: (merge_csv_metadata, (copy.deepcopy(named), payload["csvs"])),
+        "get_inferred_data_table": lambda: (_inferred_all, (_tables(copy.deepcopy(merged)),)),
+        "lpd_to_noaa": lambda: (lpd_to_noaa, (copy.deepcopy(merged), "project", "1.0.0")),
+    }
+
+
+def _inferred_all(tables):
+    for table, pc in tables:
+        get_inferred_data_table(table, pc)
+    return
+
+
+def _measure(make, repeat, memory):
+    """
+    Run one stage.
+
+    :param callable make: Returns the stage function and a fresh copy of its arguments
+    :param int repeat: Runs to time. The fastest is kept.
+    :param bool memory: Also run it once under tracemalloc for its peak memory
+    :return tuple: (seconds, peak bytes or None)
+    """
+    best = None
+    for _ in range(repeat):
+        fn, args = make()
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        fn, args = make()
+        tracemalloc.start()
+        try:
+            fn(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def run(rows, repeat=3, memory=True, **kwargs):
+    """
+    Benchmark every stage on a synthetic dataset at each size.
+
+    :param list rows: Table lengths to run, in rows
+    :param int repeat: Runs to time each stage. The fastest is kept.
+    :param bool memory: Also measure peak memory
+    :param kwargs: Passed on to synthetic_lipd
+    :return list: One result per size and stage: {"rows", "stage", "seconds", "peak_bytes", "growth"}
+    """
+    results = []
+    previous = {}
+    for n in rows:
+        payload = synthetic_lipd(rows=n, **kwargs)
+        inputs = _stage_inputs(payload)
+        for stage in STAGES:
+            seconds, peak = _measure(inputs[stage], repeat, memory)
+            growth = None
+            if stage in previous and previous[stage][1] > 0 and n != previous[stage][0]:
+                growth = math.log(max(seconds, 1e-9) / previous[stage][1]) / math.log(n / previous[stage][0])
+            previous[stage] = (n, max(seconds, 1e-9))
+            results.append({"rows": n, "stage": stage, "seconds": seconds, "peak_bytes": peak,
+                            "growth": growth})
+        logger_benchmarks.info("run: {} rows done".format(n))
+    return results
+
+
+def report(results):
+    """
+    Format results as a table, one line per size and stage.
+
+    :param list results: From run()
+    :return str: Report
+    """
+    lines = ["{:>9}  {:<24} {:>11} {:>11} {:>7}".format("rows", "stage", "seconds", "peak MB", "growth")]
+    for r in results:
+        peak = "-" if r["peak_bytes"] is None else "{:.2f}".format(r["peak_bytes"] / 1048576)
+        growth = "-" if r["growth"] is None else "{:.2f}{}".format(r["growth"], " !" if r["growth"] > SUPERLINEAR else "")
+        lines.append("{:>9}  {:<24} {:>11.4f} {:>11} {:>7}".format(r["rows"], r["stage"], r["seconds"], peak, growth))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the LiPD to NOAA conversion stages on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--paleo-tables", type=int, default=1)
+    parser.add_argument("--chron-tables", type=int, default=0)
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--ensemble-tables", type=int, default=0)
+    parser.add_argument("--ensemble-members", type=int, default=10)
+    parser.add_argument("--string-columns", type=int, default=0)
+    parser.add_argument("--missing", type=float, default=0.0, help="Share of missing data cells, 0 to 1")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, repeat=args.repeat, memory=not args.no_memory, paleo_tables=args.paleo_tables,
+                  chron_tables=args.chron_tables, columns=args.columns, ensemble_tables=args.ensemble_tables,
+                  ensemble_members=args.ensemble_members, string_columns=args.string_columns, missing=args.missing)
+    print(report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
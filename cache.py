@@ -0,0 +1,177 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from loggers import create_logger
+
+logger_cache = create_logger("cache")
+
+# Table types that carry CSV data, in a section's measurementTable list or in a model
+TABLE_KEYS = ["measurementTable", "summaryTable", "ensembleTable", "distributionTable"]
+
+
+class ByteLRU(object):
+    """
+    Least recently used cache, bounded by the total size of its values in bytes instead of by how many it holds.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param int max_bytes: Total size of the cached values before the least recently used ones are dropped
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a value, and mark it as recently used.
+
+        :param str key: Key
+        :return any: Cached value, or None on a miss
+        """
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size):
+        """
+        Add a value. Values larger than the whole cache are not kept.
+
+        :param str key: Key
+        :param any value: Value
+        :param int size: Size of the value in bytes
+        :return bool: True if the value was cached
+        """
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._data:
+                self._size -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _size) = self._data.popitem(last=False)
+                self._size -= _size
+        return True
+
+    def invalidate(self, key):
+        """
+        Remove one value.
+
+        :param str key: Key
+        :return bool: True if the key was cached
+        """
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._size -= self._data.pop(key)[1]
+            return True
+
+    def clear(self):
+        """
+        Remove every value. The hit and miss counters are kept.
+        :return int: Number of values removed
+        """
+        with self._lock:
+            _count = len(self._data)
+            self._data.clear()
+            self._size = 0
+        logger_cache.info("clear: removed %s entries", _count)
+        return _count
+
+    def stats(self):
+        """
+        :return dict: Hit and miss counts, and the cache's current and maximum size
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._data),
+                    "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+def _canonical(x):
+    """
+    Serialize data the same way every time, no matter the key order it arrived in.
+    """
+    return json.dumps(x, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _table_md5s(metadata):
+    """
+    Collect the data MD5 of every table that has one, keyed by the table's CSV filename. LiPD tables carry it as
+    "dataMD5" on the table, or as "tableMD5" on each of its columns.
+
+    :param dict metadata: Metadata, indexed by number
+    :return dict: {filename: MD5}
+    """
+    md5s = {}
+
+    def _tables(tables):
+        for table in tables or []:
+            if not isinstance(table, dict) or "filename" not in table:
+                continue
+            _md5 = table.get("dataMD5")
+            if not _md5:
+                for column in table.get("columns") or []:
+                    if isinstance(column, dict) and column.get("tableMD5"):
+                        _md5 = column["tableMD5"]
+                        break
+            if _md5:
+                md5s[table["filename"]] = _md5
+
+    for pc in ["paleoData", "chronData"]:
+        for section in metadata.get(pc) or []:
+            if not isinstance(section, dict):
+                continue
+            _tables(section.get("measurementTable"))
+            for model in section.get("model") or []:
+                if isinstance(model, dict):
+                    for key in TABLE_KEYS[1:]:
+                        _tables(model.get(key))
+    return md5s
+
+
+def conversion_key(metadata, csvs, project, version):
+    """
+    Content address for a conversion. The metadata is hashed in a canonical form, and carries the dataset's own MD5
+    fields. The CSV data is covered by the table MD5s when every CSV file has one, and by a hash of the CSV data itself
+    when any are missing.
+
+    :param dict metadata: Metadata, indexed by number. Must be hashed before the conversion modifies it.
+    :param dict csvs: CSV data, keyed by table filename
+    :param str project: Project Name
+    :param str version: Project version
+    :return str: Key
+    """
+    _hash = hashlib.sha256()
+    _hash.update(_canonical([project, version]))
+    _hash.update(_canonical(metadata))
+    md5s = _table_md5s(metadata)
+    if csvs and all(filename in md5s for filename in csvs):
+        _hash.update(b"md5:")
+        _hash.update(_canonical(sorted(md5s[filename] for filename in csvs)))
+    else:
+        _hash.update(b"csvs:")
+        _hash.update(_canonical(csvs))
+    return _hash.hexdigest()
+
+
+def result_size(out):
+    """
+    Approximate size of a conversion result in bytes: the length of its filenames and NOAA texts.
+
+    :param list out: One {filename: NOAA text} entry per output file
+    :return int: Size in bytes
+    """
+    return sum(len(k) + len(v) for entry in out for k, v in entry.items())
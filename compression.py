@@ -0,0 +1,181 @@
+import zlib
+from functools import wraps
+
+from flask import request, make_response
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+from loggers import create_logger
+
+logger_compression = create_logger("compression")
+
+# zstd is used when the zstandard package is installed. gzip is always available.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_DECOMPRESS_ERRORS = (zlib.error, ValueError) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Read the request body this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+# Responses smaller than this aren't worth compressing
+MIN_SIZE = 1024
+# Largest decompressed request body accepted, so a small compressed body can't expand without limit
+MAX_BODY_SIZE = 512 * 1024 * 1024
+
+
+def _decompressed(stream, encoding):
+    """
+    Read a compressed stream, one piece of at most CHUNK_SIZE decompressed bytes at a time. However much a chunk of
+    the body expands, only one piece of it is ever held here.
+
+    :param file stream: Compressed body
+    :param str encoding: Content-Encoding of the body
+    :return generator: Decompressed pieces
+    """
+    if encoding == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(stream)
+        while True:
+            part = reader.read(CHUNK_SIZE)
+            if not part:
+                return
+            yield part
+
+    _decomp = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding in ("gzip", "x-gzip") else zlib.MAX_WBITS)
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        # Whatever doesn't fit in the piece is left in unconsumed_tail for the next one
+        while data:
+            part = _decomp.decompress(data, CHUNK_SIZE)
+            if part:
+                yield part
+            data = _decomp.unconsumed_tail
+    part = _decomp.flush()
+    if part:
+        yield part
+
+
+def _chunks(stream):
+    """
+    Read an uncompressed stream, one chunk at a time.
+
+    :param file stream: Body
+    :return generator: Chunks
+    """
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_body(req, max_size=MAX_BODY_SIZE):
+    """
+    Read a request body, decompressing it on the way in if it has a Content-Encoding. The body is read, and
+    decompressed, one piece at a time, and counted as it goes, so a body with no Content-Length, like a chunked upload,
+    or a small compressed body that expands to far more, is held to max_size too.
+
+    :param Request req: Flask request
+    :param int max_size: Largest decompressed body to accept
+    :return bytes: Request body
+    """
+    encoding = (req.content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        if req.content_length and req.content_length > max_size:
+            raise RequestEntityTooLarge("Body is larger than {} bytes".format(max_size))
+        pieces = _chunks(req.stream)
+    elif encoding in ("gzip", "x-gzip", "deflate") or (encoding == "zstd" and zstandard):
+        pieces = _decompressed(req.stream, encoding)
+    else:
+        raise UnsupportedMediaType("Unsupported Content-Encoding: {}".format(encoding))
+
+    parts = []
+    _size = 0
+    try:
+        for part in pieces:
+            _size += len(part)
+            if _size > max_size:
+                raise RequestEntityTooLarge("{} is larger than {} bytes".format(
+                    "Body" if encoding == "identity" else "Decompressed body", max_size))
+            parts.append(part)
+    except _DECOMPRESS_ERRORS as e:
+        raise BadRequest("Could not decompress {} body: {}".format(encoding, e))
+    if encoding != "identity":
+        logger_compression.info("read_body: %s body decompressed to %s bytes", encoding, _size)
+    return b"".join(parts)
+
+
+def negotiate(accept_encodings):
+    """
+    Pick the response encoding from the client's Accept-Encoding header. zstd is preferred over gzip.
+
+    :param Accept accept_encodings: request.accept_encodings
+    :return str: "zstd", "gzip", or None for no compression
+    """
+    _offered = ["zstd", "gzip"] if zstandard else ["gzip"]
+    return accept_encodings.best_match(_offered)
+
+
+def _compress_chunks(chunks, encoding):
+    """
+    Compress an iterable of response chunks. Each chunk is flushed as it is compressed, so a streamed response keeps
+    streaming, and the uncompressed body is never held as a whole.
+
+    :param iterable chunks: Response body chunks
+    :param str encoding: "zstd" or "gzip"
+    :return generator: Compressed chunks
+    """
+    if encoding == "zstd":
+        _comp = zstandard.ZstdCompressor(level=3).compressobj()
+        _sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        _comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        _sync = zlib.Z_SYNC_FLUSH
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield _comp.compress(chunk) + _comp.flush(_sync)
+        yield _comp.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response, req):
+    """
+    Compress a response for the client, if it accepts a compressed encoding.
+
+    :param Response response: Flask response
+    :param Request req: Flask request
+    :return Response: The same response, with its body compressed when possible
+    """
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or "Content-Encoding" in response.headers or response.status_code < 200 \
+            or response.status_code in (204, 304):
+        return response
+    # Small bodies of a known size aren't worth it. Streamed bodies have no known size, and are always compressed.
+    if not response.is_streamed and (response.content_length or 0) < MIN_SIZE:
+        return response
+    encoding = negotiate(req.accept_encodings)
+    if not encoding:
+        return response
+
+    response.response = _compress_chunks(response.iter_encoded(), encoding)
+    response.headers["Content-Encoding"] = encoding
+    response.headers.pop("Content-Length", None)
+    return response
+
+
+def compressed(fn):
+    """
+    Route decorator. Compress the route's responses when the client accepts it.
+
+    :param callable fn: Flask view function
+    :return callable: Wrapped view function
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return compress_response(make_response(fn(*args, **kwargs)), request)
+    return wrapper
@@ -0,0 +1,257 @@
+import re
+
+from misc import get_dsn, get_appended_name
+from lpd_noaa import LPD_NOAA
+from jsons import idx_num_to_name
+from csvs import merge_csv_metadata
+from cache import conversion_key, result_size
+from workers import ConversionPoolFull, TIMEOUT_ERRORS
+from loggers import create_logger, benchmark
+
+logger_convert = create_logger("convert")
+
+# Conversion stages, in the order they run. Reported to the progress callback as each one starts.
+STAGES = ["idx_num_to_name", "merge_csv_metadata", "lpd_to_noaa"]
+
+
+def convert_lipd(metadata, csvs, project="project", version="1.0.0", progress=None, pool=None, cache=None):
+    """
+    Run the full LiPD to NOAA conversion for one dataset.
+
+    :param dict metadata: Metadata, indexed by number (as sent from the LiPD playground)
+    :param dict csvs: CSV data, keyed by table filename
+    :param str project: Project Name
+    :param str version: Project version
+    :param callable progress: Optional, called with the stage name as each stage starts
+    :param ConversionPool pool: Optional, run the whole conversion in one of the pool's worker processes
+    :param ByteLRU cache: Optional, reuse the result of an earlier conversion of the same data
+    :return list: One {filename: NOAA text} entry per output file
+    """
+    if cache is not None:
+        key = conversion_key(metadata, csvs, project, version)
+        out = cache.get(key)
+        if out is not None:
+            logger_convert.info("convert_lipd: Cache hit: %s", key)
+            _report(progress, "cache")
+            return out
+        out = convert_lipd(metadata, csvs, project, version, progress, pool)
+        # A dataset that gave no files is worth trying again, with a fixed converter
+        if out:
+            cache.put(key, out, result_size(out))
+        return out
+
+    if pool:
+        # The stages run in another process, so only the hand-off to the pool can be reported.
+        _report(progress, "conversion_pool")
+        return pool.run(convert_lipd, metadata, csvs, project, version)
+
+    out = []
+    logger_convert.info("convert_lipd: Start idx_num_to_name")
+    _report(progress, "idx_num_to_name")
+    _json = idx_num_to_name(metadata)
+    logger_convert.info("convert_lipd: Start merge_csv_metadata")
+    _report(progress, "merge_csv_metadata")
+    _json = merge_csv_metadata(_json, csvs)
+    logger_convert.info("convert_lipd: Start converting LiPD data to NOAA text")
+    _report(progress, "lpd_to_noaa")
+    noaas = lpd_to_noaa(_json, project, version)
+    for k, v in noaas.items():
+        out.append({k: v})
+    logger_convert.info("convert_lipd: NOAA files created: %s", len(out))
+    return out
+
+
+def convert_batch(records, project="project", version="1.0.0", pool=None, cache=None):
+    """
+    Convert many LiPD datasets. With a pool, the datasets are converted in parallel across its workers.
+
+    :param list records: One {"metadata": ..., "csvs": ...} record per dataset
+    :param str project: Project Name
+    :param str version: Project version
+    :param ConversionPool pool: Optional, spread the conversions over the pool's worker processes
+    :param ByteLRU cache: Optional, reuse the results of earlier conversions of the same data
+    :return dict: {"result": [...]} or {"error": "..."} for each dataset, keyed by dataSetName. An error from a full
+        pool or a conversion that timed out also has the HTTP "status" it maps to, 503 or 504.
+    """
+    out = {}
+    _names = []
+    _keys = []
+    _tasks = []
+    for idx, record in enumerate(records):
+        try:
+            dsn = get_dsn(record["metadata"]) if "dataSetName" in record["metadata"] else "dataset{}".format(idx)
+        except (KeyError, TypeError):
+            dsn = "dataset{}".format(idx)
+        # Two records with the same name shouldn't overwrite each other
+        if dsn in out or dsn in _names:
+            dsn = get_appended_name(dsn, set(out) | set(_names))
+        if not isinstance(record, dict) or not isinstance(record.get("metadata"), dict):
+            out[dsn] = {"error": 'Expected a {"metadata", "csvs"} record'}
+            continue
+        if not isinstance(record.get("csvs"), dict):
+            out[dsn] = {"error": "No CSV data provided"}
+            continue
+        if cache is not None:
+            key = conversion_key(record["metadata"], record["csvs"], project, version)
+            cached = cache.get(key)
+            if cached is not None:
+                out[dsn] = {"result": cached}
+                continue
+            _keys.append(key)
+        _names.append(dsn)
+        _tasks.append((record["metadata"], record["csvs"], project, version))
+
+    logger_convert.info("convert_batch: Converting %s datasets", len(_tasks))
+    if pool:
+        results = pool.run_many(convert_lipd, _tasks)
+    else:
+        results = []
+        for task in _tasks:
+            try:
+                results.append(convert_lipd(*task))
+            except Exception as e:
+                results.append(e)
+
+    for idx, (dsn, result) in enumerate(zip(_names, results)):
+        if isinstance(result, Exception):
+            logger_convert.error("convert_batch: %s: %s", dsn, result)
+            out[dsn] = {"error": "Exception found: {}".format(result)}
+            if isinstance(result, ConversionPoolFull):
+                out[dsn]["status"] = 503
+            elif isinstance(result, TIMEOUT_ERRORS):
+                out[dsn]["status"] = 504
+        else:
+            if cache is not None and result:
+                cache.put(_keys[idx], result, result_size(result))
+            out[dsn] = {"result": result}
+    logger_convert.info("convert_batch: Done, %s errors", sum(1 for v in out.values() if "error" in v))
+    return out
+
+
+def stream_lipd(metadata, csvs, project="project", version="1.0.0", cache=None):
+    """
+    Run the full LiPD to NOAA conversion for one dataset, yielding each NOAA text as soon as it is written.
+    Only one text is held in memory at a time.
+
+    :param dict metadata: Metadata, indexed by number (as sent from the LiPD playground)
+    :param dict csvs: CSV data, keyed by table filename
+    :param str project: Project Name
+    :param str version: Project version
+    :param ByteLRU cache: Optional, reuse the result of an earlier conversion of the same data
+    :return generator: {filename: NOAA text}, one per output file
+    """
+    _kept = None
+    if cache is not None:
+        key = conversion_key(metadata, csvs, project, version)
+        cached = cache.get(key)
+        if cached is not None:
+            logger_convert.info("stream_lipd: Cache hit: %s", key)
+            for entry in cached:
+                yield entry
+            return
+        # Keep the texts for the cache, unless they turn out too big for it
+        _kept = []
+        _kept_size = 0
+
+    logger_convert.info("stream_lipd: Start idx_num_to_name")
+    _json = idx_num_to_name(metadata)
+    logger_convert.info("stream_lipd: Start merge_csv_metadata")
+    _json = merge_csv_metadata(_json, csvs)
+    logger_convert.info("stream_lipd: Start streaming NOAA texts")
+    _count = 0
+    for filename, text in _lpd_noaa(_json, project, version).stream():
+        _count += 1
+        if _kept is not None:
+            _kept_size += len(filename) + len(text)
+            if _kept_size <= cache.max_bytes:
+                _kept.append({filename: text})
+            else:
+                _kept = None
+        yield {filename: text}
+    if _kept:
+        cache.put(key, _kept, _kept_size)
+    logger_convert.info("stream_lipd: NOAA files streamed: %s", _count)
+    return
+
+
+def lpd_to_noaa(D, project, version, path="", pool=None):
+    """
+    Convert a LiPD format to NOAA format
+
+    :param dict D: Metadata
+    :param str project: Project Name
+    :param float version: Project version
+    :param ConversionPool pool: Optional, run the conversion in one of the pool's worker processes
+    :return dict D: Metadata
+    """
+    if pool:
+        return pool.run(lpd_to_noaa, D, project, version, path)
+
+    try:
+        with benchmark("lpd_to_noaa"):
+            _convert_obj = _lpd_noaa(D, project, version, path)
+            logger_convert.info("lpd_noaa: Run conversion main()")
+            _convert_obj.main()
+            # get our new, modified master JSON from the conversion object
+            # d = _convert_obj.get_master()
+            logger_convert.info("lpd_noaa: Retrieve NOAA texts from conversion object")
+            noaas = _convert_obj.get_noaa_texts()
+            # remove any root level urls that are deprecated
+            # d = __rm_wdc_url(d)
+    except Exception as e:
+        # Let the caller report it. An empty result would look like a dataset with nothing to convert.
+        logger_convert.error("lpd_to_noaa: %s", e)
+        raise
+
+    logger_convert.info("lpd_noaa: Exiting lpd_noaa")
+    return noaas
+
+
+def _lpd_noaa(D, project, version, path=""):
+    """
+    Create the conversion object for a dataset.
+
+    :param dict D: Metadata
+    :param str project: Project Name
+    :param str version: Project version
+    :return LPD_NOAA: Conversion object
+    """
+    logger_convert.info("lpd_noaa: Get DSN")
+    dsn = get_dsn(D)
+    # Remove all the characters that are not allowed here. Since we're making URLs, they have to be compliant.
+    logger_convert.info("lpd_noaa: Cleanup dsn, project, version with regexes")
+    dsn = re.sub(r'[^A-Za-z-.0-9]', '', dsn)
+    project = re.sub(r'[^A-Za-z-.0-9]', '', project)
+    version = re.sub(r'[^A-Za-z-.0-9]', '', version)
+    # Create the conversion object, and start the conversion process
+    logger_convert.info("lpd_noaa: Create conversion object")
+    return LPD_NOAA(D, dsn, project, version, path)
+
+
+def _report(progress, stage):
+    """
+    Pass the stage name to the progress callback, if one was given. A failing callback never stops a conversion.
+
+    :param callable progress: Progress callback
+    :param str stage: Stage name
+    :return none:
+    """
+    if progress:
+        try:
+            progress(stage)
+        except Exception as e:
+            logger_convert.warning("report: progress callback failed: %s", e)
+    return
+
+
+def __rm_wdc_url(d):
+    """
+    Remove the WDCPaleoUrl key. It's no longer used but still exists in some files.
+    :param dict d: Metadata
+    :return dict d: Metadata
+    """
+    if "WDCPaleoUrl" in d:
+        del d["WDCPaleoUrl"]
+    if "WDSPaleoUrl" in d:
+        del d["WDSPaleoUrl"]
+    return d
@@ -1,6 +1,6 @@
 from inferred_data import get_inferred_data_table
 from misc import cast_int, get_missing_value_key, _replace_missing_values_table, rm_missing_values_table, is_ensemble
-from loggers import create_logger
+from loggers import create_logger, benchmark
 import math
 
 logger_csvs = create_logger("csvs")
@@ -9,6 +9,7 @@ logger_csvs = create_logger("csvs")
 # MERGE - CSV w/ Metadata
 
 
+@benchmark("merge_csv_metadata")
 def merge_csv_metadata(d, csvs):
     """
     Using the given metadata dictionary, retrieve CSV data from CSV files, and insert the CSV
@@ -51,7 +52,6 @@ def _merge_csv_section(sections, pc, csvs):
                 sections[_name]["model"] = _merge_csv_model(_section["model"], pc, csvs)
 
     except Exception as e:
-        print("Error: There was an error merging CSV data into the metadata ")
         logger_csvs.error("merge_csv_section: {}".format(e))
 
     logger_csvs.info("exit merge_csv_section")
@@ -132,7 +132,6 @@ def _merge_csv_table(tables, pc, csvs):
 
             tables[_name] = _table
     except Exception as e:
-        print("Error: merge_csv_table: {}, {}".format(pc, e))
         logger_csvs.error("merge_csv_table: {}, {}".format(pc, e))
     logger_csvs.info("exit merge tables")
     return tables
@@ -182,7 +181,6 @@ def _merge_csv_column(table, csvs):
         logger_csvs.error("merge_csv_column: KeyError: missing columns key")
     except Exception as e:
         logger_csvs.error("merge_csv_column: Unknown Error:  {}".format(e))
-        print("Quitting...")
         exit(1)
 
     # We want to keep one missing value ONLY at the table level. Remove MVs if they're still in column-level
@@ -222,7 +220,6 @@ def _get_filename(table):
         filename = table["filename"]
     except KeyError:
         logger_csvs.info("get_filename: KeyError: missing filename for a table")
-        print("Error: Missing filename for a table")
         filename = ""
     except Exception as e:
         logger_csvs.error("get_filename: {}".format(e))
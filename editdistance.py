@@ -0,0 +1,207 @@
+import numpy as np
+
+
+def _match_masks(pattern):
+    '''
+    Bit masks of where each character is in a pattern: bit i of masks[c] is set when pattern[i] == c.
+
+    '''
+    masks = {}
+    for i, c in enumerate(pattern):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+
+def levenshtein(a, b, max_distance=None):
+    '''
+    Edit distance between two strings: the fewest single character insertions, deletions and substitutions that turn
+    one into the other. Uses Myers' bit-parallel algorithm, as given by Hyyrö for edit distance: a column of the
+    table is kept as the bits of two integers, so each character of b costs a handful of integer operations instead
+    of a loop over a.
+
+    With max_distance, it gives up as soon as the distance can only be larger, and returns max_distance + 1.
+
+    Parameters
+    ----------
+    a : string
+        String 1.
+    b : string
+        String 2.
+    max_distance : int, optional
+        Largest distance the caller cares about.
+
+    Returns
+    -------
+    int
+        Edit distance, or max_distance + 1 when it is larger than max_distance.
+
+    '''
+    m, n = len(a), len(b)
+    if max_distance is not None and abs(m - n) > max_distance:
+        return max_distance + 1
+    if not m or not n:
+        return m or n
+    masks = _match_masks(a)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for j, c in enumerate(b):
+        eq = masks.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # Each character left of b can take the distance down by one at most
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return max_distance + 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+
+class StringArray(object):
+    '''
+    Strings kept ready to be compared to one query at a time, all together. The same bit-parallel algorithm as
+    levenshtein(), run with numpy over every string of the array at once: one step per character position instead of
+    one per character of every string.
+
+    The strings are sorted by length and stored a character position per row, so the strings still going at position
+    j are always the first ones of row j, and a distance bound only has to look at the strings of the lengths it
+    allows.
+
+    '''
+
+    # Queries longer than this don't fit in the bits of a uint64, and are compared with levenshtein() one at a time
+    MAX_QUERY = 64
+
+    def __init__(self, strings):
+        '''
+        Parameters
+        ----------
+        strings : list
+            Strings to compare queries to.
+
+        '''
+        self.strings = list(strings)
+        lengths = np.array([len(s) for s in self.strings], dtype=np.int64)
+        # Longest first
+        self._order = np.argsort(-lengths, kind="stable")
+        self._lengths = lengths[self._order]
+        self._alphabet = {c: i for i, c in enumerate(sorted(set("".join(self.strings))), 1)}
+        width = int(self._lengths[0]) if len(self.strings) else 0
+        # codes[j, k]: the character at position j of the k-th longest string, 0 past its end
+        self._codes = np.zeros((width, len(self.strings)), dtype=np.int32)
+        for k, i in enumerate(self._order):
+            s = self.strings[i]
+            if s:
+                self._codes[:len(s), k] = [self._alphabet[c] for c in s]
+        # live[j]: strings longer than j
+        self._live = np.searchsorted(-self._lengths, -np.arange(width), side="left")
+
+    def __len__(self):
+        return len(self.strings)
+
+    def distances(self, query, max_distance=None):
+        '''
+        Edit distance from a query to every string of the array.
+
+        Parameters
+        ----------
+        query : string
+            String to compare the array to.
+        max_distance : int, optional
+            Largest distance the caller cares about. The strings further away than that get max_distance + 1, and the
+            ones whose length alone puts them further away aren't compared at all.
+
+        Returns
+        -------
+        numpy.ndarray
+            Distances, in the order of the strings.
+
+        '''
+        n = len(self.strings)
+        # Without a bound every string is compared, and nothing is capped
+        cap = None if max_distance is None else max_distance + 1
+        out = np.full(n, -1 if cap is None else cap, dtype=np.int64)
+        if not n:
+            return out
+        if len(query) > self.MAX_QUERY:
+            for i, s in enumerate(self.strings):
+                out[i] = levenshtein(query, s, max_distance)
+            return out
+
+        m = len(query)
+        # The strings of allowed lengths are a run of the ones sorted longest first
+        if max_distance is None:
+            lo, hi = 0, n
+        else:
+            lo = int(np.searchsorted(-self._lengths, -(m + max_distance), side="left"))
+            hi = int(np.searchsorted(-self._lengths, -(m - max_distance), side="right"))
+        if lo >= hi:
+            return out
+        if not m:
+            lengths = self._lengths[lo:hi]
+            out[self._order[lo:hi]] = lengths if cap is None else np.minimum(lengths, cap)
+            return out
+
+        table = np.zeros(len(self._alphabet) + 1, dtype=np.uint64)
+        for c, bits in _match_masks(query).items():
+            if c in self._alphabet:
+                table[self._alphabet[c]] = bits
+        last = np.uint64(1 << (m - 1))
+        one = np.uint64(1)
+        count = hi - lo
+        pv = np.full(count, (1 << m) - 1, dtype=np.uint64)
+        mv = np.zeros(count, dtype=np.uint64)
+        score = np.full(count, m, dtype=np.int64)
+        # The bits above the query's length fill up with garbage, but carries and shifts only ever move up, so it
+        # never reaches the bits below
+        for j in range(int(self._lengths[lo])):
+            live = min(int(self._live[j]), hi) - lo
+            if live <= 0:
+                break
+            eq = table[self._codes[j, lo:lo + live]]
+            p, v = pv[:live], mv[:live]
+            xv = eq | v
+            xh = (((eq & p) + p) ^ p) | eq
+            ph = v | ~(xh | p)
+            mh = p & xh
+            score[:live] += (ph & last).astype(bool)
+            score[:live] -= (mh & last).astype(bool)
+            ph = (ph << one) | one
+            mh = mh << one
+            pv[:live] = mh | ~(xv | ph)
+            mv[:live] = ph & xv
+        if max_distance is not None:
+            np.minimum(score, cap, out=score)
+        out[self._order[lo:hi]] = score
+        return out
+
+
+def levenshtein_many(query, strings, max_distance=None):
+    '''
+    Edit distance from a query to each of many strings, compared all at once. Build a StringArray instead to compare
+    the same strings to many queries.
+
+    Parameters
+    ----------
+    query : string
+        String to compare to.
+    strings : list
+        Strings to compare query to.
+    max_distance : int, optional
+        Largest distance the caller cares about.
+
+    Returns
+    -------
+    list
+        Distances, in the order of strings. max_distance + 1 for the ones further away than max_distance.
+
+    '''
+    return StringArray(strings).distances(query, max_distance).tolist()
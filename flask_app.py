@@ -1,41 +1,158 @@
 # A very simple Flask Hello World app for you to get started with...
 
-from flask import Flask, request
-from flask import make_response, jsonify
+from flask import Flask, Blueprint, request, current_app, g
+from flask import Response, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import re
-from misc import get_dsn
-import json
-from lpd_noaa import LPD_NOAA
-from jsons import idx_num_to_name
-from csvs import merge_csv_metadata
-from loggers import create_logger
+from convert import convert_lipd, convert_batch, stream_lipd
+from compression import compressed
+from serializers import decode_request, encode_response, dumps, negotiate, NUMPY_NATIVE
+import inferred_data
+from jobs import JobStore, JobManager
+from cache import ByteLRU
+from workers import ConversionPool, ConversionPoolFull, TIMEOUT_ERRORS
+from models import ModelManager
+from autocomplete import VocabularyWatcher, SuggestionCache, rank, EXACT, PREFIX, FUZZY
+from metrics import REGISTRY, COUNTER, GAUGE
+from singleflight import SingleFlight
+from editdistance import levenshtein_many
+# Registers the "sqlite" rate limit storage
+import ratelimit
+from loggers import init_logging, create_logger, create_benchmark, start_trace, end_trace, current_trace
 from linkedearth import wiki_query
 
-from MCpredict import MCpredict
-from LSTMpredict import LSTMpredict
+import hashlib
+import hmac
 import os
-import glob
-from pydash import py_
+import re
+import threading
+import time
+from functools import partial, wraps
 
 
 logger_flask = create_logger("flask")
 
-app = Flask(__name__)
+# Endpoints of the conversion routes, which share the NOAA_RATE_LIMIT instead of having the default limits
+_noaa_endpoints = set()
+
+
+def _noaa_rate_limit():
+    return current_app.config["NOAA_RATE_LIMIT"]
+
+def _noaa_unlimited():
+    return not current_app.config["NOAA_RATE_LIMIT"]
+
+def _noaa_cost():
+    # One hit for every RATE_LIMIT_COST_BYTES of request body, or part of it, so big datasets use up more of the limit
+    return 1 + (request.content_length or 0) // current_app.config["RATE_LIMIT_COST_BYTES"]
+
+def _defaults_exempt():
+    # Without a NOAA_RATE_LIMIT the shared limit has no limits in it, and flask_limiter would fall back to the defaults
+    return request.endpoint in _noaa_endpoints and _noaa_unlimited()
+
+def _autocomplete_rate_limit():
+    return current_app.config["AUTOCOMPLETE_RATE_LIMIT"]
+
 limiter = Limiter(
-    app,
     key_func=get_remote_address,
-    default_limits=["5000 per day", "500 per hour"]
+    default_limits=["5000 per day", "500 per hour"],
+    default_limits_exempt_when=_defaults_exempt
 )
-flask_dir = "/home/cheiser/mysite/"
-model_mc_file_path=''
-pred3MC = MCpredict(3, 5, model_file_path=flask_dir, ground_truth_path=flask_dir)
-pred4MC = MCpredict(4, 5, model_file_path=flask_dir, ground_truth_path=flask_dir)
+api = Blueprint("api", __name__)
+
+# Shared by the conversion routes, so a client can't get around it by switching between them
+_noaa_shared_limit = limiter.shared_limit(_noaa_rate_limit, scope="noaa", cost=_noaa_cost,
+                                          exempt_when=_noaa_unlimited)
+
+
+def noaa_limit(fn):
+    '''
+    Put a conversion route under NOAA_RATE_LIMIT, in place of the default limits. Without one, the route has no limit
+    at all, as when the conversion routes were exempt.
+
+    '''
+    _noaa_endpoints.add("{}.{}".format(api.name, fn.__name__))
+    return _noaa_shared_limit(fn)
+
+
+# Settings for create_app(). Any of them can be overridden by the config passed in.
+DEFAULT_CONFIG = {
+    # Directory with the model, ground truth and autocomplete files
+    "FLASK_DIR": "/home/cheiser/mysite/",
+    # Load every prediction model when the app is created, instead of on the first request that needs it
+    "EAGER_MODELS": False,
+    # Load the prediction models and run sample predictions and lookups through them in the background when the app is
+    # created. /ready answers 503 until that is done. False for workers that only convert, which are ready straight away.
+    "WARM_UP": True,
+    # Seconds between checks for new model files in FLASK_DIR, which are then loaded and swapped in without a restart.
+    # 0 to only reload through POST /api/models/reload, which needs the ADMIN_TOKEN.
+    "MODEL_RELOAD_INTERVAL": 60,
+    # Seconds between checks for a new autocomplete file in FLASK_DIR
+    "AUTOCOMPLETE_RELOAD_INTERVAL": 5,
+    # Suggestions /autocomplete returns when it isn't given a limit, and the most it returns whatever the limit
+    "AUTOCOMPLETE_LIMIT": 20,
+    "AUTOCOMPLETE_MAX_LIMIT": 100,
+    # Total length of the /autocomplete results each fieldType works out ahead for its one and two character prefixes,
+    # whenever the autocomplete data or the models change, and again of the results it keeps for other queries. Only
+    # the best AUTOCOMPLETE_MAX_LIMIT results of a query are kept.
+    "AUTOCOMPLETE_CACHE_BYTES": 1024 * 1024,
+    # Worker processes for the LiPD to NOAA conversions. None for one per core, 0 to convert on the request thread.
+    "CONVERSION_POOL_SIZE": None,
+    "CONVERSION_QUEUE_DEPTH": 16,
+    "CONVERSION_TIMEOUT": 120,
+    # Seconds a client is told to wait, in a Retry-After header, before trying again when the conversion queue is full
+    "CONVERSION_RETRY_AFTER": 5,
+    # Finished NOAA conversions, keyed by the content of the LiPD data. Bounded by the size of the texts it holds.
+    "CONVERSION_CACHE_BYTES": 64 * 1024 * 1024,
+    # Largest request body accepted by /api/noaa/batch, after decompression
+    "BATCH_MAX_BYTES": 256 * 1024 * 1024,
+    # Background conversions for /api/noaa/jobs. Finished results are kept on disk for JOB_TTL seconds.
+    # Defaults to the "jobs" folder in FLASK_DIR.
+    "JOBS_DIR": None,
+    "JOB_TTL": 3600,
+    "JOB_WORKERS": 2,
+    # Each process writes its metrics to its own file here, and /metrics adds up every process's file.
+    # Defaults to the "metrics" folder in FLASK_DIR. Clear it when the service is restarted.
+    "METRICS_DIR": None,
+    # Send each request's stage timings back in a Server-Timing header
+    "SERVER_TIMING": True,
+    # Log file every module writes to, and the level of each, e.g. {"LPD_NOAA": "WARNING"} to quiet the conversion.
+    # Records are written from a background thread. The file is rolled over at LOG_MAX_BYTES.
+    "LOG_FILE": "debug.log",
+    "LOG_LEVEL": "DEBUG",
+    "LOG_LEVELS": {},
+    "LOG_MAX_BYTES": 1000000,
+    # Seconds browsers and caches may reuse a /getArchives, /predictNextValue or /autocomplete response without asking
+    # again. 0 to have them check with the ETag every time.
+    "HTTP_CACHE_MAX_AGE": 300,
+    # Production mode: every module only logs warnings and errors, whatever LOG_LEVEL is. LOG_LEVELS still applies.
+    "QUIET": False,
+    # File for a JSON line of stage timings per request. None to not write one.
+    "BENCHMARK_LOG": "benchmark.log",
+    # Where the rate limit counters are kept. None for a SQLite file in FLASK_DIR, shared by every worker process on
+    # the machine. "memory://" for each process to count on its own, or any storage URI flask_limiter supports.
+    "RATELIMIT_STORAGE_URI": None,
+    # Limit on the conversion routes, e.g. "200 per hour", in place of the default limits. Each request costs one hit
+    # for every RATE_LIMIT_COST_BYTES of its body. None for no limit.
+    "NOAA_RATE_LIMIT": None,
+    "RATE_LIMIT_COST_BYTES": 1024 * 1024,
+    # Limit on /autocomplete, on top of the default limits. The playground calls it on every keystroke, and its results
+    # are cached, so it is looser than the other routes.
+    "AUTOCOMPLETE_RATE_LIMIT": "20/second",
+    # Token the routes that change the service's state, like flushing the conversion cache, must be called with, as
+    # "Authorization: Bearer <token>". None to turn those routes off.
+    "ADMIN_TOKEN": None,
+}
+
+REGISTRY.register("lipdnet_conversion_cache_bytes", GAUGE, "Size of the NOAA texts held in the conversion caches.")
+REGISTRY.register("lipdnet_conversion_cache_entries", GAUGE, "Conversions held in the conversion caches.")
+REGISTRY.register("lipdnet_predictions_total", COUNTER, "Predictions asked for, by backend, and whether each one ran "
+                  "or shared the result of an identical one already running. The coalesce ratio is "
+                  "coalesced / (coalesced + computed).")
+REGISTRY.register("lipdnet_autocomplete_total", COUNTER, "Autocomplete lookups, by whether the results were worked "
+                  "out ahead, found in the cache, or computed.")
 
-predLSTM = LSTMpredict(model_file_path=flask_dir, ground_truth_file_path=flask_dir, topk=5)
 archives_for_MC = {}
-autocomplete_file_path = None
 
 time_map = {'age' : ['year BP', 'cal year BP','ky BP','my BP'],
     'year' : ['year CE','year AD']}
@@ -46,157 +163,615 @@ time_map = {'age' : ['year BP', 'cal year BP','ky BP','my BP'],
 # 'year' : ['AD','CE','year C.E.','year A.D.','years C.E.','years A.D.','yr CE','yr AD','yr C.E.','yr A.D.', 'yrs C.E.', 'yrs A.D.', 'yrs CE', 'yrs AD']
 # 'mage' : ['myr BP', 'myrs BP', 'ma BP', 'ma','my B.P.', 'myr B.P.', 'myrs B.P.', 'ma B.P.']
 
-def get_average_half_len_for_autocomplete():
-    """
-    names_set_dict from predict_object in LSTM contains the list of all the possible values for each fieldType
-    This method calculates half of the average length of value for each fieldType.
+names_set_ind_map = {'proxyObservationType' : 1, 'proxyObservationTypeUnits' : 2, 'interpretation/variable' : 3, 'interpretation/variableDetail' : 4, 'inferredVariable' : 5, 'inferredVariableUnits' : 6}
+
+
+class Services(object):
+    '''
+    Everything one app shares between its requests: the conversion pool, cache and job manager, the prediction models,
+    and the autocomplete data.
+
+    '''
 
-    Possible use case during autocomplete search, when a user enters half the characters for a fieldType,
-    we can use edit distance to get the most similar words to the provided word.
+    def __init__(self, config):
+        flask_dir = config["FLASK_DIR"]
+        self.flask_dir = flask_dir
+        self.batch_max_bytes = config["BATCH_MAX_BYTES"]
+        self.conversion_pool = None
+        if config["CONVERSION_POOL_SIZE"] != 0:
+            self.conversion_pool = ConversionPool(config["CONVERSION_POOL_SIZE"], config["CONVERSION_QUEUE_DEPTH"],
+                                                  config["CONVERSION_TIMEOUT"])
+        self.conversion_cache = ByteLRU(config["CONVERSION_CACHE_BYTES"])
+        jobs_dir = config["JOBS_DIR"] or os.path.join(flask_dir, "jobs")
+        self.job_manager = JobManager(JobStore(jobs_dir, ttl=config["JOB_TTL"]), max_workers=config["JOB_WORKERS"])
+        self.models = ModelManager(flask_dir, top_k=5, interval=config["MODEL_RELOAD_INTERVAL"])
+        self.autocomplete = VocabularyWatcher(flask_dir, interval=config["AUTOCOMPLETE_RELOAD_INTERVAL"])
+        # Autocomplete results of the live autocomplete data and models. Each version is only ever built once.
+        self.suggestions = None
+        self.suggestion_cache_bytes = config["AUTOCOMPLETE_CACHE_BYTES"]
+        self.suggestion_cache_depth = config["AUTOCOMPLETE_MAX_LIMIT"]
+        self._suggestions_started = set()
+        self._suggestions_lock = threading.Lock()
+        # Identical predictions asked for at the same time are only run once
+        self.predictions = SingleFlight()
+        # Set once the app has warmed up, or straight away if it doesn't
+        self.ready = threading.Event()
+        self.warm_up_report = None
+        self.server_timing = config["SERVER_TIMING"]
+        self.benchmark_log = None
+        if config["BENCHMARK_LOG"]:
+            self.benchmark_log = create_benchmark("benchmark", config["BENCHMARK_LOG"])
+
+
+def create_app(config=None):
+    '''
+    Create the Flask app. The prediction models are loaded on first use unless EAGER_MODELS is set, so a worker that
+    only serves conversions starts fast and stays small. Importing this module doesn't create one: the WSGI server
+    serves wsgi:app, and `flask --app flask_app:create_app run` runs one locally.
+
+    Parameters
+    ----------
+    config : dict
+        Overrides for DEFAULT_CONFIG, or any other Flask config.
 
     Returns
     -------
-    avg_half_len_map : dict
-        Stores the average half length for each fieldType.
+    app : Flask
+        The app.
+
+    '''
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+    init_logging(app.config["LOG_FILE"], "WARNING" if app.config["QUIET"] else app.config["LOG_LEVEL"],
+                 app.config["LOG_LEVELS"], max_bytes=app.config["LOG_MAX_BYTES"])
+
+    # The response codec writes numpy types as-is, so the conversions can skip their pass that turns them into python
+    # types. Set before the conversion workers fork, so they pick it up too.
+    inferred_data.FIX_NUMERIC_TYPES = not NUMPY_NATIVE
+
+    # Before the conversion workers fork, so they write their stage timings to the same place
+    REGISTRY.configure(app.config["METRICS_DIR"] or os.path.join(app.config["FLASK_DIR"], "metrics"))
+    services = Services(app.config)
+
+    def _cache_gauges():
+        stats = services.conversion_cache.stats()
+        REGISTRY.set("lipdnet_conversion_cache_bytes", stats["bytes"])
+        REGISTRY.set("lipdnet_conversion_cache_entries", stats["entries"])
+    REGISTRY.add_collector(_cache_gauges)
+
+    # Fork the conversion workers before any model is loaded, so they stay small
+    if services.conversion_pool:
+        services.conversion_pool.start()
+    if app.config["EAGER_MODELS"]:
+        services.models.current().load_all()
+    services.models.start()
+    services.autocomplete.start()
+    if app.config["WARM_UP"]:
+        threading.Thread(target=warm_up, args=(services,), name="warm-up", daemon=True).start()
+    else:
+        services.ready.set()
+    app.extensions["lipdnet"] = services
+
+    if not app.config["RATELIMIT_STORAGE_URI"]:
+        app.config["RATELIMIT_STORAGE_URI"] = "sqlite://" + os.path.join(app.config["FLASK_DIR"], "ratelimit.db")
+    limiter.init_app(app)
+    app.register_blueprint(api)
+    logger_flask.info("create_app: models %s", "loaded" if app.config["EAGER_MODELS"] else "load on first use")
+    return app
+
 
-    """
-    avg_half_len_map = {}
-    for key, in_set in predLSTM.names_set.items():
-        sum_len_set = sum([len(word) for word in in_set])
-        avg_half_len_map[key] = sum_len_set//(len(in_set) * 2)
-    return avg_half_len_map
+def _services():
+    return current_app.extensions["lipdnet"]
 
-avg_half_len_map = get_average_half_len_for_autocomplete()
 
-def get_latest_file_with_path(path, *paths):
+def warm_up(services):
     '''
-    Method to get the full path name for the latest file for the input parameter in paths.
-    This method uses the os.path.getctime function to get the most recently created file that matches the filename pattern in the provided path.
+    Run sample predictions through every model, and sample lookups through the autocomplete data, then mark the app
+    ready. If a model fails to load, the app is never marked ready.
 
     Parameters
     ----------
-    path : string
-        Root pathname for the files.
-    *paths : string list
-        These are the var args field, the optional set of strings to denote the full path to the file names.
+    services : Services
+        The app's services.
 
     Returns
     -------
-    latest_file : string
-        Full path name for the latest file provided in the paths parameter.
+    None.
 
     '''
-    fullpath = os.path.join(path, *paths)
-    list_of_files = glob.iglob(fullpath)
-    if not list_of_files:
-        return None
-    latest_file = max(list_of_files, key=os.path.getctime)
-    return latest_file
-
-ground_truth_file = get_latest_file_with_path(flask_dir, 'ground_truth_label_*.json')
-with open(ground_truth_file, 'r') as json_file:
-    ground_truth_dict = json.load(json_file)
-
-archives_map = ground_truth_dict['archives_map']
-names_set_ind_map = {'proxyObservationType' : 1, 'proxyObservationTypeUnits' : 2, 'interpretation/variable' : 3, 'interpretation/variableDetail' : 4, 'inferredVariable' : 5, 'inferredVariableUnits' : 6}
+    try:
+        models = services.models.current()
+        report = dict(models.warm_up())
+        start = time.time()
+        vocabulary = services.autocomplete.current()
+        for fieldType in names_set_ind_map:
+            for word in vocabulary.words(fieldType)[:1]:
+                # A short prefix, and a full word, long enough for the fuzzy matching to run
+                suggest(vocabulary, models, fieldType, word[:1])
+                suggest(vocabulary, models, fieldType, word)
+        build_suggestions(services, vocabulary, models)
+        report['autocomplete_seconds'] = round(time.time() - start, 3)
+        services.warm_up_report = report
+        services.ready.set()
+        logger_flask.info("warm_up: ready")
+    except Exception as e:
+        services.warm_up_report = {'error': str(e)}
+        logger_flask.error("warm_up: %s", e)
+    return
 
-names_set = {}
 
-def load_names_set_from_file(file_name):
+def build_suggestions(services, vocabulary, models):
     '''
-    Method to load the dict containing the list of all possible values for each fieldType, used for autocomplete suggestions.
+    Build the SuggestionCache of a version of the autocomplete data and the models, and swap it in. Does nothing if
+    that version was built before, or is being built. One that failed is not tried again.
 
     Parameters
     ----------
-    file_name : string
-        File containing the data for autocomplete suggestions.
+    services : Services
+        The app's services.
+    vocabulary : Vocabulary
+        Version of the autocomplete data.
+    models : Predictors
+        Version of the models.
 
     Returns
     -------
     None.
 
     '''
-    global names_set
-    with open(file_name, 'r', encoding='utf-8') as autocomplete_file_:
-        names_set = json.load(autocomplete_file_)
+    version = suggestions_version(vocabulary, models)
+    with services._suggestions_lock:
+        if version in services._suggestions_started:
+            return
+        services._suggestions_started.add(version)
+    try:
+        start = time.time()
+        services.suggestions = SuggestionCache(version, vocabulary, partial(suggest, vocabulary, models),
+                                               services.suggestion_cache_bytes, services.suggestion_cache_depth)
+        logger_flask.info("build_suggestions: %s built in %.2f seconds", version, time.time() - start)
+    except Exception as e:
+        logger_flask.error("build_suggestions: %s: %s", version, e)
+    return
+
 
-@app.route('/test', methods=["GET"])
+def suggestions_version(vocabulary, models):
+    # The fuzzy matching and the ranking depend on the ground truth labels too
+    return '{}.{}'.format(models.version, vocabulary.version)
+
+
+def _suggestions():
+    '''
+    The SuggestionCache of the versions of the autocomplete data and the models this request uses. When they are
+    new, it is built in the background, and None is returned until it is ready.
+
+    '''
+    services = _services()
+    cache = services.suggestions
+    if cache is not None and cache.version == _autocomplete_version():
+        return cache
+    if _autocomplete_version() not in services._suggestions_started:
+        threading.Thread(target=build_suggestions, args=(services, _vocabulary(), _models()),
+                         name="autocomplete-cache", daemon=True).start()
+    return None
+
+
+def _models():
+    '''
+    The version of the prediction models this request uses. Taken on first use and kept for the whole request, even if
+    a new version is swapped in part way through.
+
+    '''
+    if 'models' not in g:
+        g.models = _services().models.current()
+    return g.models
+
+
+def _vocabulary():
+    '''
+    The version of the autocomplete data this request uses, taken the same way as _models().
+
+    '''
+    if 'vocabulary' not in g:
+        g.vocabulary = _services().autocomplete.current()
+    return g.vocabulary
+
+
+def _models_version():
+    return _models().version
+
+
+def _autocomplete_version():
+    return suggestions_version(_vocabulary(), _models())
+
+
+def conditional(version):
+    '''
+    Give the responses of a GET route a strong ETag and a Cache-Control header. A request whose If-None-Match has the
+    ETag already gets a 304 back, without the route running at all. Only for routes whose response is decided by the
+    query string, the Accept header and the version of the data they serve.
+
+    Parameters
+    ----------
+    version : callable
+        Returns the version of the data the route serves. Its ETags change when this does.
+
+    '''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            _hash = hashlib.sha1(repr((version(), request.path, sorted(request.args.items(multi=True)),
+                                       negotiate(request))).encode('utf-8'))
+            etag = _hash.hexdigest()[:20]
+            if request.if_none_match and (request.if_none_match.star_tag or request.if_none_match.contains_weak(etag)):
+                response = Response(status=304)
+            else:
+                response = fn(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            max_age = current_app.config["HTTP_CACHE_MAX_AGE"]
+            response.cache_control.public = True
+            if max_age:
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def admin_only(*methods):
+    '''
+    Only let a route run for a request carrying ADMIN_TOKEN. Any other request gets a 403, and every request does when
+    ADMIN_TOKEN isn't set.
+
+    Parameters
+    ----------
+    methods : string
+        Only check requests with these methods. All of them when none are given.
+
+    '''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not methods or request.method in methods:
+                token = current_app.config["ADMIN_TOKEN"]
+                if not token:
+                    return encode_response({'error': 'Admin routes are turned off'}, request, 403)
+                given = request.headers.get('Authorization', '')
+                if not hmac.compare_digest(given.encode('utf-8'), 'Bearer {}'.format(token).encode('utf-8')):
+                    return encode_response({'error': 'Admin token required'}, request, 403)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@api.before_request
+def _request_start():
+    g.request_start = time.perf_counter()
+    start_trace()
+
+@api.teardown_request
+def _request_end(e=None):
+    end_trace()
+
+@api.after_request
+def _request_timing(response):
+    '''
+    Report the time spent in each stage of the request: in a Server-Timing header, and as one JSON line in the
+    benchmark log. Stages that ran more than once, like one per table, are added up.
+
+    '''
+    trace = current_trace()
+    if trace is None:
+        return response
+    services = _services()
+    if services.server_timing:
+        timings = ['{};dur={:.2f};desc="{} calls"'.format(re.sub(r'[^A-Za-z0-9_.\-]', '_', name), seconds * 1000, calls)
+                   for name, (seconds, calls) in trace.summary().items()]
+        timings.append('total;dur={:.2f}'.format((time.perf_counter() - trace.start) * 1000))
+        response.headers.add('Server-Timing', ', '.join(timings))
+    if services.benchmark_log:
+        record = trace.to_dict()
+        record.update({'route': request.url_rule.rule if request.url_rule else None, 'method': request.method,
+                       'status': response.status_code})
+        services.benchmark_log.info(dumps(record).decode('utf-8'))
+    return response
+
+@api.after_request
+def _request_metrics(response):
+    '''
+    Count the request, and record its latency and body size, labelled with the route it matched.
+
+    '''
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REGISTRY.inc("lipdnet_requests_total", route=route, method=request.method, status=response.status_code)
+    # Not set when the request was refused before it reached the route, e.g. by the rate limiter
+    if "request_start" in g:
+        REGISTRY.observe("lipdnet_request_seconds", time.perf_counter() - g.request_start, route=route)
+    if request.content_length:
+        REGISTRY.observe("lipdnet_request_payload_bytes", request.content_length, route=route)
+        REGISTRY.set_max("lipdnet_request_payload_bytes_max", request.content_length, route=route)
+    return response
+
+@api.route('/metrics', methods=["GET"])
+@limiter.exempt
+def _metrics():
+    '''
+    Request counts and latencies per route, conversion stage timings, and payload sizes, added up across every worker
+    process. Prometheus text format.
+
+    '''
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/test', methods=["GET"])
 @limiter.exempt
 def _test():
     logger_flask.info("Flask API Test: Success")
     return "Flask API Test response: Success"
 
-@app.route("/api/wikiquery", methods=["POST"])
+@api.route('/ready', methods=["GET"])
 @limiter.exempt
+def _ready():
+    '''
+    Whether this worker should get traffic: 200 once it has warmed up, 503 until then, or if warming up failed.
+
+    '''
+    services = _services()
+    ready = services.ready.is_set()
+    return encode_response({'ready': ready, 'version': services.models.current().version,
+                            'warm_up': services.warm_up_report}, request, 200 if ready else 503)
+
+@api.route("/api/wikiquery", methods=["POST"])
+@limiter.exempt
+@compressed
 def _wiki_query():
     _results = []
     logger_flask.info("Flask: Entering _wiki_query")
     try:
         logger_flask.info("Flask: Creating query string")
         # real testing
-        _results = wiki_query(request.json)
+        _results = wiki_query(decode_request(request))
         # hard coded data testing
         # _results = wiki_query(opts)
 
     except Exception as e:
-        logger_flask.error("Flask: wiki_query: {}".format(e))
+        logger_flask.error("Flask: wiki_query: %s", e)
     logger_flask.info("Finished. Sending back formatted query")
     # logger_flask.info(_results)
     return _results;
 
-@app.route('/api/noaa', methods=["POST"])
-@limiter.exempt
+@api.route('/api/noaa', methods=["POST"])
+@noaa_limit
+@compressed
 def _noaa_start():
     out = []
     logger_flask.info("Flask: LiPD Data received...")
     # logger_flask.info(request)
     # TESTER = {'@context': 'context.jsonld', 'archiveType': 'lake sediment', 'dataSetName': 'Castilla.Lane.2009', 'funding': [{'agency': ['National Geographic Society', 'NSF'], 'grant': ['BCS-0550382']}], 'geo': {'geometry': {'coordinates': [-70.88, 18.8, 1005], 'type': 'Point'}, 'properties': {'geometry_type': 'Point', 'politicalUnit': 'Dominican Republic', 'properties_elevation_unit': 'm', 'siteName': 'Laguna de Felipe'}, 'type': 'Feature'}, 'googleDataURL': 'https://docs.google.com/spreadsheets/d/1ZtQEMAdr12saY7Xe-ABc_LE4aeU_zHz3tWZUSSaePq4', 'googleMetadataWorksheet': 'o2s0ffa', 'googleSpreadSheetKey': '1ZtQEMAdr12saY7Xe-ABc_LE4aeU_zHz3tWZUSSaePq4', 'investigators': 'Lane, C.S.; Horn, S.P.; Mora, C.I.; Orvis, K.H.', 'maxYear': 1990.228261, 'metadataMD5': 'e664497687a6446c75319d39eb1a53ad', 'minYear': 596.7162845, 'originalDataURL': 'this study', 'paleoData': OrderedDict([('paleo0', OrderedDict([('measurementTable', OrderedDict([('paleo0measurement0', {'WDSPaleoUrl': 'https://www1.ncdc.noaa.gov/pub/data/paleo/pages2k/nam2k-hydro-v1-1.0.0/data-version-2017/Castilla.Lane.2009.txt', 'columns': OrderedDict([('d18O_calcite', {'QCnotes': 'Biogenic carbonates only present in 2 intervals of core - hence discontinuous record', 'TSid': 'NAm2kHydro060', 'dataType': 'float', 'description': 'oxygen isotopes from biogenic carbonates', 'hasMaxValue': 4.2999999999999998, 'hasMeanValue': 1.7972631578947371, 'hasMedianValue': 1.6795, 'hasMinValue': 0.0030000000000000001, 'hasResolution': {'hasMinValue': 2.1749999999999545, 'hasMaxValue': 311.58199999999999, 'hasMeanValue': 36.888405405405408, 'hasMedianValue': 22.924999999999955}, 'interpretation': [{'basis': 'closed basin lake water should reflect E/P ratio; no modern calibration', 'interpDirection': 'negative', 'local': 'TRUE', 'variable': 'M', 'variableDetail': 'effective'}], 'measurementMaterial': 'Adult monospecific ostracod valves and calcified charophyte oospores', 'number': 1, 'proxy': 'd18O', 'tableMD5': 'ded0c7396301a6f9d57015490e0e3ecd', 'units': 'permil (VPBD)', 'useInNAm2kHydro': 'FALSE', 'variableName': 'd18O_calcite', 'values': [4.3, 2.33, 1.595, 2.67, 2.024, 1.003, 2.292, 2.555, 2.297, 1.34, 1.526, 1.929, 2.539, 2.424, 3.195, 2.803, 2.134, 1.574, 1.84, 0.454, 1.739, 1.584, 0.969, 1.58, 1.899, 1.62, 1.43, 1.883, 1.077, 1.236, 1.423, 2.178, 1.927, 1.61, 1.107, 1.531, 0.676, 0.003]}), ('year', {'TSid': 'PYTA8BLWQIF', 'dataType': 'float', 'description': 'Year AD', 'hasMaxValue': 1825.6579999999999, 'hasMeanValue': 1078.7001842105262, 'hasMedianValue': 1046.4565, 'hasMinValue': 460.78699999999998, 'hasResolution': {'hasMinValue': 'nan', 'hasMaxValue': 'nan', 'hasMeanValue': 'nan', 'hasMedianValue': 'nan'}, 'inferredVariableType': 'year', 'number': 2, 'units': 'AD', 'variableName': 'year', 'variableType': 'inferred', 'values': [1825.658, 1817.792, 1778.341, 1756.697, 1743.71, 1713.409, 1700.422, 1683.107, 1659.299, 1555.408, 1518.613, 1382.256, 1070.674, 1066.868, 1064.149, 1061.974, 1057.625, 1055.45, 1053.275, 1039.638, 993.788, 959.401, 879.164, 856.24, 816.121, 787.465, 764.54, 724.422, 712.96, 672.841, 598.336, 575.411, 558.218, 535.293, 512.368, 495.175, 483.712, 460.787]}), ('age', {'TSid': 'PYT0C4SVLX5', 'dataType': 'float', 'description': 'Years before present (1950) BP', 'hasMaxValue': 1489.213, 'hasMeanValue': 871.29981578947377, 'hasMedianValue': 903.54349999999999, 'hasMinValue': 124.342, 'hasResolution': {'hasMinValue': 'nan', 'hasMaxValue': 'nan', 'hasMeanValue': 'nan', 'hasMedianValue': 'nan'}, 'inferredVariableType': 'age', 'number': 3, 'units': 'BP', 'variableName': 'age', 'variableType': 'inferred', 'values': [124.342, 132.208, 171.659, 193.303, 206.29, 236.591, 249.578, 266.893, 290.701, 394.592, 431.387, 567.744, 879.326, 883.132, 885.851, 888.026, 892.375, 894.55, 896.725, 910.362, 956.212, 990.599, 1070.836, 1093.76, 1133.879, 1162.535, 1185.46, 1225.578, 1237.04, 1277.159, 1351.664, 1374.589, 1391.782, 1414.707, 1437.632, 1454.825, 1466.288, 1489.213]}), ('d13C_calcite', {'TSid': 'NAm2kHydro061', 'dataType': 'float', 'description': 'carbon isotopes from biogenic carbonates', 'hasMaxValue': 4.2279999999999998, 'hasMeanValue': 2.3516944444444445, 'hasMedianValue': 2.577, 'hasMinValue': -0.187, 'hasResolution': {'hasMinValue': 2.1749999999999545, 'hasMaxValue': 447.93900000000002, 'hasMeanValue': 38.996314285714284, 'hasMedianValue': 22.924999999999955}, 'interpretation': [{'variable': 'complicated', 'variableDetail': 'Higher values could be warm and dry, decreased partial pressures of atmospheric CO2, or a shift towards more warm season precip'}], 'measurementMaterial': 'Adult monospecific ostracod valves and calcified charophyte oospores', 'number': 4, 'proxy': 'd13C', 'tableMD5': 'ded0c7396301a6f9d57015490e0e3ecd', 'units': 'permil (VPBD)', 'useInNAm2kHydro': 'FALSE', 'variableName': 'd13C_calcite', 'values': [4.228, 2.351, 2.577, 3.109, 2.742, 2.146, -0.074, 1.095, 1.579, 'nan', -0.187, 'nan', 0.798, 2.43, 3.169, 3.049, 3.27, 2.344, 2.553, 2.909, 3.871, 2.715, 2.715, 2.546, 2.579, 2.577, 2.16, 3.092, 2.6, 1.825, 3.709, 2.798, 3.054, 2.659, 1.708, 2.025, 1.681, 0.259]})]), 'dataMD5': 'ded0c7396301a6f9d57015490e0e3ecd', 'filename': 'Castilla.Lane.2009.paleo0measurement0.csv', 'googleWorkSheetKey': 'opyqd7g', 'missingValue': 'nan', 'number': 4, 'paleoMeasurementTableNumber': 1, 'paleoNumber': 1, 'tableName': 'paleo0measurement0'})]))])), ('paleo1', OrderedDict([('measurementTable', OrderedDict([('paleo1measurement0', {'WDSPaleoUrl': 'https://www1.ncdc.noaa.gov/pub/data/paleo/pages2k/nam2k-hydro-v1-1.0.0/data-version-2017/Castilla.Lane.2009.txt', 'columns': OrderedDict([('d18O_ostracodes', {'TSid': 'NAm2kHydro062', 'dataType': 'float', 'description': 'oxygen isotopes from ostracod valves', 'hasMaxValue': 3.6379999999999999, 'hasMeanValue': -0.16929661016949152, 'hasMedianValue': 0.048000000000000001, 'hasMinValue': -4.5339999999999998, 'hasResolution': {'hasMinValue': 0.66599999999999682, 'hasMaxValue': 332.47500000000002, 'hasMeanValue': 11.910358974358976, 'hasMedianValue': 5.9020000000000001}, 'interpretation': [{'basis': 'closed basin lake water should reflect E/P ratio', 'interpDirection': 'negative', 'local': 'TRUE', 'variable': 'M', 'variableDetail': 'effective'}], 'measurementMaterial': 'Adult Cythridella boldii ostracod valves', 'number': 1, 'proxy': 'd18O', 'tableMD5': '1809df60cd8a02751c440d87638adbe6', 'units': 'permil (VPBD)', 'useInNAm2kHydro': 'TRUE', 'variableName': 'd18O_ostracodes', 'values': [0.079, -0.452, 1.189, 0.462, 2.232, -0.783, 0.332, -0.995, -1.565, -2.307, 0.631, 0.937, 1.154, -0.67, 0.102, -1.23, -2.287, -0.024, 1.196, 0.037, 0.856, 0.443, 0.691, 2.02, -0.626, 3.638, 0.694, 0.289, 1.255, -1.76, 0.456, -0.137, 0.926, 1.281, 0.417, -1.353, 0.098, 0.889, -0.115, 1.34, -1.341, 1.229, 0.538, 0.467, -3.659, -2.064, -0.34, -1.432, -1.789, -1.274, -1.715, -3.708, -2.809, -3.835, -4.534, -0.99, -2.162, -2.295, -1.827, -2.17, -2.521, -3.073, -3.439, -1.197, -0.833, -1.057, 0.487, -0.778, -1.564, -1.118, -0.251, 0.825, 0.002, 0.278, -0.203, 3.025, 1.589, 1.38, 0.629, 0.034, 0.443, 0.059, 2.391, 2.797, 2.738, 0.663, 1.75, 1.888, -0.581, 0.174, 0.903, -2.07, 0.441, 0.973, -0.549, -0.542, 0.629, -1.473, -2.258, 1.291, 1.269, -1.217, -0.369, 0.507, -0.49, -0.652, 0.771, -0.279, 0.777, 2.823, 1.328, 0.304, 0.994, -0.906, 1.544, 0.418, -0.877, -1.434]}), ('year', {'TSid': 'PYT8YL4IS4C', 'dataType': 'float', 'description': 'Year AD', 'hasMaxValue': 1990.2280000000001, 'hasMeanValue': 1597.3161186440677, 'hasMedianValue': 1796.0, 'hasMinValue': 596.71600000000001, 'hasResolution': {'hasMinValue': 'nan', 'hasMaxValue': 'nan', 'hasMeanValue': 'nan', 'hasMedianValue': 'nan'}, 'inferredVariableType': 'year', 'number': 2, 'units': 'AD', 'variableName': 'year', 'variableType': 'inferred', 'values': [1990.228, 1968.587, 1964.652, 1960.717, 1954.815, 1948.913, 1944.978, 1939.076, 1933.174, 1925.304, 1917.435, 1913.5, 1909.565, 1905.63, 1901.696, 1897.761, 1891.859, 1878.087, 1866.283, 1852.511, 1846.609, 1842.674, 1838.739, 1834.804, 1828.902, 1823.0, 1822.0, 1821.0, 1820.333, 1819.667, 1819.0, 1818.333, 1817.667, 1817.0, 1815.667, 1815.0, 1814.333, 1813.667, 1813.0, 1811.333, 1810.333, 1809.667, 1809.0, 1807.667, 1807.0, 1806.333, 1805.333, 1804.333, 1803.667, 1802.333, 1801.667, 1801.0, 1800.333, 1799.667, 1799.0, 1798.333, 1797.667, 1797.0, 1796.333, 1795.667, 1795.0, 1789.72, 1784.44, 1779.16, 1773.88, 1768.6, 1763.32, 1755.4, 1750.12, 1721.08, 1710.52, 1699.96, 1692.04, 1678.84, 1668.28, 1655.08, 1641.88, 1633.96, 1626.04, 1620.76, 1615.48, 1602.28, 1591.72, 1578.52, 1573.24, 1562.68, 1557.4, 1549.48, 1519.319, 1503.745, 1464.809, 1453.128, 1445.34, 1437.553, 1418.085, 1359.681, 1351.894, 1342.489, 1325.957, 993.482, 964.092, 934.702, 920.007, 905.312, 875.922, 817.142, 802.447, 787.752, 773.057, 758.362, 743.667, 728.972, 714.277, 699.582, 684.887, 640.801, 611.411, 596.716]}), ('age', {'TSid': 'PYTHGAME4YN', 'dataType': 'float', 'description': 'Years before present (1950) BP', 'hasMaxValue': 1353.2840000000001, 'hasMeanValue': 352.68388135593216, 'hasMedianValue': 154.0, 'hasMinValue': -40.228000000000002, 'hasResolution': {'hasMinValue': 'nan', 'hasMaxValue': 'nan', 'hasMeanValue': 'nan', 'hasMedianValue': 'nan'}, 'inferredVariableType': 'age', 'number': 3, 'units': 'BP', 'variableName': 'age', 'variableType': 'inferred', 'values': [-40.228, -18.587, -14.652, -10.717, -4.815, 1.087, 5.022, 10.924, 16.826, 24.696, 32.565, 36.5, 40.435, 44.37, 48.304, 52.239, 58.141, 71.913, 83.717, 97.489, 103.391, 107.326, 111.261, 115.196, 121.098, 127.0, 128.0, 129.0, 129.667, 130.333, 131.0, 131.667, 132.333, 133.0, 134.333, 135.0, 135.667, 136.333, 137.0, 138.667, 139.667, 140.333, 141.0, 142.333, 143.0, 143.667, 144.667, 145.667, 146.333, 147.667, 148.333, 149.0, 149.667, 150.333, 151.0, 151.667, 152.333, 153.0, 153.667, 154.333, 155.0, 160.28, 165.56, 170.84, 176.12, 181.4, 186.68, 194.6, 199.88, 228.92, 239.48, 250.04, 257.96, 271.16, 281.72, 294.92, 308.12, 316.04, 323.96, 329.24, 334.52, 347.72, 358.28, 371.48, 376.76, 387.32, 392.6, 400.52, 430.681, 446.255, 485.191, 496.872, 504.66, 512.447, 531.915, 590.319, 598.106, 607.511, 624.043, 956.518, 985.908, 1015.298, 1029.993, 1044.688, 1074.078, 1132.858, 1147.553, 1162.248, 1176.943, 1191.638, 1206.333, 1221.028, 1235.723, 1250.418, 1265.113, 1309.199, 1338.589, 1353.284]}), ('d13C_ostracodes', {'TSid': 'NAm2kHydro063', 'dataType': 'float', 'description': 'carbon isotopes from ostracod valves', 'hasMaxValue': -0.44, 'hasMeanValue': -4.7993389830508484, 'hasMedianValue': -5.1649999999999991, 'hasMinValue': -8.9700000000000006, 'hasResolution': {'hasMinValue': 0.66599999999999682, 'hasMaxValue': 332.47500000000002, 'hasMeanValue': 11.910358974358976, 'hasMedianValue': 5.9020000000000001}, 'measurementMaterial': 'Adult Cythridella boldii ostracod valves', 'number': 4, 'proxy': 'd13C', 'tableMD5': '1809df60cd8a02751c440d87638adbe6', 'units': 'permil (VPBD)', 'useInNAm2kHydro': 'FALSE', 'variableName': 'd13C_ostracodes', 'values': [-5.575, -5.265, -4.574, -3.519, -3.395, -4.5, -4.302, -5.282, -6.837, -6.779, -3.748, -1.906, -1.84, -2.576, -0.932, -1.512, -2.9, -1.826, -5.128, -6.413, -5.612, -5.835, -5.716, -5.169, -7.808, -5.508, -4.234, -5.758, -5.331, -6.005, -5.908, -4.616, -5.071, -5.44, -6.107, -5.612, -5.161, -5.774, -6.567, -6.42, -7.37, -5.537, -5.388, -7.269, -6.876, -6.741, -5.527, -5.083, -6.367, -6.473, -6.006, -6.6, -5.492, -6.192, -6.371, -4.97, -5.106, -5.658, -5.372, -4.956, -5.899, -5.887, -5.686, -7.28, -5.824, -7.019, -6.212, -6.359, -6.171, -3.201, -6.168, -5.056, -5.316, -5.361, -5.66, -8.341, -8.97, -8.744, -6.875, -6.009, -6.133, -5.016, -4.295, -3.221, -2.083, -4.149, -4.071, -4.894, -5.576, -5.943, -4.477, -3.825, -3.659, -3.696, -4.333, -3.721, -2.848, -4.376, -4.453, -2.36, -0.44, -1.96, -2.43, -2.66, -0.77, -2.01, -3.23, -3.58, -3.23, -3.51, -3.75, -3.1, -2.1, -3.23, -1.69, -2.43, -2.82, -2.4]})]), 'dataMD5': '1809df60cd8a02751c440d87638adbe6', 'filename': 'Castilla.Lane.2009.paleo1measurement0.csv', 'googleWorkSheetKey': 'oc7mjtf', 'missingValue': 'nan', 'number': 4, 'paleoMeasurementTableNumber': 1, 'paleoNumber': 2, 'tableName': 'paleo1measurement0'})]))]))]), 'pub': [{'author': 'Lane, Chad S.;  Horn, Sally P.;  Mora, Claudia I.;  Orvis, Kenneth H.', 'dataUrl': 'doi.org', 'identifier': [{'id': '10.1016/j.quascirev.2009.04.013', 'type': 'doi', 'url': 'http://dx.doi.org/10.1016/j.quascirev.2009.04.013'}], 'issue': '23-24', 'journal': 'Quaternary Science Reviews', 'page': '2239-2260', 'pubDataUrl': 'doi.org', 'pubYear': '2009', 'publisher': 'Elsevier BV', 'title': 'Late-Holocene paleoenvironmental change at mid-elevation on the Caribbean slope of the Cordillera Central, Dominican Republic: a multi-site, multi-proxy analysis', 'type': 'journal-article', 'volume': '28'}], 'studyName': 'Isotope data from Laguna de Felipe recording Little Ice Age Aridity in the Caribbean', 'tagMD5': '285bfb25d48ae8f66366eebf8831cc0a', 'lipdVersion': 1.3}
-    # logger_flask.info(request.json)
-    logger_flask.info("Flask: Processing: {}".format(request.json["metadata"]["dataSetName"]))
+    body = decode_request(request)
+    # logger_flask.info(body)
+    if not _lipd_record(body):
+        return encode_response({'error': 'Expected a {"metadata", "csvs"} record'}, request, 400)
+    logger_flask.info("Flask: Processing: %s", body["metadata"].get("dataSetName"))
     try:
         logger_flask.info("Flask: Start processing to NOAA...")
-        if "csvs" in request.json:
+        if "csvs" in body and _wants_ndjson():
+            logger_flask.info("Flask: Csv data exists. Streaming NOAA texts as NDJSON")
+            return Response(_ndjson_lines(stream_lipd(body["metadata"], body["csvs"], "project", "1.0.0",
+                                                        cache=_services().conversion_cache)),
+                            mimetype='application/x-ndjson')
+        elif "csvs" in body:
             logger_flask.info("Flask: Csv data exists")
-            _csvs = request.json["csvs"]
-            logger_flask.info("Flask: Start idx_num_to_name")
-            _json = idx_num_to_name(request.json["metadata"])
-            logger_flask.info("Flask: Start merge_csv_metadata")
-            _json = merge_csv_metadata(_json, _csvs)
+            out = convert_lipd(body["metadata"], body["csvs"], "project", "1.0.0", pool=_services().conversion_pool,
+                               cache=_services().conversion_cache)
         else:
             logger_flask.info("Flask: No CSV data provided : Quitting...")
             return "No CSV data provided"
-        logger_flask.info("Flask: Start converting LiPD data to NOAA text")
-        noaas = lpd_to_noaa(_json, "project", "1.0.0")
-        logger_flask.info("Flask: Format the NOAA text data for the response object")
-        for k,v in noaas.items():
-            out.append({k: v})
-        #logger_flask.info(noaas)
-        logger_flask.info("Flask: Sending back NOAA files: {}".format(len(out)))
+        logger_flask.info("Flask: Sending back NOAA files: %s", len(out))
     except Exception as e:
-        logger_flask.error("Flask App Error: {} : Quitting...".format(e))
+        logger_flask.error("Flask App Error: %s : Quitting...", e)
+        response = _conversion_error(e)
+        if response is not None:
+            return response
         return "Exception found: {}".format(e)
     logger_flask.info("Flask: Sending Response to Node")
-    return json.dumps(out)
+    return encode_response(out, request)
 
-@app.route('/getArchives', methods=['GET'])
+@api.route('/api/noaa/batch', methods=["POST"])
+@noaa_limit
+@compressed
+def _noaa_batch():
+    '''
+    Convert many LiPD datasets in one call. The body is a list of {"metadata": ..., "csvs": ...} records, or
+    {"datasets": [...]}. The datasets are converted in parallel on the conversion pool, and each one gets its NOAA texts
+    under "result", or an "error", keyed by its dataSetName.
+
+    '''
+    body = decode_request(request, max_size=_services().batch_max_bytes)
+    if isinstance(body, dict):
+        body = body.get("datasets")
+    if not isinstance(body, list):
+        return encode_response({'error': 'Expected a list of {"metadata", "csvs"} records'}, request, 400)
+    logger_flask.info("Flask: Batch of %s datasets received...", len(body))
+    out = convert_batch(body, "project", "1.0.0", pool=_services().conversion_pool,
+                        cache=_services().conversion_cache)
+    logger_flask.info("Flask: Sending back batch results: %s", len(out))
+    # Any dataset the pool couldn't take sets the status of the whole batch. The finished ones are cached, so sending
+    # the batch again only converts the rest.
+    statuses = {result.get("status") for result in out.values()}
+    if 503 in statuses:
+        return _retry_later(encode_response(out, request, 503))
+    return encode_response(out, request, 504 if 504 in statuses else 200)
+
+@api.route('/api/noaa/cache', methods=["GET", "DELETE"])
+@api.route('/api/noaa/cache/<key>', methods=["DELETE"])
+@admin_only("DELETE")
+def _noaa_cache(key=None):
+    '''
+    GET: hit and miss counts and size of the conversion cache.
+    DELETE: drop one cached conversion by its key, or the whole cache. Needs the ADMIN_TOKEN.
+
+    '''
+    conversion_cache = _services().conversion_cache
+    if request.method == "GET":
+        return encode_response(conversion_cache.stats(), request)
+    if key:
+        return encode_response({'removed': 1 if conversion_cache.invalidate(key) else 0}, request)
+    return encode_response({'removed': conversion_cache.clear()}, request)
+
+def _conversion_error(e):
+    '''
+    Response for a conversion the pool couldn't run: 503 when its queue is full, 504 when the conversion took longer
+    than CONVERSION_TIMEOUT. None for any other error.
+
+    '''
+    if isinstance(e, ConversionPoolFull):
+        return _retry_later(encode_response({'error': str(e)}, request, 503))
+    if isinstance(e, TIMEOUT_ERRORS):
+        return encode_response({'error': 'Conversion took longer than {} seconds'.format(
+            current_app.config["CONVERSION_TIMEOUT"])}, request, 504)
+    return None
+
+def _retry_later(response):
+    '''
+    Tell the client when to try again after the conversion queue was full.
+
+    '''
+    response.headers['Retry-After'] = str(current_app.config["CONVERSION_RETRY_AFTER"])
+    return response
+
+def _lipd_record(body):
+    '''
+    Check that a request body is a {"metadata": ..., "csvs": ...} record, as the conversion routes expect.
+
+    '''
+    return isinstance(body, dict) and isinstance(body.get("metadata"), dict)
+
+def _wants_ndjson():
+    '''
+    Check if the client asked for the NOAA texts to be streamed, either with ?stream=1 or with
+    "Accept: application/x-ndjson".
+
+    '''
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def _ndjson_lines(noaas):
+    '''
+    Serialize each {filename: NOAA text} as one line of NDJSON, as soon as the conversion produces it.
+    An error part way through is sent as a final {"error": ...} line, since the status code has already gone out.
+
+    '''
+    _count = 0
+    try:
+        for noaa in noaas:
+            _count += 1
+            yield dumps(noaa) + b"\n"
+        logger_flask.info("Flask: Streamed NOAA files: %s", _count)
+    except Exception as e:
+        logger_flask.error("Flask App Error: %s : Quitting stream...", e)
+        yield dumps({'error': "Exception found: {}".format(e)}) + b"\n"
+
+@api.route('/api/noaa/jobs', methods=["POST"])
+@noaa_limit
+def _noaa_job_start():
+    '''
+    Queue a LiPD to NOAA conversion on the background executor, and return the job id straight away.
+    Poll /api/noaa/jobs/<job_id> for the result, or follow /api/noaa/jobs/<job_id>/events for progress.
+
+    '''
+    logger_flask.info("Flask: LiPD Data received for a conversion job...")
+    body = decode_request(request)
+    if not _lipd_record(body):
+        return encode_response({'error': 'Expected a {"metadata", "csvs"} record'}, request, 400)
+    if "csvs" not in body:
+        logger_flask.info("Flask: No CSV data provided : Quitting...")
+        return encode_response({'error': 'No CSV data provided'}, request, 400)
+    services = _services()
+    # The job would only fail once it got to the pool
+    if services.conversion_pool and services.conversion_pool.full():
+        return _conversion_error(ConversionPoolFull("conversion queue is full"))
+    job_id = services.job_manager.submit(convert_lipd, body["metadata"], body["csvs"], "project", "1.0.0",
+                                         pool=services.conversion_pool, cache=services.conversion_cache)
+    logger_flask.info("Flask: Queued %s as job %s", body["metadata"].get("dataSetName"), job_id)
+    response = encode_response({'job': job_id, 'status': 'queued'}, request, 202)
+    response.headers['Location'] = url_for('._noaa_job_status', job_id=job_id)
+    return response
+
+@api.route('/api/noaa/jobs/<job_id>', methods=["GET"])
+@limiter.exempt
+def _noaa_job_status(job_id):
+    '''
+    Return the status and current stage of a conversion job. Once the job is done, the NOAA texts are under 'result'.
+
+    '''
+    record = _services().job_manager.get(job_id)
+    if record is None:
+        return encode_response({'error': 'Unknown or expired job'}, request, 404)
+    return encode_response(record, request)
+
+@api.route('/api/noaa/jobs/<job_id>/events', methods=["GET"])
+@limiter.exempt
+def _noaa_job_events(job_id):
+    '''
+    Server-sent events for a conversion job. One event is sent per status or stage change, and the stream closes
+    when the job is done or has failed.
+
+    '''
+    # The stream runs after the request context is gone, so it keeps its own reference to the job manager
+    job_manager = _services().job_manager
+    if job_manager.get(job_id) is None:
+        return encode_response({'error': 'Unknown or expired job'}, request, 404)
+
+    def stream():
+        for record in job_manager.events(job_id):
+            yield "event: {}\ndata: {}\n\n".format(record['status'], dumps(record).decode('utf-8'))
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@api.route('/api/models', methods=["GET"])
+@limiter.exempt
+def _models_status():
+    '''
+    Version and files of the live prediction models, which models are loaded, and the report of the last reload.
+
+    '''
+    manager = _services().models
+    models = manager.current()
+    return encode_response({'version': models.version,
+                            'files': {k: v and os.path.basename(v) for k, v in models.files.items()},
+                            'loaded': models.loaded(), 'last_reload': manager.last_reload,
+                            'predictions': _services().predictions.stats()}, request)
+
+@api.route('/api/models/reload', methods=["POST"])
+@admin_only()
+def _models_reload():
+    '''
+    Load the latest model files and swap them in now, instead of waiting for the next check.
+    Requests already running finish on the old version. Needs the ADMIN_TOKEN.
+
+    '''
+    report = _services().models.reload()
+    return encode_response(report, request, 500 if 'error' in report else 200)
+
+@api.route('/getArchives', methods=['GET'])
 @limiter.exempt
+@conditional(_models_version)
 def get_archives():
-    if not archives_map:
-        return make_response(jsonify({'result': {}}), 200)
-    covered = {'MarineSediment', 'LakeSediment', 'GlacierIce', 'GroundIce', 'TerrestrialSediment', 'MollusckShell','MolluskShell', 'MolluskShells', 'molluskshell'}
-    final_arch = set()
-    for key,value in archives_map.items():
-        print(key,value)
-        if key in covered:
-            continue
-        elif key.title() in archives_map:
-            final_arch.add(key.title())
-        elif key.title() is not value:
-            final_arch.add(key.title())
-    return make_response(jsonify({'result': {'0' : list(sorted(final_arch))}}), 200)
-
-@app.route('/predictNextValue', methods=['GET'])
+    models = _models()
+    if not models.archives_map:
+        return encode_response({'result': {}}, request)
+    # Worked out once per version of the ground truth labels
+    return encode_response({'result': {'0' : models.archive_names}}, request)
+
+@api.route('/predictNextValue', methods=['GET'])
 @limiter.exempt
+@conditional(_models_version)
 def predict_next_value():
     '''
     Method to predict the next value in the recommendation system chain.
@@ -215,121 +790,121 @@ def predict_next_value():
 
     if variabletype == 'measured' or variabletype == 'inferred':
         # HANDLE ARCHIVE TYPES USING EDIT DISTANCE FOR SPELLING MISTAKES
+        # Use the same version of the models for the whole request, even if a new one is swapped in part way through
+        models = _models()
+        archives_map = models.archives_map
 
         if inputs[0] not in archives_map:
 
             present = False
-            for key in archives_map.keys():
-                dist = editDistDP(inputs[0].lower(), key.lower(), len(inputs[0]), len(key))
-                print('input = {}, key = {}, dist = {}'.format(inputs[0], key, dist))
+            keys = list(archives_map.keys())
+            # Only whether a key is within 3 matters, so the ones further away aren't compared all the way through
+            distances = levenshtein_many(inputs[0].lower(), [key.lower() for key in keys], 3)
+            logger_flask.debug("predict_next_value: input = %s, distances = %s", inputs[0], dict(zip(keys, distances)))
+            for key, dist in zip(keys, distances):
                 if dist <= 3:
                     inputs[0] = archives_map[key]
                     present = True
                     break
             if not present:
-                return make_response(jsonify({'result': {}}), 200)
+                return encode_response({'result': {}}, request)
 
         inputstr = (',').join(inputs)
         if inputs[0] in archives_for_MC:
-            return predict_using_markov_chains(variabletype, inputstr)
-        return predict_using_lstm(variabletype, inputstr)
+            backend, predict = 'MC', predict_using_markov_chains
+        else:
+            backend, predict = 'LSTM', predict_using_lstm
+        # When many users open the same template, the same prediction is asked for many times at once. Run it once,
+        # and give every caller the result.
+        output, shared = _services().predictions.do((inputstr, variabletype, models.version), predict, variabletype,
+                                                     inputstr, models)
+        REGISTRY.inc("lipdnet_predictions_total", backend=backend, outcome='coalesced' if shared else 'computed')
+        return encode_response({'result': output}, request)
 
     elif variabletype == 'time':
         if len(inputs) == 1 and inputs[0] in set(time_map.keys()):
-            return make_response(jsonify({'result': {'0': time_map[inputs[0]]}}), 200)
-        return make_response(jsonify({'result': {'0' : list(time_map.keys())}}), 200)
+            return encode_response({'result': {'0': time_map[inputs[0]]}}, request)
+        return encode_response({'result': {'0' : list(time_map.keys())}}, request)
 
     elif variabletype == 'depth':
         if len(inputs) == 1 and inputs[0] == 'Depth':
-            return make_response(jsonify({'result': {'0' : ['m', 'cm', 'mm']}}), 200)
-        return make_response(jsonify({'result': {'0' : ['Depth']}}), 200)
+            return encode_response({'result': {'0' : ['m', 'cm', 'mm']}}, request)
+        return encode_response({'result': {'0' : ['Depth']}}, request)
 
     else:
-       return make_response(jsonify({'result': {}}), 200)
+       return encode_response({'result': {}}, request)
 
-@app.route('/autocomplete', methods=['GET'])
-@limiter.limit("2/second", override_defaults=False)
+@api.route('/autocomplete', methods=['GET'])
+@limiter.limit(_autocomplete_rate_limit, override_defaults=False)
+@conditional(_autocomplete_version)
 def autocomplete_suggestion():
-    global autocomplete_file_path
-
-    # Ensure that autocomplete always works on the latest autocomplete data
-    new_autocomplete_file_path = get_latest_file_with_path(flask_dir, 'autocomplete_file_*.json')
-    if autocomplete_file_path != new_autocomplete_file_path:
-        autocomplete_file_path = new_autocomplete_file_path
-        load_names_set_from_file(new_autocomplete_file_path)
-
-
     fieldType  = request.args.get('fieldType', None)
     queryString  = request.args.get('queryString', '')
-    results = []
+    try:
+        limit = int(request.args.get('limit', current_app.config["AUTOCOMPLETE_LIMIT"]))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return encode_response({'error': 'limit and offset must be integers'}, request, 400)
+    if limit < 0 or offset < 0:
+        return encode_response({'error': 'limit and offset must not be negative'}, request, 400)
     if fieldType not in names_set_ind_map:
-        return make_response(jsonify({'result': {}}), 200)
-    if fieldType and queryString:
-        queryString = queryString.lower()
-        fieldType_set = names_set[fieldType]
-        results.extend(py_.filter(fieldType_set, lambda word: word.lower().startswith(queryString)))
-        # results.extend([word for word in fieldType_set if word.lower().startswith(queryString)])
+        return encode_response({'result': {}}, request)
+    limit = min(limit, current_app.config["AUTOCOMPLETE_MAX_LIMIT"])
+    # The latest autocomplete data is kept loaded in the background. Take the current version once, for the whole request.
+    cache = _suggestions()
+    if cache is None:
+        results = suggest(_vocabulary(), _models(), fieldType, queryString, limit=limit, offset=offset)
+        outcome = 'computed'
+    else:
+        results, outcome = cache.get(fieldType, queryString, limit, offset)
+    REGISTRY.inc("lipdnet_autocomplete_total", outcome=outcome)
+    return encode_response({'result': {0: results}}, request)
 
-        if len(queryString) >= avg_half_len_map[names_set_ind_map[fieldType]]:
-            for word in fieldType_set:
-                if word not in results:
-                    edist = editDistDP(queryString, word.lower(), len(queryString), len(word))
-                    if edist <= 5:
-                        results.append(word)
 
-    return make_response(jsonify({'result': {0: results}}), 200)
+def suggest(vocabulary, models, fieldType, queryString, limit=None, offset=0):
+    '''
+    Autocomplete suggestions for what has been typed so far in a field: the values starting with it, then, once
+    enough has been typed, the values within a small edit distance of it. Ranked by how they match, then by how
+    common they are in the ground truth.
 
+    Parameters
+    ----------
+    vocabulary : Vocabulary
+        Version of the autocomplete data to suggest from.
+    models : Predictors
+        Version of the models, for the average length of the values of each fieldType and how common each value is.
+    fieldType : string
+        Field being typed in, one of names_set_ind_map.
+    queryString : string
+        What has been typed so far.
+    limit : int, optional
+        Most suggestions to return. All of them when not given.
+    offset : int
+        Best suggestions to skip, for the next page.
 
-def lpd_to_noaa(D, project, version, path=""):
-    """
-    Convert a LiPD format to NOAA format
+    Returns
+    -------
+    results : list
+        Suggested values, best first.
 
-    :param dict D: Metadata
-    :param str project: Project Name
-    :param float version: Project version
-    :return dict D: Metadata
-    """
-    try:
-        logger_flask.info("lpd_noaa: Get DSN")
-        dsn = get_dsn(D)
-        # Remove all the characters that are not allowed here. Since we're making URLs, they have to be compliant.
-        logger_flask.info("lpd_noaa: Cleanup dsn, project, version with regexes")
-        dsn = re.sub(r'[^A-Za-z-.0-9]', '', dsn)
-        project = re.sub(r'[^A-Za-z-.0-9]', '', project)
-        version = re.sub(r'[^A-Za-z-.0-9]', '', version)
-        # Create the conversion object, and start the conversion process
-        logger_flask.info("lpd_noaa: Create conversion object")
-        _convert_obj = LPD_NOAA(D, dsn, project, version, path)
-        logger_flask.info("lpd_noaa: Run conversion main()")
-        _convert_obj.main()
-        # get our new, modified master JSON from the conversion object
-        # d = _convert_obj.get_master()
-        logger_flask.info("lpd_noaa: Retrieve NOAA texts from conversion object")
-        noaas = _convert_obj.get_noaa_texts()
-        logger_flask.info("lpd_noaa: Log the NOAA texts below: ----------------")
-        #logger_flask.info(noaas)
-        # remove any root level urls that are deprecated
-        # d = __rm_wdc_url(d)
-    except Exception as e:
-        logger_flask.error("lpd_to_noaa: {}".format(e))
+    '''
+    candidates = []
+    if fieldType and queryString:
+        queryString = queryString.lower()
+        for word in vocabulary.starting_with(fieldType, queryString):
+            candidates.append((word, EXACT if word.lower() == queryString else PREFIX, 0))
 
-    logger_flask.info("lpd_noaa: Exiting lpd_noaa")
-    return noaas
+        if len(queryString) >= models.avg_half_len_map[names_set_ind_map[fieldType]]:
+            seen = {word for word, _, _ in candidates}
+            for word, edist in vocabulary.within(fieldType, queryString, 5):
+                if word not in seen:
+                    seen.add(word)
+                    candidates.append((word, FUZZY, edist))
 
+    return rank(candidates, models.term_counts if candidates else None, limit, offset)
 
-def __rm_wdc_url(d):
-    """
-    Remove the WDCPaleoUrl key. It's no longer used but still exists in some files.
-    :param dict d: Metadata
-    :return dict d: Metadata
-    """
-    if "WDCPaleoUrl" in d:
-        del d["WDCPaleoUrl"]
-    if "WDSPaleoUrl" in d:
-        del d["WDSPaleoUrl"]
-    return d
 
-def predict_using_markov_chains(variabletype, sentence):
+def predict_using_markov_chains(variabletype, sentence, models):
     '''
     Method to return the list of top 5 values for a fieldType given the input sentence and the variableType using the model created for Markov Chains.
 
@@ -339,23 +914,25 @@ def predict_using_markov_chains(variabletype, sentence):
         Either "measured" or "inferred".
     sentence : string
         Comma-separated input string containing values corresponding to the prediction chain.
+    models : Predictors
+        Version of the models to predict with.
 
     Returns
     -------
-    response
-        Json response to the API call predictNextValue.
+    output : dict
+        Top values for each fieldType predicted, keyed by its position in the response of predictNextValue.
 
     '''
     output = {}
     inputs = sentence.split(',')
     if len(inputs) == 2 and variabletype == 'measured':
-        output = {0: pred3MC.predict_seq(sentence, isInferred=(True if variabletype=='inferred' else False))['0'], 1: pred4MC.predict_seq(sentence, isInferred=(True if variabletype =='inferred' else False))['0']}
+        output = {0: models.mc3.predict_seq(sentence, isInferred=(True if variabletype=='inferred' else False))['0'], 1: models.mc4.predict_seq(sentence, isInferred=(True if variabletype =='inferred' else False))['0']}
     else:
-        output = {0: pred4MC.predict_seq(sentence, isInferred=(True if variabletype =='inferred' else False))['0']}
+        output = {0: models.mc4.predict_seq(sentence, isInferred=(True if variabletype =='inferred' else False))['0']}
 
-    return make_response(jsonify({'result': output}), 200)
+    return output
 
-def predict_using_lstm(variabletype, sentence):
+def predict_using_lstm(variabletype, sentence, models):
     '''
     Method to return the list of top 5 values for a fieldType given the input sentence and the variableType using the model created for LSTM.
 
@@ -365,14 +942,16 @@ def predict_using_lstm(variabletype, sentence):
         Either "measured" or "inferred".
     sentence : string
         Comma-separated input string containing values corresponding to the prediction chain.
+    models : Predictors
+        Version of the models to predict with.
 
     Returns
     -------
-    response
-        Json response to the API call predictNextValue.
+    output : dict
+        Top values for each fieldType predicted, keyed by its position in the response of predictNextValue.
 
     '''
-
+    predLSTM = models.lstm
     inverse_ref_dict = {val:key for key,val in predLSTM.reference_dict.items()}
     inverse_ref_dict_u = {val:key for key,val in predLSTM.reference_dict_u.items()}
 
@@ -389,55 +968,13 @@ def predict_using_lstm(variabletype, sentence):
         result_list = [(inverse_ref_dict[val] if val in inverse_ref_dict else val) for val in result_list]
         output = {0: result_list}
 
-    return make_response(jsonify({'result': output}), 200)
-
-
-def editDistDP(str1, str2, m, n):
-    '''
-    Calculates the edit distance between str1 and str2.
-
-    Parameters
-    ----------
-    str1 : string
-        Input string 1.
-    str2 : TYPE
-        Input string 2.
-    m : int
-        len of string 1
-    n : int
-        len of string 2
+    return output
 
-    Returns
-    -------
-    int
-        Edit distance value between str1 and str2.
 
-    '''
-    dp = [[0 for x in range(n + 1)] for x in range(m + 1)]
-
-    for i in range(m + 1):
-        for j in range(n + 1):
-
-            if i == 0:
-                dp[i][j] = j
-
-            elif j == 0:
-                dp[i][j] = i
-
-            elif str1[i-1] == str2[j-1]:
-                dp[i][j] = dp[i-1][j-1]
-
-            else:
-                dp[i][j] = 1 + min(dp[i][j-1],
-                                   dp[i-1][j],
-                                   dp[i-1][j-1])
-
-    return dp[m][n]
-
-@app.errorhandler(429)
+@api.app_errorhandler(429)
 def ratelimit_handler(e):
     '''
-    Method to return a json error response to the UI incase the rate of invoking the API is exceeded to more than 2/sec.
+    Method to return a json error response to the UI incase the rate of invoking the API is exceeded.
 
     Parameters
     ----------
@@ -450,9 +987,8 @@ def ratelimit_handler(e):
         Json response to UI when the rate limit has been exceeded.
 
     '''
-    return make_response(jsonify(error="ratelimit exceeded %s" % e.description), 429)
-
-
-
+    return encode_response({'error': "ratelimit exceeded %s" % e.description}, request, 429)
 
 
+if __name__ == '__main__':
+    create_app().run()
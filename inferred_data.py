@@ -3,10 +3,14 @@ import copy
 import warnings
 import math
 
-from loggers import create_logger
+from loggers import create_logger, benchmark
 
 logger_inferred_data = create_logger("inferred_data")
 
+# Turn numpy types in the inferred data back into python types. Not needed when the data is only encoded by a
+# numpy-aware serializer, so callers with one can switch this off.
+FIX_NUMERIC_TYPES = True
+
 
 def _fix_numeric_types(c):
     """
@@ -136,7 +140,7 @@ def _get_resolution(age, values):
         res = np.diff(age2)
 
     except IndexError as e:
-        print("get_resolution: IndexError: {}".format(e))
+        logger_inferred_data.warning("get_resolution: IndexError: %s", e)
     except Exception as e:
         logger_inferred_data.warn("get_resolution: Exception: {}".format(e))
 
@@ -256,6 +260,7 @@ def _get_inferred_data_column(column):
     return column
 
 
+@benchmark("get_inferred_data_table")
 def get_inferred_data_table(table, pc):
     """
     Table level: Dive down, calculate data, then return the new table with the inferred data.
@@ -303,5 +308,6 @@ def get_inferred_data_table(table, pc):
     except Exception as e:
         logger_inferred_data.warn("get_inferred_data_table: Exception: {}".format(e))
 
-    table["columns"] = _fix_numeric_types(table["columns"])
+    if FIX_NUMERIC_TYPES:
+        table["columns"] = _fix_numeric_types(table["columns"])
     return table
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from loggers import create_logger
+
+logger_jobs = create_logger("jobs")
+
+# Job status values, in the order a job moves through them.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobStore(object):
+    """
+    Keeps job records as small JSON files on local disk, so any worker process on this host can answer a poll for a
+    job, no matter which worker is running it. Records older than the TTL are evicted.
+    """
+
+    def __init__(self, path, ttl=3600, evict_interval=60):
+        """
+        :param str path: Directory to keep the job records in
+        :param int ttl: Seconds to keep a record after its last update
+        :param int evict_interval: Minimum seconds between eviction sweeps
+        """
+        self.path = path
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._last_evict = 0
+
+    def _file(self, job_id):
+        return os.path.join(self.path, "{}.json".format(job_id))
+
+    def write(self, job_id, record):
+        """
+        Write a job record. The file is swapped in whole, so readers never see a half-written record.
+
+        :param str job_id: Job id
+        :param dict record: Job record
+        :return none:
+        """
+        os.makedirs(self.path, exist_ok=True)
+        _tmp = "{}.{}.tmp".format(self._file(job_id), os.getpid())
+        with open(_tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(_tmp, self._file(job_id))
+        return
+
+    def read(self, job_id):
+        """
+        Read a job record.
+
+        :param str job_id: Job id
+        :return dict: Job record, or None if the job does not exist or has expired
+        """
+        _file = self._file(job_id)
+        try:
+            if time.time() - os.path.getmtime(_file) > self.ttl:
+                return None
+            with open(_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def evict(self, force=False):
+        """
+        Remove job records that have outlived the TTL. Sweeps are skipped if one ran recently, unless forced.
+
+        :param bool force: Sweep even if the last sweep was recent
+        :return int: Number of records removed
+        """
+        _now = time.time()
+        if not force and _now - self._last_evict < self.evict_interval:
+            return 0
+        self._last_evict = _now
+        _count = 0
+        try:
+            for name in os.listdir(self.path):
+                _file = os.path.join(self.path, name)
+                try:
+                    if _now - os.path.getmtime(_file) > self.ttl:
+                        os.remove(_file)
+                        _count += 1
+                except OSError:
+                    # Removed by another worker in the meantime
+                    pass
+        except OSError:
+            # Nothing has been written yet
+            pass
+        if _count:
+            logger_jobs.info("evict: removed %s expired jobs", _count)
+        return _count
+
+
+class JobManager(object):
+    """
+    Runs long tasks on a local background executor and tracks their progress in a JobStore.
+    """
+
+    def __init__(self, store, max_workers=2, poll_interval=0.25):
+        """
+        :param JobStore store: Where job records are kept
+        :param int max_workers: Background threads that run jobs
+        :param float poll_interval: Seconds between record checks when streaming job events
+        """
+        self.store = store
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a task. The task is called with a `progress` keyword argument, which it can call with a stage name.
+
+        :param callable fn: Task to run
+        :return str: Job id
+        """
+        self.store.evict()
+        job_id = uuid.uuid4().hex
+        record = {"job": job_id, "status": QUEUED, "stage": None, "created": time.time()}
+        self.store.write(job_id, record)
+        self._executor.submit(self._run, job_id, record, fn, args, kwargs)
+        logger_jobs.info("submit: %s", job_id)
+        return job_id
+
+    def get(self, job_id):
+        """
+        Get a job record.
+
+        :param str job_id: Job id
+        :return dict: Job record, or None if the job is unknown or expired
+        """
+        self.store.evict()
+        return self.store.read(job_id)
+
+    def events(self, job_id):
+        """
+        Follow a job until it finishes. Yields the job record each time its status or stage changes.
+
+        :param str job_id: Job id
+        :return generator: Job records
+        """
+        _last = None
+        while True:
+            record = self.store.read(job_id)
+            if record is None:
+                return
+            _current = (record["status"], record["stage"])
+            if _current != _last:
+                _last = _current
+                yield record
+            if record["status"] in (DONE, FAILED):
+                return
+            time.sleep(self.poll_interval)
+
+    def _run(self, job_id, record, fn, args, kwargs):
+        """
+        Run one job on the executor, and record its progress, result, or error.
+        """
+        def progress(stage):
+            with self._lock:
+                record["stage"] = stage
+                self.store.write(job_id, record)
+
+        try:
+            with self._lock:
+                record["status"] = RUNNING
+                self.store.write(job_id, record)
+            result = fn(*args, progress=progress, **kwargs)
+            with self._lock:
+                record["status"] = DONE
+                record["result"] = result
+                record["finished"] = time.time()
+                self.store.write(job_id, record)
+            logger_jobs.info("run: %s done", job_id)
+        except Exception as e:
+            with self._lock:
+                record["status"] = FAILED
+                record["error"] = str(e)
+                record["finished"] = time.time()
+                self.store.write(job_id, record)
+            logger_jobs.error("run: %s failed: %s", job_id, e)
+        return
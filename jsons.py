@@ -1,5 +1,5 @@
 from misc import get_appended_name
-from loggers import create_logger
+from loggers import create_logger, benchmark
 
 from collections import OrderedDict
 
@@ -7,6 +7,7 @@ logger_jsons = create_logger("jsons")
 
 
 # IMPORT
+@benchmark("idx_num_to_name")
 def idx_num_to_name(L):
     """
     Switch from index-by-number to index-by-name.
@@ -23,7 +24,6 @@ def idx_num_to_name(L):
             L["chronData"] = _import_data(L["chronData"], "chron")
     except Exception as e:
         logger_jsons.error("idx_num_to_name: {}".format(e))
-        print("Error: idx_name_to_num: {}".format(e))
 
     logger_jsons.info("exit idx_num_to_name")
     return L
@@ -63,7 +63,6 @@ def _import_data(sections, crumbs):
 
     except Exception as e:
         logger_jsons.error("import_data: Exception: {}".format(e))
-        print("Error: import_data: {}".format(e))
 
     logger_jsons.info("exit import_data: {}".format(crumbs))
     return _sections
@@ -96,7 +95,6 @@ def _import_model(models, crumbs):
             _models[_table_name] = model
     except Exception as e:
         logger_jsons.error("import_model: {}".format(e))
-        print("Error: import_model: {}".format(e))
     logger_jsons.info("exit import_model: {}".format(crumbs))
     return _models
 
@@ -121,7 +119,6 @@ def _idx_table_by_name(tables, crumbs):
             _tables[_name] = _tmp
     except Exception as e:
         logger_jsons.error("idx_table_by_name: {}".format(e))
-        print("Error: idx_table_by_name: {}".format(e))
 
     return _tables
 
@@ -144,12 +141,10 @@ def _idx_col_by_name(table):
                     _name = get_appended_name(_name, _columns)
                 _columns[_name] = _column
             except Exception as e:
-                print("Error: idx_col_by_name: inner: {}".format(e))
                 logger_jsons.info("idx_col_by_name: inner: {}".format(e))
 
         table["columns"] = _columns
     except Exception as e:
-        print("Error: idx_col_by_name: {}".format(e))
         logger_jsons.error("idx_col_by_name: {}".format(e))
 
     return table
@@ -0,0 +1,313 @@
+"""
+Load test /predictNextValue and /autocomplete, the two endpoints the LiPD playground calls on every field change and
+keystroke.
+
+The requests are replayed from the data the app serves: prediction chains walked through the ground truth labels, and
+words from the autocomplete vocabulary typed out one prefix at a time. By default they run against an app built
+in this process, through one Flask test client per thread. Give --url to load a running server instead.
+
+    python loadtest.py --flask-dir /home/cheiser/mysite --concurrency 8 --duration 30
+    python loadtest.py --url http://127.0.0.1:5000 --flask-dir /home/cheiser/mysite --concurrency 32 --requests 5000
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from models import ARTIFACTS, get_latest_file_with_path
+from autocomplete import AUTOCOMPLETE_FILES, load_names_set_from_file
+from loggers import create_logger
+
+logger_loadtest = create_logger("loadtest")
+
+PREDICT = "/predictNextValue"
+AUTOCOMPLETE = "/autocomplete"
+PERCENTILES = (50, 95, 99)
+# Longest chain walked through the ground truth: archive, proxy observation type, then the interpretation
+CHAIN_LENGTH = 4
+
+
+def _chains(ground_truth, rng, count):
+    """
+    Prediction requests as the playground makes them while a column is filled in: the archive type first, then one
+    more value of the chain each time, for measured and inferred variables.
+
+    :param dict ground_truth: Contents of the ground truth labels file
+    :param random.Random rng: Random source
+    :param int count: Chains to walk
+    :return list: (inputstr, variableType) for every step of every chain
+    """
+    labels = ground_truth["ground_truth"]
+    archives = [a for a in ground_truth["archive_types"] if a in labels]
+    inferred = list(ground_truth["inf_var"])
+    out = []
+    for _ in range(count):
+        chain = [rng.choice(archives)]
+        if inferred and rng.random() < 0.25:
+            out.append((chain[0], "inferred"))
+            out.append((",".join(chain + [rng.choice(inferred)]), "inferred"))
+            continue
+        out.append((chain[0], "measured"))
+        while len(chain) < CHAIN_LENGTH:
+            _next = [v for v in labels.get(chain[-1], []) if v != "NA"]
+            if not _next:
+                break
+            chain.append(rng.choice(_next))
+            out.append((",".join(chain), "measured"))
+    return out
+
+
+def _prefixes(names_set, rng, count):
+    """
+    Autocomplete requests as the playground makes them while a value is typed: one per keystroke.
+
+    :param dict names_set: Contents of the autocomplete file
+    :param random.Random rng: Random source
+    :param int count: Words to type out
+    :return list: (fieldType, queryString) for every prefix of every word
+    """
+    fields = [f for f, words in names_set.items() if words]
+    out = []
+    for _ in range(count):
+        field = rng.choice(fields)
+        word = rng.choice(names_set[field])
+        for n in range(1, len(word) + 1):
+            out.append((field, word[:n]))
+    return out
+
+
+def workload(flask_dir, chains=200, words=200, seed=0):
+    """
+    Build the requests to replay, from the latest ground truth labels and autocomplete files, mixed in a random order.
+
+    :param str flask_dir: Directory with the ground_truth_label_* and autocomplete_file_* files
+    :param int chains: Prediction chains to walk
+    :param int words: Autocomplete words to type out
+    :param int seed: Random seed. The same files and seed always give the same requests.
+    :return list: (endpoint, query parameters, archive type or None)
+    """
+    rng = random.Random(seed)
+    with open(get_latest_file_with_path(flask_dir, ARTIFACTS["ground_truth"]), "r") as f:
+        ground_truth = json.load(f)
+    names_set = load_names_set_from_file(get_latest_file_with_path(flask_dir, AUTOCOMPLETE_FILES))
+
+    out = [(PREDICT, {"inputstr": s, "variableType": t}, s.split(",")[0]) for s, t in _chains(ground_truth, rng, chains)]
+    out.extend((AUTOCOMPLETE, {"fieldType": f, "queryString": q}, None) for f, q in _prefixes(names_set, rng, words))
+    rng.shuffle(out)
+    logger_loadtest.info("workload: {} requests from {}".format(len(out), flask_dir))
+    return out
+
+
+def _backend(archive, mc_archives):
+    """
+    Predictor a /predictNextValue request is served by, the same way the app picks it.
+
+    :param str archive: First value of the chain
+    :param set mc_archives: Archive types the target predicts with the Markov chains
+    :return str: "MC" or "LSTM"
+    """
+    return "MC" if archive in mc_archives else "LSTM"
+
+
+class _TestClientTarget(object):
+    """
+    Sends requests to an app in this process, with one test client per thread.
+    """
+
+    def __init__(self, app, mc_archives=()):
+        self.app = app
+        self.mc_archives = set(mc_archives)
+        self._local = threading.local()
+
+    def get(self, path, params):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.get(path, query_string=params)
+        response.get_data()
+        return response.status_code
+
+
+class _URLTarget(object):
+    """
+    Sends requests to a running server. It can't be asked which archive types it predicts with the Markov chains, so
+    they are given.
+    """
+
+    def __init__(self, url, timeout=30, mc_archives=()):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.mc_archives = set(mc_archives)
+
+    def get(self, path, params):
+        try:
+            with urllib.request.urlopen("{}{}?{}".format(self.url, path, urllib.parse.urlencode(params)),
+                                        timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def _percentile(ordered, p):
+    # Nearest rank
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+
+def run(target, requests, concurrency=8, duration=None, count=None):
+    """
+    Replay the requests from concurrency threads, over and over, until duration seconds have passed or count requests
+    were sent. With neither, every request is sent once.
+
+    :param target: Sends one request and returns its status code. Its mc_archives pick the backend of each prediction.
+    :param list requests: From workload()
+    :param int concurrency: Requests in flight at once
+    :param float duration: Seconds to run for
+    :param int count: Requests to send
+    :return dict: {"seconds", "groups"}, with the latencies and statuses of each endpoint and predictor backend
+    """
+    if duration is None and count is None:
+        count = len(requests)
+    source = itertools.cycle(requests)
+    source_lock = threading.Lock()
+    sent = [0]
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def _next():
+        with source_lock:
+            if (count is not None and sent[0] >= count) or (deadline and time.perf_counter() >= deadline):
+                return None
+            sent[0] += 1
+            return next(source)
+
+    def _worker():
+        # Each thread keeps its own results and they are merged at the end, so recording one doesn't contend
+        groups = {}
+        while True:
+            item = _next()
+            if item is None:
+                return groups
+            path, params, archive = item
+            keys = [path] + (["{} {}".format(path, _backend(archive, target.mc_archives))] if path == PREDICT else [])
+            _start = time.perf_counter()
+            try:
+                status = target.get(path, params)
+            except Exception as e:
+                logger_loadtest.error("run: {} {}: {}".format(path, params, e))
+                status = "error"
+            elapsed = time.perf_counter() - _start
+            for key in keys:
+                group = groups.setdefault(key, {"latencies": [], "statuses": {}})
+                group["latencies"].append(elapsed)
+                group["statuses"][status] = group["statuses"].get(status, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_worker) for _ in range(concurrency)]
+        results = [f.result() for f in futures]
+    seconds = time.perf_counter() - start
+
+    groups = {}
+    for result in results:
+        for key, group in result.items():
+            merged = groups.setdefault(key, {"latencies": [], "statuses": {}})
+            merged["latencies"].extend(group["latencies"])
+            for status, n in group["statuses"].items():
+                merged["statuses"][status] = merged["statuses"].get(status, 0) + n
+    return {"seconds": seconds, "groups": groups}
+
+
+def summarize(result):
+    """
+    Throughput and latency percentiles of each endpoint and predictor backend.
+
+    :param dict result: From run()
+    :return list: {"group", "requests", "errors", "rps", "p50", "p95", "p99", "statuses"}, latencies in seconds
+    """
+    out = []
+    for key in sorted(result["groups"]):
+        group = result["groups"][key]
+        ordered = sorted(group["latencies"])
+        summary = {"group": key, "requests": len(ordered),
+                   "errors": sum(n for s, n in group["statuses"].items() if s == "error" or s >= 400),
+                   "rps": len(ordered) / result["seconds"] if result["seconds"] else None,
+                   "statuses": {str(s): n for s, n in sorted(group["statuses"].items(), key=lambda i: str(i[0]))}}
+        for p in PERCENTILES:
+            summary["p{}".format(p)] = _percentile(ordered, p)
+        out.append(summary)
+    return out
+
+
+def report(summaries, seconds):
+    """
+    Format the summaries as a table, one line per endpoint and predictor backend.
+
+    :param list summaries: From summarize()
+    :param float seconds: Length of the run
+    :return str: Report
+    """
+    lines = ["{:<26} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}  {}".format("endpoint", "requests", "errors", "req/s",
+                                                                      "p50 ms", "p95 ms", "p99 ms", "statuses")]
+    for s in summaries:
+        lines.append("{:<26} {:>9} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}  {}".format(
+            s["group"], s["requests"], s["errors"], s["rps"], s["p50"] * 1000, s["p95"] * 1000, s["p99"] * 1000,
+            " ".join("{}:{}".format(k, v) for k, v in s["statuses"].items())))
+    lines.append("{} requests in {:.2f} seconds".format(
+        sum(s["requests"] for s in summaries if s["group"] in (PREDICT, AUTOCOMPLETE)), seconds))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /predictNextValue and /autocomplete.")
+    parser.add_argument("--flask-dir", required=True,
+                        help="Directory with the ground truth and autocomplete files. Also the app's FLASK_DIR.")
+    parser.add_argument("--url", help="Load a running server at this address, instead of an app in this process")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, help="Seconds to run for")
+    parser.add_argument("--requests", type=int, help="Requests to send. Every request once if neither this nor "
+                                                     "--duration is given.")
+    parser.add_argument("--chains", type=int, default=200, help="Prediction chains to walk")
+    parser.add_argument("--words", type=int, default=200, help="Autocomplete words to type out")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--eager-models", action="store_true",
+                        help="Load the models before the run, so it doesn't time the first load")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the rate limits on. Every test client shares one address, so most requests would "
+                             "be turned away.")
+    parser.add_argument("--mc-archives", nargs="*", default=[],
+                        help="With --url, the archive types the server predicts with the Markov chains, to report "
+                             "their predictions apart from the LSTM ones")
+    parser.add_argument("--json", help="Also write the summaries to this file")
+    args = parser.parse_args(argv)
+
+    requests = workload(args.flask_dir, chains=args.chains, words=args.words, seed=args.seed)
+    if args.url:
+        target = _URLTarget(args.url, mc_archives=args.mc_archives)
+    else:
+        from flask_app import create_app, archives_for_MC
+        # No warm-up running in the background while the requests are timed. --eager-models loads the models first.
+        target = _TestClientTarget(create_app({"FLASK_DIR": args.flask_dir, "EAGER_MODELS": args.eager_models,
+                                               "WARM_UP": False, "RATELIMIT_ENABLED": args.rate_limits}),
+                                   mc_archives=archives_for_MC)
+
+    result = run(target, requests, concurrency=args.concurrency, duration=args.duration, count=args.requests)
+    summaries = summarize(result)
+    print(report(summaries, result["seconds"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seconds": result["seconds"], "concurrency": args.concurrency, "summaries": summaries}, f,
+                      indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,33 @@
+import atexit
+import contextvars
 import datetime
 import logging
-from logging.config import dictConfig
-from logging.handlers import RotatingFileHandler
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+
+# The queue handlers records are put on, and the listeners writing them out
+_listeners = []
+_logging_lock = threading.RLock()
+# Settings init_logging() was last called with, and the handler it put on the root logger
+_logging_settings = None
+_root_handler = None
+
+# Spans of the request being handled. Each thread, and each task in it, sees its own.
+_trace = contextvars.ContextVar("benchmark_trace", default=None)
+# Called with (name, seconds) each time a benchmarked stage finishes
+_observers = []
 
 
 def log_benchmark(fn, start, end):
@@ -17,6 +43,109 @@ def log_benchmark(fn, start, end):
     return line
 
 
+class Trace(object):
+    """
+    The benchmarked stages run while handling one request, with their start times and durations. Nested stages are
+    recorded with their depth, so the breakdown can be shown as a tree.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+
+    def add(self, spans, offset=0.0, depth=0):
+        """
+        Add spans recorded somewhere else, like in a conversion worker process.
+
+        :param list spans: Spans, as recorded by another Trace
+        :param float offset: Seconds from the start of this trace to the start of the other one
+        :param int depth: Depth of the stage the spans ran under
+        :return none:
+        """
+        for span in spans:
+            self.spans.append(dict(span, start=round(span["start"] + offset, 6), depth=span["depth"] + depth))
+        return
+
+    def summary(self):
+        """
+        Total time and number of calls of each stage, in the order the stages started.
+
+        :return dict: {name: (seconds, calls)}
+        """
+        out = {}
+        for span in sorted(self.spans, key=lambda x: x["start"]):
+            seconds, calls = out.get(span["name"], (0.0, 0))
+            out[span["name"]] = (seconds + span["duration"], calls + 1)
+        return out
+
+    def to_dict(self):
+        return {"total": round(time.perf_counter() - self.start, 6),
+                "spans": sorted(self.spans, key=lambda x: x["start"])}
+
+
+def start_trace():
+    """
+    Start recording the benchmarked stages run from here on, in this thread.
+    :return Trace: The new trace
+    """
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def end_trace():
+    """
+    Stop recording benchmarked stages in this thread.
+    :return Trace: The trace that was being recorded, or None
+    """
+    trace = _trace.get()
+    _trace.set(None)
+    return trace
+
+
+def current_trace():
+    """
+    :return Trace: The trace being recorded in this thread, or None
+    """
+    return _trace.get()
+
+
+def add_benchmark_observer(fn):
+    """
+    Pass the duration of every benchmarked stage to a function, whether or not a trace is being recorded.
+    :param callable fn: Called with the stage name and its duration in seconds
+    :return none:
+    """
+    _observers.append(fn)
+    return
+
+
+@contextmanager
+def benchmark(name):
+    """
+    Time a named stage. Use it as a context manager, or as a function decorator to time every call.
+    The stage is added to the current trace, if there is one, nested under any stage it runs inside of.
+
+    :param str name: Stage name
+    """
+    trace = _trace.get()
+    if trace is not None:
+        depth = trace.depth
+        trace.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if trace is not None:
+            trace.depth = depth
+            trace.spans.append({"name": name, "start": round(start - trace.start, 6),
+                                "duration": round(end - start, 6), "depth": depth})
+        for fn in _observers:
+            fn(name, end - start)
+
+
 def update_changelog():
     """
     Create or update the changelog txt file. Prompt for update description.
@@ -32,6 +161,140 @@ def update_changelog():
     return
 
 
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """
+    A RotatingFileHandler that any number of processes can write to. Each write, and each rollover, holds a lock on a
+    file next to the log, and a process reopens the log when another one has rolled it over.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        self._lock_file = None
+        self._lock_pid = None
+
+    def _reopen_if_rolled_over(self):
+        if self.stream is None:
+            return
+        try:
+            _current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            _current = None
+        if _current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = None
+        return
+
+    def emit(self, record):
+        if fcntl is None:
+            return super().emit(record)
+        try:
+            # A forked process opens its own lock file. flock is shared by every copy of the same open file.
+            if self._lock_pid != os.getpid():
+                self._lock_file = open(self.baseFilename + ".lock", "a")
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rolled_over()
+                super().emit(record)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+        return
+
+
+def _queued(handler):
+    """
+    Write a handler's records from a background thread. The QueueHandler returned only puts records on a queue, so
+    logging never waits for the disk.
+
+    :param logging.Handler handler: Handler that writes the records
+    :return QueueHandler: Handler to add to a logger instead
+    """
+    _queue = queue.SimpleQueue()
+    listener = QueueListener(_queue, handler, respect_handler_level=True)
+    listener.start()
+    queue_handler = QueueHandler(_queue)
+    _listeners.append([queue_handler, listener])
+    return queue_handler
+
+
+def _stop_queued(queue_handler):
+    """
+    Write out the records still queued for a handler from _queued(), then close it.
+
+    :param QueueHandler queue_handler: Handler from _queued()
+    :return none:
+    """
+    for entry in list(_listeners):
+        if entry[0] is queue_handler:
+            _listeners.remove(entry)
+            entry[1].stop()
+            for handler in entry[1].handlers:
+                handler.close()
+    return
+
+
+def _restart_listeners():
+    # A forked process has the queues but not the threads that empty them. Start new ones, on new queues, so the
+    # records the parent had queued aren't written twice.
+    for entry in _listeners:
+        _queue = queue.SimpleQueue()
+        entry[0].queue = _queue
+        entry[1] = QueueListener(_queue, *entry[1].handlers, respect_handler_level=True)
+        entry[1].start()
+    return
+
+
+def _stop_listeners():
+    for entry in list(_listeners):
+        _stop_queued(entry[0])
+    return
+
+
+def _stop_listeners_at_exit(_):
+    # multiprocessing ends its processes with os._exit, which skips atexit, but still runs its own finalizers
+    multiprocessing.util.Finalize(None, _stop_listeners, exitpriority=10)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners)
+atexit.register(_stop_listeners)
+multiprocessing.util.register_after_fork(_stop_listeners, _stop_listeners_at_exit)
+
+
+def init_logging(log_file="debug.log", level=logging.DEBUG, levels=None, max_bytes=1000000, backup_count=1):
+    """
+    Set up logging for the whole process: every logger writes to one rotating file, from a background thread.
+    Only the first call does anything, unless it's called again with different settings.
+
+    :param str log_file: Log file. Any number of processes can share it.
+    :param int level: Level of the root logger
+    :param dict levels: Level of any logger, by name, e.g. {"LPD_NOAA": "WARNING"}
+    :param int max_bytes: Size the log file is rolled over at
+    :param int backup_count: Rolled over log files to keep
+    :return none:
+    """
+    global _logging_settings, _root_handler
+    settings = (log_file, level, tuple(sorted((levels or {}).items())), max_bytes, backup_count)
+    with _logging_lock:
+        if settings == _logging_settings:
+            return
+        root = logging.getLogger()
+        if _root_handler is not None:
+            root.removeHandler(_root_handler)
+            _stop_queued(_root_handler)
+        file_handler = SharedRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _root_handler = _queued(file_handler)
+        root.addHandler(_root_handler)
+        root.setLevel(level)
+        for name, _level in (levels or {}).items():
+            logging.getLogger(name).setLevel(_level)
+        _logging_settings = settings
+    return
+
+
 def create_benchmark(name, log_file, level=logging.INFO):
     """
     Creates a logger for function benchmark times
@@ -39,63 +302,23 @@ def create_benchmark(name, log_file, level=logging.INFO):
     :param str log_file: Filename
     :return obj: Logger
     """
-    handler = logging.FileHandler(log_file)
-    rtf_handler = RotatingFileHandler(log_file, maxBytes=30000, backupCount=0)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
-    handler.setFormatter(formatter)
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(handler)
-    logger.addHandler(rtf_handler)
+    # Benchmarks only go to their own file, and only get one handler however many times this is called
+    logger.propagate = False
+    if not logger.handlers:
+        rtf_handler = SharedRotatingFileHandler(log_file, maxBytes=1000000, backupCount=1, delay=True)
+        rtf_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(_queued(rtf_handler))
     return logger
 
 
 def create_logger(name):
     """
-    Creates a logger with the below attributes.
+    Creates a logger with the below attributes. Logging is set up with init_logging() the first time this is called.
     :param str name: Name of the logger
     :return obj: Logger
     """
-    logging.config.dictConfig({
-        'version': 1,
-        'disable_existing_loggers': False,
-        'formatters': {
-            'simple': {
-                'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
-            },
-            'detailed': {
-                'format': '%(asctime)s %(module)-17s line:%(lineno)-4d '
-                          '%(levelname)-8s %(message)s'
-            },
-            'email': {
-                'format': 'Timestamp: %(asctime)s\nModule: %(module)s\n'
-                          'Line: %(lineno)d\nMessage: %(message)s'
-            },
-        },
-        'handlers': {
-            # 'stream': {
-            #     'level': 'DEBUG',
-            #     'class': 'logging.StreamHandler',
-            #     "formatter": "simple"
-            # },
-            "file": {
-                "level": "DEBUG",
-                "formatter": "simple",
-                "class": "logging.handlers.RotatingFileHandler",
-                "filename": "debug.log",
-                'mode': 'a',
-                'maxBytes': 30000,
-                'backupCount': 0
-            }
-        },
-        'loggers': {
-            '': {
-                # "handlers": ["stream", "file"],
-                "handlers": ["file"],
-                "level": "DEBUG",
-                'propagate': True
-            }
-        }
-    })
+    if _logging_settings is None:
+        init_logging()
     return logging.getLogger(name)
-
@@ -5,7 +5,7 @@ import os
 # NOAA KEYS is for converting keys from LPD to NOAA
 from alternates import NOAA_KEYS_BY_SECTION, LIPD_NOAA_MAP_FLAT, LIPD_NOAA_MAP_BY_SECTION
 from misc import clean_doi, generate_timestamp, get_authors_as_str
-from loggers import create_logger
+from loggers import create_logger, benchmark
 logger_lpd_noaa = create_logger("LPD_NOAA")
 
 class LPD_NOAA(object):
@@ -89,6 +89,7 @@ class LPD_NOAA(object):
 
     # MAIN
 
+    @benchmark("LPD_NOAA.main")
     def main(self):
         """
         Load in the template file, and run through the parser
@@ -98,42 +99,7 @@ class LPD_NOAA(object):
         # Starting Directory: dir_tmp/dir_bag/data/
 
         try:
-            # convert all lipd keys to noaa keys
-            # timestamp the conversion of the file
-
-            # MISC SETUP FUNCTIONS
-            logger_lpd_noaa.info("Get timestamp")
-            self.noaa_data_sorted["File_Last_Modified_Date"]["Modified_Date"] = generate_timestamp()
-            logger_lpd_noaa.info("Count data tables")
-            self.__get_table_count()
-            # Get measurement tables from metadata, and sort into object self
-            logger_lpd_noaa.info("Sort tables")
-            self.__put_tables_in_self(["paleo", "paleoData", "measurementTable"])
-            self.__put_tables_in_self(["chron", "chronData", "measurementTable"])
-
-            # how many measurement tables exist? this will tell use how many noaa files to create
-            logger_lpd_noaa.info("Make table pairs")
-            self.__get_table_pairs()
-
-            # reorganize data into noaa sections
-            logger_lpd_noaa.info("Map the LiPD data into the NOAA sections")
-            self.__reorganize()
-
-            # special case: earliest_year, most_recent_year, and time unit
-            # self.__check_time_values()
-            # self.__check_time_unit()
-
-            logger_lpd_noaa.info("Get overall data")
-            self.__get_overall_data(self.lipd_data)
-            logger_lpd_noaa.info("Reorganize sensor")
-            self.__reorganize_sensor()
-            logger_lpd_noaa.info("Convert lists to strings")
-            self.__lists_to_str()
-            logger_lpd_noaa.info("Create study name")
-            self.__generate_study_name()
-
-            # END MISC SETUP FUNCTIONS
-
+            self.__setup()
             # Use data in steps_dict to write to
             # self.noaa_data_sorted = self.__key_conversion(self.noaa_data_sorted)
             logger_lpd_noaa.info("Create NOAA texts")
@@ -143,6 +109,66 @@ class LPD_NOAA(object):
         logger_lpd_noaa.info("exit main")
         return
 
+    def stream(self):
+        """
+        Same as main, but yield each NOAA text as soon as it's written, instead of collecting all of them in
+        noaa_file_output. Use this when the texts are sent out one at a time.
+        :return generator: (filename, NOAA text) for each data table pair
+        """
+        logger_lpd_noaa.info("enter stream")
+        try:
+            self.__setup()
+            logger_lpd_noaa.info("Stream NOAA texts")
+            for filename, text in self.__create_texts():
+                yield filename, text
+        except Exception as e:
+            logger_lpd_noaa.error("{}".format(e))
+        logger_lpd_noaa.info("exit stream")
+        return
+
+    @benchmark("LPD_NOAA.setup")
+    def __setup(self):
+        """
+        Sort the LiPD data into the NOAA sections, ready for the texts to be written.
+        :return none:
+        """
+        # convert all lipd keys to noaa keys
+        # timestamp the conversion of the file
+
+        # MISC SETUP FUNCTIONS
+        logger_lpd_noaa.info("Get timestamp")
+        self.noaa_data_sorted["File_Last_Modified_Date"]["Modified_Date"] = generate_timestamp()
+        logger_lpd_noaa.info("Count data tables")
+        self.__get_table_count()
+        # Get measurement tables from metadata, and sort into object self
+        logger_lpd_noaa.info("Sort tables")
+        self.__put_tables_in_self(["paleo", "paleoData", "measurementTable"])
+        self.__put_tables_in_self(["chron", "chronData", "measurementTable"])
+
+        # how many measurement tables exist? this will tell use how many noaa files to create
+        logger_lpd_noaa.info("Make table pairs")
+        self.__get_table_pairs()
+
+        # reorganize data into noaa sections
+        logger_lpd_noaa.info("Map the LiPD data into the NOAA sections")
+        self.__reorganize()
+
+        # special case: earliest_year, most_recent_year, and time unit
+        # self.__check_time_values()
+        # self.__check_time_unit()
+
+        logger_lpd_noaa.info("Get overall data")
+        self.__get_overall_data(self.lipd_data)
+        logger_lpd_noaa.info("Reorganize sensor")
+        self.__reorganize_sensor()
+        logger_lpd_noaa.info("Convert lists to strings")
+        self.__lists_to_str()
+        logger_lpd_noaa.info("Create study name")
+        self.__generate_study_name()
+
+        # END MISC SETUP FUNCTIONS
+        return
+
     # MISC
 
     def get_master(self):
@@ -246,11 +272,11 @@ class LPD_NOAA(object):
                     noaa_key = LIPD_NOAA_MAP_BY_SECTION[header][k]
                     d_out[noaa_key] = v
                 except Exception:
-                    print("lpd_noaa: convert_keys_section: ran into an error converting {}".format(k))
+                    logger_lpd_noaa.error("convert_keys_section: ran into an error converting %s", k)
         except KeyError:
-            print("lpd_noaa: convert_keys_section: KeyError: header key {} is not in NOAA_ALL_DICT".format(header))
+            logger_lpd_noaa.error("convert_keys_section: KeyError: header key %s is not in NOAA_ALL_DICT", header)
         except AttributeError:
-            print("lpd_noaa: convert_keys_section: AttributeError: metdata is wrong data type".format(header))
+            logger_lpd_noaa.error("convert_keys_section: AttributeError: metadata is wrong data type, %s", header)
             return d
         return d_out
 
@@ -285,7 +311,7 @@ class LPD_NOAA(object):
                     # Key not in our dict. Create the blank entry.
                     d[key] = ""
         except Exception:
-            print("lpd_noaa: create_blanks: must section: {}, key".format(section_name, key))
+            logger_lpd_noaa.debug("create_blanks: must section: %s, %s", section_name, key)
         return d
 
     @staticmethod
@@ -425,9 +451,9 @@ class LPD_NOAA(object):
                 if "values" in data:
                     return True
         except KeyError as e:
-            print("values_exist: KeyError: {}".format(e))
+            logger_lpd_noaa.debug("values_exist: KeyError: %s", e)
         except Exception as e:
-            print("values_exist: Excpetion: {}".format(e))
+            logger_lpd_noaa.error("values_exist: Exception: %s", e)
         return False
 
     # REORGANIZE
@@ -513,7 +539,7 @@ class LPD_NOAA(object):
             l = self.noaa_data_sorted["Site_Information"]['geometry']['coordinates']
             locations = ["Northernmost_Latitude", "Southernmost_Latitude", "Easternmost_Longitude",
                          "Westernmost_Longitude", "Elevation"]
-            print("coordinates: {} coordinates found".format(len(l)))
+            logger_lpd_noaa.debug("coordinates: %s coordinates found", len(l))
 
             # Amount of coordinates in the list
             _len_coords = len(l)
@@ -543,7 +569,7 @@ class LPD_NOAA(object):
                 for index, location in enumerate(locations):
                     self.noaa_geo[locations[index]] = l[index]
             else:
-                print("coordinates: too many coordinates given")
+                logger_lpd_noaa.warning("coordinates: too many coordinates given")
         except KeyError as e:
             logger_lpd_noaa.error("coordinates: no coordinate information: {}".format(e))
         except Exception as e:
@@ -579,7 +605,7 @@ class LPD_NOAA(object):
         Places new data into self.noaa_geo temporarily, and then back into self.noaa_data_sorted.
         :return:
         """
-        print("enter reorganize_geo")
+        logger_lpd_noaa.debug("enter reorganize_geo")
 
         try:
             # Geo -> Properties
@@ -587,7 +613,7 @@ class LPD_NOAA(object):
                 noaa_key = self.__get_noaa_key(k)
                 self.noaa_geo[noaa_key] = v
         except KeyError:
-            print("reorganize_geo: KeyError: geo properties")
+            logger_lpd_noaa.debug("reorganize_geo: KeyError: geo properties")
         try:
             # Geo -> Geometry
             self.__reorganize_coordinates()
@@ -834,7 +860,7 @@ class LPD_NOAA(object):
             filename = table['filename']
         except KeyError as e:
             filename = ""
-            print("get_filename: KeyError: Table missing filename, {}".format(e))
+            logger_lpd_noaa.error("get_filename: KeyError: Table missing filename, %s", e)
         except TypeError:
             try:
                 filename = table[0]["filename"]
@@ -858,7 +884,7 @@ class LPD_NOAA(object):
             doi = pub["doi"]
             doi = clean_doi(doi)
         except KeyError:
-            print("get_dois: KeyError: missing a doi key")
+            logger_lpd_noaa.debug("get_dois: KeyError: missing a doi key")
         except Exception as e:
             logger_lpd_noaa.error("get_dois: {}".format(e))
 
@@ -1157,12 +1183,24 @@ class LPD_NOAA(object):
 
     # CREATE FILE REPRESENTATIONS
 
+    @benchmark("LPD_NOAA.create_file")
     def __create_file(self):
         """
         Open text file. Write one section at a time. Close text file. Move completed file to dir_root/noaa/
         :return none:
         """
         logger_lpd_noaa.info("enter create_file")
+        for filename, text in self.__create_texts():
+            self.noaa_file_output[filename] = text
+        # print(self.noaa_file_output)
+        logger_lpd_noaa.info("exit create_file")
+        return
+
+    def __create_texts(self):
+        """
+        Write the NOAA texts, one per data table pair, and yield each one as soon as it is finished.
+        :return generator: (filename, NOAA text)
+        """
         self.__get_output_filenames()
         logger_lpd_noaa.info(self.output_filenames)
         # print(self.noaa_data_sorted)
@@ -1173,8 +1211,8 @@ class LPD_NOAA(object):
                 # self.noaa_file_output[filename] = ""
                 # self.noaa_txt = self.noaa_file_output[filename]
                 self.noaa_txt = ""
-                logger_lpd_noaa.info("creating: {}".format(filename))
-                logger_lpd_noaa.info("write_file: opened output txt file")
+                logger_lpd_noaa.info("creating: %s", filename)
+                logger_lpd_noaa.debug("write_file: opened output txt file")
             except Exception as e:
                 logger_lpd_noaa.error("write_file: failed to open output txt file, {}".format(e))
                 return
@@ -1195,13 +1233,13 @@ class LPD_NOAA(object):
             self.__write_generic('Species')
             self.__write_data(idx)
 
-            self.noaa_file_output[filename] = self.noaa_txt
+            # Hand off the finished text, and drop our reference to it before starting the next one.
+            text, self.noaa_txt = self.noaa_txt, None
             # logger_lpd_noaa.info("closed output text file")
             # reset the max min time unit to none
             self.max_min_time = {"min": "", "max": "", "time": ""}
             # shutil.copy(os.path.join(os.getcwd(), filename), self.dir_root)
-            logger_lpd_noaa.info("exit create_file")
-        # print(self.noaa_file_output)
+            yield filename, text
         return
 
     def __write_top(self, filename):
@@ -1210,7 +1248,7 @@ class LPD_NOAA(object):
         :param int section_num: Section number
         :return none:
         """
-        logger_lpd_noaa.info("writing section: {}".format("top"))
+        logger_lpd_noaa.debug("writing section: %s", "top")
         self.__create_blanks("Top", self.noaa_data_sorted["Top"])
 
         # Start writing the NOAA file section by section, starting at the very top of the template.
@@ -1236,7 +1274,7 @@ class LPD_NOAA(object):
         self.__write_k_v("Dataset_DOI",  ', '.join(self.doi), False, True, False, False)
         # self.__write_k_v("Parameter_Keywords", self.steps_dict[section_num]['parameterKeywords'])
         self.__write_divider()
-        logger_lpd_noaa.info("exit write_top")
+        logger_lpd_noaa.debug("exit write_top")
         return
 
     def __write_generic(self, header, d=None):
@@ -1247,7 +1285,7 @@ class LPD_NOAA(object):
         :param dict d: Section from steps_dict
         :return none:
         """
-        logger_lpd_noaa.info("writing section: {}".format(header))
+        logger_lpd_noaa.debug("writing section: %s", header)
         if not d:
             d = self.noaa_data_sorted[header]
         d = self.__create_blanks(header, d)
@@ -1301,7 +1339,7 @@ class LPD_NOAA(object):
             if not self.noaa_data_sorted["Publication"]:
                 self.noaa_data_sorted["Publication"].append({"pubYear": ""})
             for idx, pub in enumerate(self.noaa_data_sorted["Publication"]):
-                print("publication: {}".format(idx))
+                logger_lpd_noaa.debug("publication: %s", idx)
                 # Do not write out Data Citation publications. Check, and skip if necessary
                 is_data_citation = self.__get_pub_type(pub)
                 if not is_data_citation or is_data_citation and len(self.noaa_data_sorted["Publication"]) == 1:
@@ -1325,7 +1363,7 @@ class LPD_NOAA(object):
         if not self.noaa_data_sorted["Funding_Agency"]:
             self.noaa_data_sorted["Funding_Agency"].append({"grant": "", "agency": ""})
         for idx, entry in enumerate(self.noaa_data_sorted["Funding_Agency"]):
-            print("funding: {}".format(idx))
+            logger_lpd_noaa.debug("funding: %s", idx)
             self.__write_generic('Funding_Agency', entry)
         return
 
@@ -1368,7 +1406,7 @@ class LPD_NOAA(object):
         :param dict table: Paleodata
         :return none:
         """
-        print("writing section: {}".format("Variables"))
+        logger_lpd_noaa.debug("writing section: %s", "Variables")
 
         # Write the template lines first
         self.__write_template_variable()
@@ -1392,7 +1430,7 @@ class LPD_NOAA(object):
                     self.__write_variables_2(data)
 
         except KeyError as e:
-            print("write_variables: KeyError: {} not found".format(e))
+            logger_lpd_noaa.debug("write_variables: KeyError: %s not found", e)
         return
 
     def __write_variables_2(self, col):
@@ -1453,11 +1491,11 @@ class LPD_NOAA(object):
                     try:
                         e = e.replace(",", ";")
                     except AttributeError as ee:
-                        print("write_variables_2: AttributeError: {}, {}".format(e, ee))
+                        logger_lpd_noaa.error("write_variables_2: AttributeError: %s, %s", e, ee)
                     self.noaa_txt += '{}, '.format(e)
             except KeyError as e:
                 self.noaa_txt += '{:<0}'.format(',')
-                print("write_variables: KeyError: missing {}".format(e))
+                logger_lpd_noaa.debug("write_variables: KeyError: missing %s", e)
         self.noaa_txt += '\n#'
         return
 
@@ -1467,7 +1505,7 @@ class LPD_NOAA(object):
         :param dict table: Paleodata dictionary
         :return none:
         """
-        print("writing section: data, csv values from file")
+        logger_lpd_noaa.debug("writing section: data, csv values from file")
         # get filename for this table's csv data
         # filename = self.__get_filename(table)
         # logger_lpd_noaa.info("processing csv file: {}".format(filename))
@@ -1641,6 +1679,6 @@ class LPD_NOAA(object):
                 self.noaa_txt += '\n'
 
         except IndexError:
-            print("_write_data_col_vals: IndexError: couldn't get length of columns")
+            logger_lpd_noaa.error("_write_data_col_vals: IndexError: couldn't get length of columns")
 
         return
\ No newline at end of file
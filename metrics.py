@@ -0,0 +1,294 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from loggers import create_logger, add_benchmark_observer
+
+logger_metrics = create_logger("metrics")
+
+# Histogram bucket upper bounds. Request and stage latencies in seconds, payload sizes in bytes.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _format_labels(labels, extra=None):
+    _pairs = list(labels) + ([extra] if extra else [])
+    if not _pairs:
+        return ""
+    _escaped = ('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in _pairs)
+    return "{" + ",".join(_escaped) + "}"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry(object):
+    """
+    Counters, gauges and histograms for one process. When given a directory, each process writes its values to its own
+    file there, and render() adds up the files of every process. So a scrape of any one app worker reports the
+    whole service, conversion pool workers included.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.flush_interval = 1
+        self._metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+        self._collectors = []
+        self._pid = os.getpid()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def configure(self, path, flush_interval=1):
+        """
+        Share values with the other processes through a directory.
+
+        :param str path: Directory for the per-process files. None to keep values in this process only.
+        :param float flush_interval: Seconds between writes of this process's file
+        :return none:
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        return
+
+    def _after_fork(self):
+        # A forked process starts with its own empty values, or the parent's would be counted twice
+        self._lock = threading.Lock()
+        self._values = {}
+        self._dirty = False
+        self._thread = None
+        self._pid = os.getpid()
+
+    def register(self, name, kind, help_text, buckets=None, aggregate="sum"):
+        """
+        Declare a metric. Declaring one again is a no-op.
+
+        :param str name: Metric name
+        :param str kind: COUNTER, GAUGE or HISTOGRAM
+        :param str help_text: Description shown in the exposition
+        :param tuple buckets: Histogram bucket upper bounds
+        :param str aggregate: How a gauge is combined across processes: "sum" of the live processes, or "max"
+        :return none:
+        """
+        self._metrics.setdefault(name, {"kind": kind, "help": help_text, "buckets": tuple(buckets or ()),
+                                        "aggregate": aggregate})
+        return
+
+    def add_collector(self, fn):
+        """
+        Add a function that sets gauges from some other state, called before each write and render.
+
+        :param callable fn: Called with no arguments
+        :return none:
+        """
+        self._collectors.append(fn)
+        return
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+        self._ensure_flusher()
+        return
+
+    def set(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = value
+            self._dirty = True
+        self._ensure_flusher()
+        return
+
+    def set_max(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            if value > self._values.get(key, float("-inf")):
+                self._values[key] = value
+                self._dirty = True
+        self._ensure_flusher()
+        return
+
+    def observe(self, name, value, **labels):
+        buckets = self._metrics[name]["buckets"]
+        key = (name, _labels(labels))
+        with self._lock:
+            _hist = self._values.get(key)
+            if _hist is None:
+                # One count per bucket, plus the +Inf bucket, then the sum
+                _hist = self._values[key] = [0] * (len(buckets) + 1) + [0.0]
+            _hist[bisect_left(buckets, value)] += 1
+            _hist[-1] += value
+            self._dirty = True
+        self._ensure_flusher()
+        return
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the time taken by the block into a histogram, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _ensure_flusher(self):
+        if self.path and self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                    self._thread.start()
+        return
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger_metrics.error("flush: {}".format(e))
+
+    def _collect(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger_metrics.error("collect: {}".format(e))
+        return
+
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return [[name, list(labels), value[:] if isinstance(value, list) else value]
+                    for (name, labels), value in self._values.items()]
+
+    def flush(self):
+        """
+        Write this process's values to its file, if they changed since the last write.
+        :return none:
+        """
+        if not self.path:
+            return
+        self._collect()
+        if not self._dirty:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        _file = os.path.join(self.path, "metrics_{}.json".format(self._pid))
+        _tmp = _file + ".tmp"
+        with open(_tmp, "w") as f:
+            json.dump({"pid": self._pid, "values": self._snapshot()}, f)
+        os.replace(_tmp, _file)
+        return
+
+    def _read_all(self):
+        """
+        Read the values of every process.
+
+        :return list: (pid, values) for each process
+        """
+        if not self.path:
+            self._collect()
+            return [(self._pid, self._snapshot())]
+        self.flush()
+        out = []
+        for _file in glob.glob(os.path.join(self.path, "metrics_*.json")):
+            try:
+                with open(_file, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # The file was replaced or removed while being read
+                continue
+            out.append((data["pid"], data["values"]))
+        return out
+
+    def render(self):
+        """
+        Combine the values of every process, in the Prometheus text exposition format. Counters and histograms are
+        added up across every process that ever wrote a file. Gauges only count the processes still running.
+
+        :return str: Exposition text
+        """
+        merged = {}
+        for pid, values in self._read_all():
+            _live = None
+            for name, labels, value in values:
+                meta = self._metrics.get(name)
+                if meta is None:
+                    continue
+                if meta["kind"] == GAUGE:
+                    if _live is None:
+                        _live = _alive(pid)
+                    if not _live:
+                        continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if key not in merged:
+                    merged[key] = value
+                elif meta["kind"] == HISTOGRAM:
+                    merged[key] = [a + b for a, b in zip(merged[key], value)]
+                elif meta["kind"] == GAUGE and meta["aggregate"] == "max":
+                    merged[key] = max(merged[key], value)
+                else:
+                    merged[key] = merged[key] + value
+
+        lines = []
+        for name in sorted(self._metrics):
+            meta = self._metrics[name]
+            lines.append("# HELP {} {}".format(name, meta["help"]))
+            lines.append("# TYPE {} {}".format(name, meta["kind"]))
+            for (_name, labels), value in sorted(merged.items()):
+                if _name != name:
+                    continue
+                if meta["kind"] != HISTOGRAM:
+                    lines.append("{}{} {}".format(name, _format_labels(labels), value))
+                    continue
+                _cumulative = 0
+                for bound, count in zip(meta["buckets"] + ("+Inf",), value[:-1]):
+                    _cumulative += count
+                    lines.append("{}_bucket{} {}".format(name, _format_labels(labels, ("le", str(bound))), _cumulative))
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), value[-1]))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), _cumulative))
+        return "\n".join(lines) + "\n"
+
+
+# One registry per process, shared by every module
+REGISTRY = Registry()
+
+REGISTRY.register("lipdnet_requests_total", COUNTER, "Requests handled, by route, method and status code.")
+REGISTRY.register("lipdnet_request_seconds", HISTOGRAM, "Time to build the response, by route.", LATENCY_BUCKETS)
+REGISTRY.register("lipdnet_request_payload_bytes", HISTOGRAM, "Size of request bodies, by route.", SIZE_BUCKETS)
+REGISTRY.register("lipdnet_request_payload_bytes_max", GAUGE, "Largest request body seen, by route.",
+                  aggregate="max")
+REGISTRY.register("lipdnet_stage_seconds", HISTOGRAM, "Time spent in each benchmarked stage: conversion steps and predictions.",
+                  LATENCY_BUCKETS)
+
+
+def _observe_stage(name, seconds):
+    REGISTRY.observe("lipdnet_stage_seconds", seconds, stage=name)
+
+
+# Every stage timed with loggers.benchmark goes into the stage histogram
+add_benchmark_observer(_observe_stage)
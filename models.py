@@ -0,0 +1,502 @@
+import gc
+import glob
+import hashlib
+import json
+import os
+import resource
+import threading
+import time
+
+from loggers import create_logger
+
+logger_models = create_logger("models")
+
+# Ground truth keys of the names sets, by their index in the prediction chain
+NAMES_SET_KEYS = {0: 'archive_types', 1: 'proxy_obs_types', 2: 'units', 3: 'int_var', 4: 'int_var_det', 5: 'inf_var',
+                  6: 'inf_var_units'}
+
+# Archive types /getArchives leaves out of its list
+COVERED_ARCHIVES = {'MarineSediment', 'LakeSediment', 'GlacierIce', 'GroundIce', 'TerrestrialSediment', 'MollusckShell',
+                    'MolluskShell', 'MolluskShells', 'molluskshell'}
+
+# Files that make up one version of the models, by the name they are reported under
+ARTIFACTS = {'lstm': 'model_lstm_interp_*.pth', 'lstm_units': 'model_lstm_units_*.pth',
+             'token_info': 'model_token_info_*.txt', 'token_units_info': 'model_token_units_info_*.txt',
+             'mc': 'model_mc_*.txt', 'ground_truth': 'ground_truth_label_*.json'}
+
+
+def get_latest_file_with_path(path, *paths):
+    '''
+    Method to get the full path name for the latest file for the input parameter in paths.
+    This method uses the os.path.getctime function to get the most recently created file that matches the filename pattern in the provided path.
+
+    Parameters
+    ----------
+    path : string
+        Root pathname for the files.
+    *paths : string list
+        These are the var args field, the optional set of strings to denote the full path to the file names.
+
+    Returns
+    -------
+    latest_file : string
+        Full path name for the latest file provided in the paths parameter.
+
+    '''
+    fullpath = os.path.join(path, *paths)
+    list_of_files = glob.glob(fullpath)
+    if not list_of_files:
+        return None
+    latest_file = max(list_of_files, key=os.path.getctime)
+    return latest_file
+
+
+def get_average_half_len_for_autocomplete(names_set):
+    """
+    names_set contains the list of all the possible values for each fieldType
+    This method calculates half of the average length of value for each fieldType.
+
+    Possible use case during autocomplete search, when a user enters half the characters for a fieldType,
+    we can use edit distance to get the most similar words to the provided word.
+
+    Parameters
+    ----------
+    names_set : dict
+        Set of possible values for each fieldType, keyed by its index in the prediction chain.
+
+    Returns
+    -------
+    avg_half_len_map : dict
+        Stores the average half length for each fieldType.
+
+    """
+    avg_half_len_map = {}
+    for key, in_set in names_set.items():
+        sum_len_set = sum([len(word) for word in in_set])
+        avg_half_len_map[key] = sum_len_set//(len(in_set) * 2) if in_set else 0
+    return avg_half_len_map
+
+
+def find_artifacts(model_dir):
+    '''
+    Find the latest file of each kind in ARTIFACTS. The predictors are given these files to load, so they load what
+    the version was worked out from.
+
+    Parameters
+    ----------
+    model_dir : string
+        Directory with the model files.
+
+    Returns
+    -------
+    files : dict
+        Path of the latest file of each kind, or None if there isn't one.
+
+    '''
+    return {name: get_latest_file_with_path(model_dir, pattern) for name, pattern in ARTIFACTS.items()}
+
+
+def artifacts_version(files):
+    '''
+    Short id for a set of model files. It changes when any file is replaced, or rewritten in place.
+
+    Parameters
+    ----------
+    files : dict
+        Path of each model file, from find_artifacts.
+
+    Returns
+    -------
+    string
+        Version id.
+
+    '''
+    _hash = hashlib.sha1()
+    for name in sorted(files):
+        path = files[name]
+        try:
+            _stat = os.stat(path) if path else None
+        except OSError:
+            _stat = None
+        _hash.update(repr((name, path, _stat and _stat.st_mtime_ns, _stat and _stat.st_size)).encode('utf-8'))
+    return _hash.hexdigest()[:12]
+
+
+def get_rss():
+    '''
+    Resident memory of this process, in bytes. Falls back to the peak resident memory where /proc isn't available.
+
+    Returns
+    -------
+    int
+        Resident memory in bytes.
+
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Predictors(object):
+    '''
+    One version of the prediction models and the ground truth labels. Each one is loaded from the model directory the
+    first time it is used, so a worker that only serves conversions never imports torch or reads a model file.
+    Safe to share between threads: a model is only ever loaded once, and loading one doesn't hold up the others.
+
+    '''
+
+    def __init__(self, model_dir, top_k=5, files=None):
+        '''
+        Parameters
+        ----------
+        model_dir : string
+            Directory with the model_*, model_token_* and ground_truth_label_* files.
+        top_k : int
+            Number of values each predictor returns.
+        files : dict
+            Model files this version is made of, from find_artifacts. Found in model_dir if not given.
+
+        '''
+        self.model_dir = model_dir
+        self.top_k = top_k
+        self.files = files if files is not None else find_artifacts(model_dir)
+        self.version = artifacts_version(self.files)
+        self._loaded = {}
+        self._locks = {name: threading.Lock() for name in self._loaders()}
+        # Report of warm_up(), once it has run
+        self.warm_up_report = None
+
+    def _loaders(self):
+        return {'ground_truth': self._load_ground_truth, 'mc3': self._load_mc3, 'mc4': self._load_mc4,
+                'lstm': self._load_lstm}
+
+    def _get(self, name):
+        '''
+        Return a model, loading it first if this is its first use.
+
+        '''
+        try:
+            return self._loaded[name]
+        except KeyError:
+            pass
+        with self._locks[name]:
+            if name not in self._loaded:
+                start = time.time()
+                self._loaded[name] = self._loaders()[name]()
+                logger_models.info("load: {} loaded in {:.2f} seconds".format(name, time.time() - start))
+        return self._loaded[name]
+
+    def _load_ground_truth(self):
+        with open(self.files['ground_truth'], 'r') as json_file:
+            return json.load(json_file)
+
+    def _load_mc3(self):
+        from MCpredict import MCpredict
+        return MCpredict(3, self.top_k, model_file_path=self.model_dir, ground_truth_path=self.model_dir,
+                         files=self.files)
+
+    def _load_mc4(self):
+        from MCpredict import MCpredict
+        return MCpredict(4, self.top_k, model_file_path=self.model_dir, ground_truth_path=self.model_dir,
+                         files=self.files)
+
+    def _load_lstm(self):
+        from LSTMpredict import LSTMpredict
+        return LSTMpredict(model_file_path=self.model_dir, ground_truth_file_path=self.model_dir, topk=self.top_k,
+                           files=self.files)
+
+    @property
+    def ground_truth(self):
+        return self._get('ground_truth')
+
+    @property
+    def mc3(self):
+        return self._get('mc3')
+
+    @property
+    def mc4(self):
+        return self._get('mc4')
+
+    @property
+    def lstm(self):
+        return self._get('lstm')
+
+    @property
+    def archives_map(self):
+        return self.ground_truth['archives_map']
+
+    @property
+    def archive_names(self):
+        '''
+        Archive types for the LiPD playground to offer, in title case. Worked out once for this version.
+
+        '''
+        try:
+            return self._loaded['archive_names']
+        except KeyError:
+            pass
+        archives_map = self.archives_map
+        final_arch = set()
+        for key, value in archives_map.items():
+            logger_models.debug("archive_names: %s: %s", key, value)
+            if key in COVERED_ARCHIVES:
+                continue
+            elif key.title() in archives_map:
+                final_arch.add(key.title())
+            elif key.title() is not value:
+                final_arch.add(key.title())
+        self._loaded['archive_names'] = sorted(final_arch)
+        return self._loaded['archive_names']
+
+    @property
+    def avg_half_len_map(self):
+        '''
+        Half the average length of the values of each fieldType, from the same names sets the LSTM model uses.
+
+        '''
+        try:
+            return self._loaded['avg_half_len_map']
+        except KeyError:
+            pass
+        names_set = {}
+        for key, name in NAMES_SET_KEYS.items():
+            names_set[key] = set(self.ground_truth[name])
+            # The LSTM model strips the spaces from every fieldType but the last
+            if key < 6:
+                names_set[key] = {val.replace(' ', '') for val in names_set[key]}
+        self._loaded['avg_half_len_map'] = get_average_half_len_for_autocomplete(names_set)
+        return self._loaded['avg_half_len_map']
+
+    @property
+    def term_counts(self):
+        '''
+        How many times each value comes next in the ground truth chains, by its lowercased value. How common a value
+        is, for ranking autocomplete suggestions. Worked out once for this version.
+
+        '''
+        try:
+            return self._loaded['term_counts']
+        except KeyError:
+            pass
+        counts = {}
+        for values in self.ground_truth['ground_truth'].values():
+            for val in values:
+                val = val.lower()
+                counts[val] = counts.get(val, 0) + 1
+        self._loaded['term_counts'] = counts
+        return self._loaded['term_counts']
+
+    def load_all(self):
+        '''
+        Load every model now, instead of on first use.
+
+        Returns
+        -------
+        None.
+
+        '''
+        for name in self._loaders():
+            self._get(name)
+        return
+
+    def _sample_chains(self):
+        '''
+        Chains to warm the predictors up with: each archive type on its own, and followed by its most common proxy
+        observation type, as the LiPD playground sends them once the proxy is chosen.
+
+        '''
+        labels = self.ground_truth['ground_truth']
+        chains = []
+        for archive in sorted(set(self.archives_map.values())):
+            chains.append(archive)
+            proxies = [value for value in labels.get(archive, []) if value != 'NA']
+            if proxies:
+                chains.append('{},{}'.format(archive, proxies[0]))
+        return chains
+
+    def warm_up(self):
+        '''
+        Load every model, then run a measured and an inferred prediction through each predictor for every archive type,
+        so the first requests don't pay for the lazy set up in torch, memory growing to its working size, and the
+        first reads of the weights.
+
+        Returns
+        -------
+        report : dict
+            Time taken, predictions run, and the predictions that failed. Raises if a model fails to load.
+
+        '''
+        start = time.time()
+        self.load_all()
+        report = {'predictions': 0, 'errors': []}
+        for chain in self._sample_chains():
+            # MC uses the third order model for archive,proxy chains and the fourth order one for the rest
+            predictors = [('lstm', self.lstm.predictForSentence), ('mc4', self.mc4.predict_seq)]
+            if ',' in chain:
+                predictors.append(('mc3', self.mc3.predict_seq))
+            for name, predict in predictors:
+                for isInferred in (False, True):
+                    try:
+                        predict(chain, isInferred=isInferred)
+                        report['predictions'] += 1
+                    except Exception as e:
+                        report['errors'].append('{}: {}: {}'.format(name, chain, e))
+        # So are the lookups /getArchives and /autocomplete work out on first use
+        self.archive_names
+        self.avg_half_len_map
+        report['seconds'] = round(time.time() - start, 3)
+        self.warm_up_report = report
+        logger_models.info("warm_up: version %s: %s predictions in %ss, %s failed", self.version,
+                           report['predictions'], report['seconds'], len(report['errors']))
+        return report
+
+    def loaded(self):
+        '''
+        Returns
+        -------
+        list
+            Names of the models loaded so far.
+
+        '''
+        return [name for name in self._loaders() if name in self._loaded]
+
+
+class ModelManager(object):
+    '''
+    Holds the live version of the prediction models, and swaps in a new version when new model files are deployed,
+    without a restart.
+
+    A request takes the live version once with current() and uses it to the end, so it is never affected by a swap.
+    A new version is loaded and warmed on the side while the old one keeps serving, then swapped in with one assignment.
+    The old version is freed once the last request using it finishes.
+
+    '''
+
+    def __init__(self, model_dir, top_k=5, interval=60):
+        '''
+        Parameters
+        ----------
+        model_dir : string
+            Directory with the model files.
+        top_k : int
+            Number of values each predictor returns.
+        interval : float
+            Seconds between checks for new model files. 0 to only reload when asked to.
+
+        '''
+        self.model_dir = model_dir
+        self.top_k = top_k
+        self.interval = interval
+        self.last_reload = None
+        self._current = Predictors(model_dir, top_k)
+        self._pending = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        '''
+        Returns
+        -------
+        Predictors
+            The live version of the models.
+
+        '''
+        return self._current
+
+    def start(self):
+        '''
+        Start checking for new model files in the background, every interval seconds.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="model-reload", daemon=True)
+            self._thread.start()
+        return
+
+    def stop(self):
+        self._stop.set()
+        return
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger_models.error("watch: {}".format(e))
+        return
+
+    def check(self):
+        '''
+        Look for new model files, and reload if there are. New files are only loaded once they are unchanged for two
+        checks in a row, so a file that is still being copied in isn't picked up half written.
+
+        Returns
+        -------
+        dict
+            Reload report, or None if nothing was reloaded.
+
+        '''
+        files = find_artifacts(self.model_dir)
+        version = artifacts_version(files)
+        if version == self._current.version:
+            self._pending = None
+            return None
+        if version != self._pending:
+            logger_models.info("check: new model files found, version {}".format(version))
+            self._pending = version
+            return None
+        self._pending = None
+        return self.reload(files)
+
+    def reload(self, files=None):
+        '''
+        Load a new version of the models and swap it in. The models the live version has already loaded are loaded
+        into the new one before the swap, so no request pays for loading them, and it is warmed up too if the live
+        version was. If anything fails to load, the live version stays.
+
+        Parameters
+        ----------
+        files : dict
+            Model files to load, from find_artifacts. The latest files in model_dir if not given.
+
+        Returns
+        -------
+        dict
+            Versions before and after, time taken, and resident memory before, during and after the overlap.
+
+        '''
+        with self._reload_lock:
+            old = self._current
+            new = Predictors(self.model_dir, self.top_k, files)
+            report = {'old_version': old.version, 'new_version': new.version, 'loaded': old.loaded()}
+            start = time.time()
+            report['rss_before'] = get_rss()
+            try:
+                for name in report['loaded']:
+                    new._get(name)
+                if old.warm_up_report is not None:
+                    new.warm_up()
+            except Exception as e:
+                logger_models.error("reload: version {} failed to load, keeping {}: {}".format(new.version,
+                                                                                              old.version, e))
+                report['error'] = str(e)
+                self.last_reload = report
+                return report
+            report['rss_overlap'] = get_rss()
+            self._current = new
+            del old
+            gc.collect()
+            report['rss_after'] = get_rss()
+            report['seconds'] = round(time.time() - start, 3)
+            report['time'] = time.time()
+            self.last_reload = report
+        logger_models.info("reload: swapped version {old_version} for {new_version} in {seconds}s, "
+                           "rss {rss_before} -> {rss_overlap} -> {rss_after} bytes".format(**report))
+        return report
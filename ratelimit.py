@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+
+from loggers import create_logger
+
+logger_ratelimit = create_logger("ratelimit")
+
+# Delete the counters whose window has passed once every this many hits, instead of on every hit
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage):
+    """
+    Rate limit counters kept in a local SQLite file, so every worker process on the machine counts against the same
+    limits. Without it, each of N workers keeps its own counters and every limit is really N times looser.
+
+    Supports the fixed window strategy, flask_limiter's default. A hit is one upsert, in a database in WAL mode that
+    doesn't wait for the disk. A counter can be lost if the machine goes down, which is fine for rate limits.
+
+        RATELIMIT_STORAGE_URI = "sqlite:///home/cheiser/mysite/ratelimit.db"
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, timeout=5, **options):
+        """
+        :param str uri: sqlite:// followed by the path of the database file
+        :param bool wrap_exceptions: Raise limits.errors.StorageError instead of the sqlite3 error
+        :param float timeout: Seconds to wait for another process's write to finish
+        """
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urllib.parse.urlparse(uri or "")
+        self.path = urllib.parse.unquote(parsed.netloc + parsed.path)
+        if not self.path:
+            raise ConfigurationError("SQLiteStorage: no database file in {}".format(uri))
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._hits = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        """
+        The connection for this thread and process. A connection isn't shared between threads, or carried over a fork.
+
+        :return sqlite3.Connection: Connection
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+                     "expires REAL NOT NULL)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, amount=1):
+        """
+        Add to a counter. A counter whose window has passed starts again from zero, with a new window.
+
+        :param str key: Counter
+        :param int expiry: Seconds until the window of a new counter ends
+        :param int amount: Amount to add, the cost of the request
+        :return int: Value of the counter after adding
+        """
+        now = time.time()
+        conn = self._connection()
+        count = conn.execute(
+            "INSERT INTO counters (key, count, expires) VALUES (?1, ?2, ?3) ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires <= ?4 THEN excluded.count ELSE count + excluded.count END, "
+            "expires = CASE WHEN expires <= ?4 THEN excluded.expires ELSE expires END RETURNING count",
+            (key, amount, now + expiry, now)).fetchone()[0]
+        self._hits += 1
+        if self._hits % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+        return count
+
+    def get(self, key):
+        row = self._connection().execute("SELECT count FROM counters WHERE key = ? AND expires > ?",
+                                         (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute("SELECT expires FROM counters WHERE key = ? AND expires > ?",
+                                         (key, time.time())).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger_ratelimit.error("check: {}: {}".format(self.path, e))
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM counters").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM counters WHERE key = ?", (key,))
+        return
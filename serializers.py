@@ -0,0 +1,140 @@
+import json
+
+import numpy as np
+from flask import Response
+from werkzeug.exceptions import BadRequest
+
+from compression import read_body, MAX_BODY_SIZE
+from loggers import create_logger
+
+logger_serializers = create_logger("serializers")
+
+# Faster JSON and MessagePack backends are used when they're installed. Stdlib json is always there as a fallback.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Every backend raises a ValueError for a malformed body: json.JSONDecodeError, orjson.JSONDecodeError, and msgpack's
+# ExtraData, FormatError and StackError. A msgpack map with an unhashable key is a TypeError.
+_DECODE_ERRORS = (ValueError, TypeError) + ((msgpack.UnpackException,) if msgpack else ())
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/msgpack", "application/vnd.msgpack")
+
+# Every backend here writes numpy scalars and arrays as plain numbers and lists, so the data never needs a pass to
+# turn numpy types back into python types before it's sent.
+NUMPY_NATIVE = True
+
+if orjson:
+    _ORJSON_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(o):
+    """
+    Fallback for types the encoders don't know. Numpy scalars and arrays become python numbers and lists.
+
+    :param any o: Object that could not be encoded
+    :return any: Encodable version of the object
+    """
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    raise TypeError("Object of type {} is not serializable".format(type(o).__name__))
+
+
+def is_msgpack(mimetype):
+    """
+    Check if a mimetype is one of the MessagePack names.
+
+    :param str mimetype: Mimetype
+    :return bool:
+    """
+    return bool(msgpack) and mimetype in MSGPACK_TYPES
+
+
+def loads(data, mimetype=JSON):
+    """
+    Decode a request body.
+
+    :param bytes data: Raw body
+    :param str mimetype: Content type of the body
+    :return any: Decoded data
+    :raises BadRequest: The body is not valid JSON or MessagePack
+    """
+    try:
+        if is_msgpack(mimetype):
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if orjson:
+            return orjson.loads(data)
+        return json.loads(data)
+    except _DECODE_ERRORS as e:
+        raise BadRequest("Could not decode {} body: {}".format("MessagePack" if is_msgpack(mimetype) else "JSON", e))
+
+
+def dumps(obj, mimetype=JSON):
+    """
+    Encode data for a response body.
+
+    :param any obj: Data
+    :param str mimetype: Content type to encode as
+    :return bytes: Encoded data
+    """
+    if is_msgpack(mimetype):
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    if orjson:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTS)
+    return json.dumps(obj, default=_default).encode("utf-8")
+
+
+def negotiate(request):
+    """
+    Pick the response type from the request's Accept header. MessagePack is only picked when it's installed and the
+    client prefers it. Everything else gets JSON.
+
+    :param Request request: Flask request
+    :return str: Response mimetype
+    """
+    if msgpack:
+        _best = request.accept_mimetypes.best_match((JSON,) + MSGPACK_TYPES, default=JSON)
+        if _best in MSGPACK_TYPES:
+            return MSGPACK
+    return JSON
+
+
+def decode_request(request, max_size=MAX_BODY_SIZE):
+    """
+    Decode the body of a request, as JSON or as MessagePack depending on its Content-Type. Compressed bodies are
+    decompressed first.
+
+    :param Request request: Flask request
+    :param int max_size: Largest body to accept, after decompression
+    :return any: Decoded body, or None if the body is empty
+    """
+    data = read_body(request, max_size)
+    if not data:
+        return None
+    return loads(data, request.mimetype)
+
+
+def encode_response(obj, request, status=200):
+    """
+    Build a response for the data, in the format the client asked for.
+
+    :param any obj: Data
+    :param Request request: Flask request
+    :param int status: HTTP status code
+    :return Response: Flask response
+    """
+    mimetype = negotiate(request)
+    response = Response(dumps(obj, mimetype), status=status, mimetype=mimetype)
+    response.vary.add("Accept")
+    return response
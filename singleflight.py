@@ -0,0 +1,73 @@
+import threading
+
+from loggers import create_logger
+
+logger_singleflight = create_logger("singleflight")
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Runs a function once for every caller asking for the same key at the same time. The first caller runs it, and the
+    ones that come in while it is running wait for it and get the same result, or the same exception. Nothing is kept
+    once it finishes: the next caller runs it again. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs), or wait for the run already going for the same key.
+
+        :param hashable key: Identifies the result. Callers with equal keys must be fine with each other's result.
+        :param callable fn: Function to run
+        :return tuple: (result, True if it came from another caller's run)
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger_singleflight.debug("do: %s shared with %s callers", key, call.waiters)
+        return call.result, False
+
+    def stats(self):
+        """
+        :return dict: Calls so far, how many of them shared another caller's run, and the runs going now
+        """
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls),
+                    "coalesce_ratio": round(self.coalesced / self.calls, 4) if self.calls else 0.0}
@@ -0,0 +1,102 @@
+import random
+
+from loggers import create_logger
+
+logger_synthetic = create_logger("synthetic")
+
+# Words for the string columns
+WORDS = ["laminated", "turbidite", "tephra", "hiatus", "bioturbated", "slump", "organic", "sandy", "clay", "silt"]
+
+
+def synthetic_lipd(dsn="Synthetic.Dataset.2021", paleo_tables=1, chron_tables=0, columns=4, rows=100,
+                   ensemble_tables=0, ensemble_members=10, string_columns=0, missing=0.0, missing_value="nan", seed=0):
+    """
+    Create a synthetic LiPD payload in the shape the LiPD playground sends to /api/noaa: metadata indexed by number,
+    and the CSV data for each table as a list of columns, keyed by table filename.
+
+    Every paleo table has a depth and an age column, then its data columns. Every chron table has depth, age and age
+    uncertainty columns. Ensemble tables go in the chron models, one depth column and a list of member columns.
+
+    :param str dsn: Dataset name
+    :param int paleo_tables: Number of paleo measurement tables
+    :param int chron_tables: Number of chron measurement tables
+    :param int columns: Number of numeric data columns in each paleo table, besides depth and age
+    :param int rows: Number of rows in every table
+    :param int ensemble_tables: Number of ensemble tables, spread over the chron models
+    :param int ensemble_members: Number of member columns in each ensemble table
+    :param int string_columns: Number of text columns in each paleo table
+    :param float missing: Share of the data cells, 0 to 1, that are missing values
+    :param str missing_value: Missing value written into the CSV data
+    :param int seed: Random seed. The same arguments and seed always give the same payload.
+    :return dict: {"metadata": ..., "csvs": ...}
+    """
+    rng = random.Random(seed)
+    csvs = {}
+    metadata = {
+        "dataSetName": dsn,
+        "archiveType": "MarineSediment",
+        "lipdVersion": 1.3,
+        "investigators": "Synthetic, A.",
+        "geo": {"type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(rng.uniform(-180, 180), 3),
+                                                              round(rng.uniform(-90, 90), 3), -1200]},
+                "properties": {"siteName": "Synthetic Site"}},
+        "pub": [{"author": "Synthetic, A.", "title": "Synthetic data", "journal": "None", "pubYear": "2021",
+                 "identifier": [{"type": "doi", "id": "10.0000/synthetic"}]}],
+        "paleoData": [],
+    }
+
+    depth = [round(i * 0.5, 2) for i in range(rows)]
+    age = [round(d * 12.5 + rng.uniform(-2, 2), 2) for d in depth]
+
+    def _missing(values):
+        if missing <= 0:
+            return values
+        return [missing_value if rng.random() < missing else v for v in values]
+
+    def _column(number, name, units, **kwargs):
+        column = {"number": number, "variableName": name, "units": units, "TSid": "SYN{}{}".format(name, number)}
+        column.update(kwargs)
+        return column
+
+    for t in range(paleo_tables):
+        filename = "{}.paleo{}measurement0.csv".format(dsn, t)
+        _columns = [_column(1, "depth", "cm", variableType="measured"),
+                    _column(2, "age", "BP", variableType="inferred", inferredVariableType="age")]
+        _data = [depth, age]
+        for c in range(columns):
+            _columns.append(_column(len(_columns) + 1, "proxy{}".format(c), "permil", variableType="measured",
+                                    proxyObservationType="d18O", measurementMaterial="foraminifera",
+                                    interpretation=[{"variable": "T", "direction": "negative"}]))
+            _data.append(_missing([round(rng.gauss(0, 1), 4) for _ in range(rows)]))
+        for c in range(string_columns):
+            _columns.append(_column(len(_columns) + 1, "notes{}".format(c), "unitless", dataType="string"))
+            _data.append([rng.choice(WORDS) for _ in range(rows)])
+        metadata["paleoData"].append({"measurementTable": [{"filename": filename, "missingValue": missing_value,
+                                                            "columns": _columns}]})
+        csvs[filename] = _data
+
+    if chron_tables or ensemble_tables:
+        metadata["chronData"] = []
+    for t in range(max(chron_tables, 1 if ensemble_tables else 0)):
+        section = {}
+        if t < chron_tables:
+            filename = "{}.chron{}measurement0.csv".format(dsn, t)
+            section["measurementTable"] = [{"filename": filename, "missingValue": missing_value, "columns": [
+                _column(1, "depth", "cm"), _column(2, "age", "BP"), _column(3, "ageUncertainty", "yr")]}]
+            csvs[filename] = [depth, age, _missing([round(rng.uniform(10, 100), 1) for _ in range(rows)])]
+        metadata["chronData"].append(section)
+
+    # Spread the ensemble tables over the chron sections' models
+    for e in range(ensemble_tables):
+        section = metadata["chronData"][e % len(metadata["chronData"])]
+        model = section.setdefault("model", [{"ensembleTable": []}])[0]
+        filename = "{}.chron{}model0ensemble{}.csv".format(dsn, e % len(metadata["chronData"]),
+                                                             len(model["ensembleTable"]))
+        model["ensembleTable"].append({"filename": filename, "missingValue": missing_value, "columns": [
+            _column(1, "depth", "cm"),
+            _column(list(range(2, ensemble_members + 2)), "age", "BP")]})
+        csvs[filename] = [depth] + [[round(a + rng.gauss(0, 50), 1) for a in age] for _ in range(ensemble_members)]
+
+    logger_synthetic.info("synthetic_lipd: {}: {} tables, {} rows".format(dsn, len(csvs), rows))
+    return {"metadata": metadata, "csvs": csvs}
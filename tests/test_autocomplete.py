@@ -0,0 +1,68 @@
+import pytest
+
+from autocomplete import Vocabulary, rank, EXACT, PREFIX, FUZZY
+from editdistance import levenshtein
+
+
+WORDS = ["D18O", "D13C", "Dd", "Density", "Depth", "Temperature", "d18o", "Tree Ring Width", "Trace Elements"]
+
+
+@pytest.fixture
+def vocabulary():
+    return Vocabulary({"proxyObservationType": WORDS, "empty": []}, ("autocomplete_file_1.json", 1, 1))
+
+
+def test_starting_with(vocabulary):
+    assert vocabulary.starting_with("proxyObservationType", "d1") == ["D18O", "D13C", "d18o"]
+    assert vocabulary.starting_with("proxyObservationType", "TR") == ["Tree Ring Width", "Trace Elements"]
+    assert vocabulary.starting_with("proxyObservationType", "") == WORDS
+    assert vocabulary.starting_with("proxyObservationType", "x") == []
+
+
+def test_starting_with_unknown_field(vocabulary):
+    assert vocabulary.starting_with("empty", "d") == []
+    assert vocabulary.starting_with("archiveType", "d") == []
+
+
+def test_within(vocabulary):
+    # Both spellings of the same lowercased value are returned, in file order
+    assert vocabulary.within("proxyObservationType", "D18", 1) == [("D18O", 1), ("d18o", 1)]
+    assert vocabulary.within("proxyObservationType", "depht", 2) == [("Depth", 2)]
+    assert vocabulary.within("proxyObservationType", "tempreature", 2) == [("Temperature", 2)]
+    assert vocabulary.within("empty", "d", 2) == []
+
+
+def test_within_matches_levenshtein(vocabulary):
+    for query in ["d", "DD", "dens", "tree ring", "trace element", "temp"]:
+        for max_distance in range(4):
+            expected = [(w, levenshtein(query.lower(), w.lower())) for w in WORDS]
+            expected = [(w, d) for w, d in expected if d <= max_distance]
+            assert vocabulary.within("proxyObservationType", query, max_distance) == expected
+
+
+def test_version_follows_the_file():
+    a = Vocabulary({"f": ["x"]}, ("autocomplete_file_1.json", 1, 1))
+    b = Vocabulary({"f": ["x"]}, ("autocomplete_file_1.json", 2, 1))
+    assert a.version != b.version
+    assert a.version == Vocabulary({"f": ["y"]}, ("autocomplete_file_1.json", 1, 1)).version
+
+
+CANDIDATES = [("Depth", FUZZY, 2), ("Dd", PREFIX, 0), ("D18O", PREFIX, 0), ("d", EXACT, 0), ("Density", FUZZY, 1),
+              ("D13C", PREFIX, 0)]
+
+
+def test_rank_order():
+    # Exact, then prefix, then fuzzy from the closest out. Ties keep the order they came in.
+    assert rank(CANDIDATES) == ["d", "Dd", "D18O", "D13C", "Density", "Depth"]
+
+
+def test_rank_common_values_first():
+    assert rank(CANDIDATES, counts={"d13c": 5, "d18o": 2}) == ["d", "D13C", "D18O", "Dd", "Density", "Depth"]
+
+
+def test_rank_pages_match_the_full_ranking():
+    counts = {"d13c": 5, "depth": 1}
+    ranked = rank(CANDIDATES, counts)
+    for limit in range(1, 7):
+        for offset in range(7):
+            assert rank(iter(CANDIDATES), counts, limit, offset) == ranked[offset:offset + limit]
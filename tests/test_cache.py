@@ -0,0 +1,83 @@
+from cache import ByteLRU, conversion_key
+
+
+def test_get_and_put():
+    lru = ByteLRU(100)
+    assert lru.get("a") is None
+    assert lru.put("a", "A", 10)
+    assert lru.get("a") == "A"
+    assert lru.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": 10, "max_bytes": 100}
+
+
+def test_least_recently_used_is_dropped_first():
+    lru = ByteLRU(30)
+    lru.put("a", "A", 10)
+    lru.put("b", "B", 10)
+    lru.put("c", "C", 10)
+    # "a" is used again, so "b" is now the least recently used
+    lru.get("a")
+    lru.put("d", "D", 10)
+    assert lru.get("b") is None
+    assert [lru.get(k) for k in "acd"] == ["A", "C", "D"]
+    assert lru.stats()["bytes"] == 30
+
+
+def test_bounded_by_bytes_not_entries():
+    lru = ByteLRU(30)
+    lru.put("a", "A", 10)
+    lru.put("b", "B", 10)
+    # One large value takes the room of both small ones
+    lru.put("c", "C", 25)
+    assert lru.get("a") is None and lru.get("b") is None
+    assert lru.stats()["entries"] == 1 and lru.stats()["bytes"] == 25
+
+
+def test_value_larger_than_cache_is_not_kept():
+    lru = ByteLRU(30)
+    lru.put("a", "A", 10)
+    assert not lru.put("b", "B", 31)
+    assert lru.get("b") is None
+    assert lru.get("a") == "A"
+
+
+def test_replacing_a_value_updates_the_size():
+    lru = ByteLRU(30)
+    lru.put("a", "A", 20)
+    lru.put("a", "AA", 5)
+    assert lru.get("a") == "AA"
+    assert lru.stats()["bytes"] == 5
+
+
+def test_invalidate_and_clear():
+    lru = ByteLRU(100)
+    lru.put("a", "A", 10)
+    lru.put("b", "B", 10)
+    assert lru.invalidate("a")
+    assert not lru.invalidate("a")
+    assert lru.stats()["bytes"] == 10
+    assert lru.clear() == 1
+    assert lru.stats()["entries"] == 0 and lru.stats()["bytes"] == 0
+
+
+def _metadata(md5="abc"):
+    return {"dataSetName": "x", "paleoData": [{"measurementTable": [{"filename": "x.paleo1measurement1.csv",
+                                                                       "dataMD5": md5}]}]}
+
+
+def test_conversion_key_ignores_key_order():
+    a = {"dataSetName": "x", "archiveType": "marine sediment"}
+    b = {"archiveType": "marine sediment", "dataSetName": "x"}
+    assert conversion_key(a, {}, "p", "1") == conversion_key(b, {}, "p", "1")
+    assert conversion_key(a, {}, "p", "1") != conversion_key(a, {}, "p", "2")
+
+
+def test_conversion_key_uses_table_md5s():
+    csvs = {"x.paleo1measurement1.csv": [[1, 2]]}
+    # With an MD5 for every CSV file, the CSV data itself isn't hashed
+    assert conversion_key(_metadata(), csvs, "p", "1") == \
+        conversion_key(_metadata(), {"x.paleo1measurement1.csv": [[3, 4]]}, "p", "1")
+    assert conversion_key(_metadata(), csvs, "p", "1") != conversion_key(_metadata("def"), csvs, "p", "1")
+    # Without one, it is
+    extra = {"x.paleo1measurement1.csv": [[1, 2]], "x.chron1measurement1.csv": [[5]]}
+    assert conversion_key(_metadata(), extra, "p", "1") != \
+        conversion_key(_metadata(), dict(extra, **{"x.chron1measurement1.csv": [[6]]}), "p", "1")
@@ -0,0 +1,51 @@
+import gzip
+import io
+import zlib
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+from compression import read_body, _decompressed, CHUNK_SIZE
+
+BODY = b'{"metadata": {"dataSetName": "A.B.C"}, "csvs": {}}' * 1000
+
+
+def _read(data, encoding=None, max_size=1024 * 1024, **kwargs):
+    headers = {"Content-Encoding": encoding} if encoding else {}
+    with Flask(__name__).test_request_context(method="POST", data=data, headers=headers, **kwargs) as ctx:
+        return read_body(ctx.request, max_size)
+
+
+@pytest.mark.parametrize("encoding, compress", [
+    (None, lambda b: b),
+    ("gzip", gzip.compress),
+    ("deflate", zlib.compress),
+])
+def test_read_body(encoding, compress):
+    assert _read(compress(BODY), encoding) == BODY
+
+
+def test_expanding_body_is_held_to_max_size():
+    bomb = gzip.compress(b"\0" * (64 * 1024 * 1024))
+    with pytest.raises(RequestEntityTooLarge):
+        _read(bomb, "gzip")
+
+
+def test_decompressed_pieces_are_bounded():
+    bomb = gzip.compress(b"\0" * (16 * 1024 * 1024))
+    sizes = [len(part) for part in _decompressed(io.BytesIO(bomb), "gzip")]
+    assert sum(sizes) == 16 * 1024 * 1024
+    assert max(sizes) <= CHUNK_SIZE
+
+
+def test_body_without_content_length_is_held_to_max_size():
+    with pytest.raises(RequestEntityTooLarge):
+        _read(None, max_size=1000, input_stream=io.BytesIO(BODY))
+
+
+def test_bad_bodies():
+    with pytest.raises(BadRequest):
+        _read(b"not gzip", "gzip")
+    with pytest.raises(UnsupportedMediaType):
+        _read(BODY, "br")
@@ -0,0 +1,83 @@
+import pytest
+
+import convert
+from cache import ByteLRU
+
+
+class _Failing(object):
+    # Stands in for LPD_NOAA, failing part way through the conversion
+    def __init__(self, *args):
+        pass
+
+    def main(self):
+        raise ValueError("bad table")
+
+
+class _Converter(object):
+    # Stands in for LPD_NOAA, writing one NOAA text per dataset, or none for a dataset named "Empty"
+    def __init__(self, D, dsn, *args):
+        self.dsn = dsn
+
+    def main(self):
+        pass
+
+    def get_noaa_texts(self):
+        return {} if self.dsn == "Empty" else {self.dsn + ".txt": "NOAA text"}
+
+    def stream(self):
+        return iter(self.get_noaa_texts().items())
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    monkeypatch.setattr(convert, "LPD_NOAA", _Failing)
+
+
+@pytest.fixture
+def converter(monkeypatch):
+    monkeypatch.setattr(convert, "LPD_NOAA", _Converter)
+
+
+def test_lpd_to_noaa_raises(failing):
+    with pytest.raises(ValueError):
+        convert.lpd_to_noaa({"dataSetName": "A.B.C"}, "project", "1.0.0")
+
+
+def test_convert_lipd_raises(failing):
+    with pytest.raises(ValueError):
+        convert.convert_lipd({"dataSetName": "A.B.C"}, {}, "project", "1.0.0")
+
+
+def test_results_are_cached(converter):
+    cache = ByteLRU(1024)
+    assert convert.convert_lipd({"dataSetName": "A.B.C"}, {}, cache=cache) == [{"A.B.C.txt": "NOAA text"}]
+    assert list(convert.stream_lipd({"dataSetName": "A.B.D"}, {}, cache=cache)) == [{"A.B.D.txt": "NOAA text"}]
+    assert cache.stats()["entries"] == 2
+
+
+def test_empty_results_are_not_cached(converter):
+    cache = ByteLRU(1024)
+    assert convert.convert_lipd({"dataSetName": "Empty"}, {}, cache=cache) == []
+    assert list(convert.stream_lipd({"dataSetName": "Empty"}, {}, cache=cache)) == []
+    assert convert.convert_batch([{"metadata": {"dataSetName": "Empty"}, "csvs": {}}], cache=cache) == \
+        {"Empty": {"result": []}}
+    assert cache.stats()["entries"] == 0
+
+
+def test_failed_conversions_are_not_cached(failing):
+    cache = ByteLRU(1024)
+    with pytest.raises(ValueError):
+        convert.convert_lipd({"dataSetName": "A.B.C"}, {}, cache=cache)
+    out = convert.convert_batch([{"metadata": {"dataSetName": "A.B.C"}, "csvs": {}}], cache=cache)
+    assert out == {"A.B.C": {"error": "Exception found: bad table"}}
+    assert cache.stats()["entries"] == 0
+
+
+def test_batch_reports_bad_records_on_their_own(converter):
+    records = [{"metadata": 5, "csvs": {}}, {"metadata": {"dataSetName": "A.B.C"}}, "record",
+               {"metadata": {"dataSetName": "A.B.D"}, "csvs": {}}]
+    out = convert.convert_batch(records, cache=ByteLRU(1024))
+    assert out == {"dataset0": {"error": 'Expected a {"metadata", "csvs"} record'},
+                   "A.B.C": {"error": "No CSV data provided"},
+                   "dataset2": {"error": 'Expected a {"metadata", "csvs"} record'},
+                   "A.B.D": {"result": [{"A.B.D.txt": "NOAA text"}]}}
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from editdistance import levenshtein, levenshtein_many, StringArray
+
+
+def dp(a, b):
+    # The full table, the way editDistDP worked it out
+    table = [[i + j if not i or not j else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+    return table[-1][-1]
+
+
+def _words(rng, count, lo=0, hi=20, alphabet="abcdeé "):
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("", "", 0), ("", "abc", 3), ("abc", "", 3), ("kitten", "sitting", 3), ("flaw", "lawn", 2),
+    ("marine sediment", "marinesedimnt", 2), ("a" * 70, "b" * 70, 70),
+])
+def test_levenshtein_examples(a, b, expected):
+    assert levenshtein(a, b) == expected
+    assert levenshtein(b, a) == expected
+
+
+def test_levenshtein_matches_table():
+    rng = random.Random(0)
+    for a, b in zip(_words(rng, 2000), _words(rng, 2000)):
+        assert levenshtein(a, b) == dp(a, b)
+
+
+def test_levenshtein_long_strings():
+    rng = random.Random(1)
+    for a, b in zip(_words(rng, 20, 60, 130), _words(rng, 20, 60, 130)):
+        assert levenshtein(a, b) == dp(a, b)
+
+
+def test_levenshtein_bounded():
+    rng = random.Random(2)
+    for a, b in zip(_words(rng, 1000), _words(rng, 1000)):
+        d = dp(a, b)
+        for k in range(7):
+            assert levenshtein(a, b, k) == min(d, k + 1)
+
+
+@pytest.mark.parametrize("max_distance", [None, 0, 1, 3, 5])
+def test_string_array_matches_levenshtein(max_distance):
+    rng = random.Random(3)
+    strings = _words(rng, 500, 0, 30) + [""]
+    array = StringArray(strings)
+    for query in _words(rng, 40, 0, 25) + ["", "x" * 64, "y" * 80]:
+        assert array.distances(query, max_distance).tolist() == [levenshtein(query, s, max_distance) for s in strings]
+
+
+def test_string_array_unbounded_is_not_capped():
+    assert levenshtein_many("", ["bb a"]) == [4]
+    assert levenshtein_many("", ["", "a", "abcdefgh"]) == [0, 1, 8]
+    assert levenshtein_many("abcdefghij", ["z"]) == [10]
+
+
+def test_string_array_empty():
+    assert StringArray([]).distances("abc").tolist() == []
+    assert StringArray([]).distances("abc", 3).tolist() == []
+
+
+def test_levenshtein_many_bounded():
+    assert levenshtein_many("abc", ["abd", "", "xyzxyzxyz"], 3) == [1, 3, 4]
@@ -0,0 +1,97 @@
+import glob
+import os
+import shutil
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+import flask_app
+from workers import ConversionPoolFull
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _app(tmp_path, **config):
+    for path in glob.glob(os.path.join(HERE, "ground_truth_label_*.json")) + \
+            glob.glob(os.path.join(HERE, "autocomplete_file_*.json")):
+        shutil.copy(path, str(tmp_path))
+    _config = {"FLASK_DIR": str(tmp_path), "LOG_FILE": str(tmp_path / "debug.log"), "BENCHMARK_LOG": None,
+               "RATELIMIT_STORAGE_URI": "memory://", "CONVERSION_POOL_SIZE": 0, "WARM_UP": False,
+               "MODEL_RELOAD_INTERVAL": 0}
+    _config.update(config)
+    return flask_app.create_app(_config)
+
+
+@pytest.fixture
+def client(tmp_path):
+    return _app(tmp_path).test_client()
+
+
+def test_noaa_routes_have_no_limit_by_default(client):
+    # More requests than the default limits allow
+    codes = {client.post("/api/noaa", json={}).status_code for _ in range(520)}
+    assert codes == {400}
+
+
+def test_noaa_rate_limit(tmp_path):
+    client = _app(tmp_path, NOAA_RATE_LIMIT="3 per hour").test_client()
+    routes = ["/api/noaa", "/api/noaa/jobs", "/api/noaa", "/api/noaa"]
+    codes = [client.post(route, json={}).status_code for route in routes]
+    assert codes == [400, 400, 400, 429]
+
+
+@pytest.mark.parametrize("data, content_type", [
+    (b'{"metadata": ', "application/json"),
+    (b"\xc1", "application/x-msgpack"),
+    (b"\x92\x01", "application/x-msgpack"),
+])
+def test_malformed_body(client, data, content_type):
+    for route in ["/api/noaa", "/api/noaa/batch", "/api/noaa/jobs"]:
+        assert client.post(route, data=data, content_type=content_type).status_code == 400
+
+
+class _FullPool(object):
+    # Stands in for a ConversionPool with every worker busy and the queue at its limit
+    def full(self):
+        return True
+
+    def run(self, *args, **kwargs):
+        raise ConversionPoolFull("conversion queue is full")
+
+    def run_many(self, fn, tasks):
+        return [ConversionPoolFull("conversion queue is full") for _ in tasks]
+
+
+class _SlowPool(_FullPool):
+    # Stands in for a ConversionPool whose conversions all take longer than its timeout
+    def full(self):
+        return False
+
+    def run(self, *args, **kwargs):
+        raise FutureTimeoutError()
+
+    def run_many(self, fn, tasks):
+        return [TimeoutError("conversion took longer than 120 seconds") for _ in tasks]
+
+
+RECORD = {"metadata": {"dataSetName": "A.B.C"}, "csvs": {}}
+
+
+def test_full_pool_is_503(tmp_path):
+    app = _app(tmp_path, CONVERSION_RETRY_AFTER=7)
+    app.extensions["lipdnet"].conversion_pool = _FullPool()
+    client = app.test_client()
+    for response in [client.post("/api/noaa", json=RECORD), client.post("/api/noaa/batch", json=[RECORD]),
+                     client.post("/api/noaa/jobs", json=RECORD)]:
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "7"
+
+
+def test_timed_out_conversion_is_504(tmp_path):
+    app = _app(tmp_path)
+    app.extensions["lipdnet"].conversion_pool = _SlowPool()
+    client = app.test_client()
+    assert client.post("/api/noaa", json=RECORD).status_code == 504
+    response = client.post("/api/noaa/batch", json=[RECORD])
+    assert response.status_code == 504
+    assert response.get_json()["A.B.C"]["status"] == 504
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+from limits import RateLimitItemPerMinute
+from limits.errors import ConfigurationError
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from ratelimit import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage("sqlite://" + str(tmp_path / "ratelimit.db"))
+
+
+def test_registered_for_sqlite_uris(tmp_path):
+    storage = storage_from_string("sqlite://" + str(tmp_path / "ratelimit.db"))
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.check()
+
+
+def test_needs_a_file():
+    with pytest.raises(ConfigurationError):
+        SQLiteStorage("sqlite://")
+
+
+def test_incr_and_get(storage):
+    assert storage.get("k") == 0
+    assert storage.incr("k", 60) == 1
+    assert storage.incr("k", 60, amount=2) == 3
+    assert storage.get("k") == 3
+    assert storage.get_expiry("k") > time.time() + 50
+
+
+def test_counter_starts_again_after_its_window(storage):
+    storage.incr("k", 1)
+    storage.incr("k", 1)
+    time.sleep(1.1)
+    assert storage.get("k") == 0
+    assert storage.incr("k", 60) == 1
+
+
+def test_clear_and_reset(storage):
+    storage.incr("a", 60)
+    storage.incr("b", 60)
+    storage.clear("a")
+    assert storage.get("a") == 0 and storage.get("b") == 1
+    assert storage.reset() == 1
+    assert storage.get("b") == 0
+
+
+def test_shared_between_storages_on_one_file(tmp_path):
+    # Two storages on one file stand in for two worker processes
+    uri = "sqlite://" + str(tmp_path / "ratelimit.db")
+    a, b = SQLiteStorage(uri), SQLiteStorage(uri)
+    a.incr("k", 60)
+    b.incr("k", 60)
+    assert a.get("k") == b.get("k") == 2
+
+
+def test_concurrent_hits_are_all_counted(storage):
+    def _hit():
+        for _ in range(50):
+            storage.incr("k", 60)
+
+    threads = [threading.Thread(target=_hit) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert storage.get("k") == 200
+
+
+def test_fixed_window_limiter(storage):
+    limiter = FixedWindowRateLimiter(storage)
+    limit = RateLimitItemPerMinute(3)
+    assert [limiter.hit(limit, "client") for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit(limit, "other client")
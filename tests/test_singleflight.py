@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _callers(flight, key, fn, count):
+    # Start count callers on the same key. Their results and exceptions fill in as they finish
+    results = [None] * count
+    errors = [None] * count
+
+    def _call(i):
+        try:
+            results[i] = flight.do(key, fn)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=_call, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def _wait_for(flight, coalesced):
+    for _ in range(500):
+        if flight.stats()["coalesced"] == coalesced:
+            return
+        time.sleep(0.01)
+    raise AssertionError("callers never joined the run")
+
+
+def test_concurrent_callers_share_one_run():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def fn():
+        runs.append(1)
+        release.wait(5)
+        return "value"
+
+    threads, results, errors = _callers(flight, "k", fn, 5)
+    _wait_for(flight, 4)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(runs) == 1
+    assert sorted(results) == [("value", False)] + [("value", True)] * 4
+    assert errors == [None] * 5
+    assert flight.stats() == {"calls": 5, "coalesced": 4, "in_flight": 0, "coalesce_ratio": 0.8}
+
+
+def test_exception_is_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("failed")
+
+    threads, results, errors = _callers(flight, "k", fn, 3)
+    _wait_for(flight, 2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == [None] * 3
+    assert all(isinstance(e, ValueError) for e in errors)
+
+
+def test_nothing_is_kept_after_a_run():
+    flight = SingleFlight()
+    values = iter([1, 2])
+    assert flight.do("k", lambda: next(values)) == (1, False)
+    assert flight.do("k", lambda: next(values)) == (2, False)
+    with pytest.raises(KeyError):
+        flight.do("k", lambda: {}["x"])
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: "A") == ("A", False)
+    assert flight.do("b", lambda: "B") == ("B", False)
+    assert flight.stats()["coalesced"] == 0
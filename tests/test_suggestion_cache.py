@@ -0,0 +1,62 @@
+from autocomplete import Vocabulary, SuggestionCache
+
+
+WORDS = ["D18O", "D13C", "Dd", "Density", "Depth", "Temperature", "Tree Ring Width", "Trace Elements"]
+
+
+class Compute(object):
+    # Every value starting with the query, in file order, counting the calls
+    def __init__(self, words):
+        self.words = words
+        self.calls = []
+
+    def __call__(self, fieldType, query, limit=None, offset=0):
+        self.calls.append((query, limit, offset))
+        found = [w for w in self.words if w.lower().startswith(query)]
+        return found[offset:] if limit is None else found[offset:offset + limit]
+
+
+def _cache(max_bytes=1024, depth=3, words=WORDS):
+    compute = Compute(words)
+    return SuggestionCache("v1", Vocabulary({"proxyObservationType": words}), compute, max_bytes, depth), compute
+
+
+def test_short_prefixes_are_precomputed():
+    cache, compute = _cache()
+    built = len(compute.calls)
+    assert cache.get("proxyObservationType", "D", 2) == (["D18O", "D13C"], "precomputed")
+    assert cache.get("proxyObservationType", "de", 3) == (["Density", "Depth"], "precomputed")
+    assert len(compute.calls) == built
+
+
+def test_longer_queries_are_cached():
+    cache, compute = _cache()
+    assert cache.get("proxyObservationType", "Dep", 3) == (["Depth"], "computed")
+    assert cache.get("proxyObservationType", "dep", 3) == (["Depth"], "cached")
+
+
+def test_only_depth_results_are_kept():
+    cache, compute = _cache(depth=3)
+    # "d" has five values. The first three are kept, the ones past them are worked out when asked for.
+    assert cache.get("proxyObservationType", "d", 3) == (["D18O", "D13C", "Dd"], "precomputed")
+    assert cache.get("proxyObservationType", "d", 3, 1) == (["D13C", "Dd", "Density"], "computed")
+    assert compute.calls[-1] == ("d", 3, 1)
+    # All three of "t" fit, so any page of it comes from what is kept
+    assert cache.get("proxyObservationType", "t", 3, 2) == (["Trace Elements"], "precomputed")
+    assert cache.get("proxyObservationType", "t", 3, 3) == ([], "precomputed")
+
+
+def test_precomputed_prefixes_are_bounded():
+    cache, _ = _cache(max_bytes=60)
+    short = cache._short["proxyObservationType"]
+    # The one character prefixes come first, and they stop at max_bytes
+    assert set(short) == {"d", "t"}
+    assert sum(len(q) + sum(len(w) for w in found) for q, (found, _) in short.items()) <= 60
+    assert cache.get("proxyObservationType", "de", 3) == (["Density", "Depth"], "computed")
+
+
+def test_unknown_field_is_computed():
+    cache, compute = _cache()
+    assert cache.get("inferredVariable", "d", 3) == (["D18O", "D13C", "Dd"], "computed")
+    assert compute.calls[-1] == ("d", 3, 0)
+    assert cache.stats()["proxyObservationType"]["precomputed"] > 0
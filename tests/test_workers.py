@@ -0,0 +1,66 @@
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from workers import ConversionPool
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _fail(message):
+    raise ValueError(message)
+
+
+def _die():
+    os._exit(1)
+
+
+@pytest.fixture
+def pool():
+    pool = ConversionPool(size=2, timeout=1.5)
+    yield pool
+    pool.shutdown(wait=False)
+
+
+def test_run(pool):
+    assert pool.run(_sleep, 0) == 0
+    with pytest.raises(ValueError):
+        pool.run(_fail, "failed")
+
+
+def test_run_many_results_in_order(pool):
+    results = pool.run_many(_sleep, [(0.1,), (0,), (0.2,)])
+    assert results == [0.1, 0, 0.2]
+
+
+def test_run_many_returns_exceptions(pool):
+    results = pool.run_many(_fail, [("a",), ("b",)])
+    assert [str(e) for e in results] == ["a", "b"]
+
+
+def test_run_many_times_out_each_task(pool):
+    # One task never finishes in time while the other worker keeps finishing short ones. It times out on its own,
+    # without holding up the batch or taking the short ones with it.
+    start = time.monotonic()
+    results = pool.run_many(_sleep, [(5,)] + [(0.3,)] * 8)
+    assert isinstance(results[0], TimeoutError)
+    assert results[1:] == [0.3] * 8
+    assert time.monotonic() - start < 4.5
+
+
+def test_broken_pool_is_replaced(pool):
+    pool.run(_sleep, 0)
+    broken = pool._executor
+    with pytest.raises(BrokenProcessPool):
+        pool.run(_die)
+    assert pool.run(_sleep, 0) == 0
+    replacement = pool._executor
+    assert replacement is not broken
+    # Another task that was on the broken executor reports it late. The healthy replacement is kept.
+    pool._replace_broken(broken)
+    assert pool._executor is replacement
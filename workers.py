@@ -0,0 +1,246 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+
+from loggers import create_logger, benchmark, current_trace, start_trace, end_trace
+
+logger_workers = create_logger("workers")
+
+
+class ConversionPoolFull(Exception):
+    """
+    Raised when a task is submitted while every worker is busy and the queue is at its limit.
+    """
+    pass
+
+
+# Raised for a task that takes longer than the pool's timeout. future.result() raises the concurrent.futures one, which
+# is only the builtin TimeoutError from Python 3.11 on, and run_many returns the builtin one.
+TIMEOUT_ERRORS = (TimeoutError, FutureTimeoutError)
+
+
+def _init_worker():
+    """
+    Runs once in each worker process as it starts. Import the conversion modules up front, so no task pays for it.
+    :return none:
+    """
+    import lpd_noaa
+    import csvs
+    import jsons
+    import inferred_data
+    logger_workers.info("init_worker: conversion worker {} ready".format(os.getpid()))
+    return
+
+
+def _traced(fn, args, kwargs):
+    """
+    Run a task in a worker while recording its benchmarked stages, so they can be added to the trace of the request
+    that submitted it.
+
+    :return tuple: The task's result, and the spans it recorded
+    """
+    trace = start_trace()
+    try:
+        return fn(*args, **kwargs), trace.spans
+    finally:
+        end_trace()
+
+
+def _ping():
+    return os.getpid()
+
+
+class ConversionPool(object):
+    """
+    A pool of worker processes for the CPU-bound LiPD to NOAA conversions. Conversions are pure Python, so threads
+    can't run them in parallel. Processes can, and let a single app worker use every core.
+    """
+
+    def __init__(self, size=None, queue_depth=16, timeout=120):
+        """
+        :param int size: Number of worker processes. Defaults to the number of cores.
+        :param int queue_depth: Tasks allowed to wait for a free worker before new tasks are refused
+        :param float timeout: Seconds to wait for a task's result before giving up on it
+        """
+        self.size = size or os.cpu_count() or 1
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.size + self.queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _new_executor(self):
+        # With the fork start method the executor launches every worker on the first submit, instead of one at a
+        # time as tasks arrive.
+        try:
+            _ctx = multiprocessing.get_context("fork")
+        except ValueError:
+            _ctx = multiprocessing.get_context()
+        return ProcessPoolExecutor(max_workers=self.size, mp_context=_ctx, initializer=_init_worker)
+
+    def start(self):
+        """
+        Fork the worker processes now, instead of on the first conversion.
+        :return none:
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            _executor = self._executor
+        _executor.submit(_ping).result()
+        logger_workers.info("start: {} conversion workers".format(self.size))
+        return
+
+    def submit(self, fn, *args, block=False, **kwargs):
+        """
+        Queue a task on the pool. The task and its arguments must be picklable.
+
+        :param callable fn: Module-level function to run in a worker
+        :param bool block: Wait up to the task timeout for a queue slot, instead of failing straight away
+        :return Future: Future for the task's result. Its executor attribute is the executor it was submitted to.
+        """
+        if not self._slots.acquire(blocking=block, timeout=self.timeout if block else None):
+            raise ConversionPoolFull("conversion queue is full ({} running, {} waiting)".format(self.size, self.queue_depth))
+        _executor = None
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._new_executor()
+                _executor = self._executor
+                future = _executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._replace_broken(_executor)
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.executor = _executor
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def full(self):
+        """
+        Check if every worker is busy and the queue is at its limit, so a task submitted now would be refused.
+        :return bool:
+        """
+        if not self._slots.acquire(blocking=False):
+            return True
+        self._slots.release()
+        return False
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run a task on the pool, and wait for its result. A task that times out keeps its worker until it finishes,
+        and its queue slot with it, so a run of slow datasets pushes back on new submissions.
+
+        :param callable fn: Module-level function to run in a worker
+        :return any: The task's result
+        """
+        trace = current_trace()
+        if trace is None:
+            future = self.submit(fn, *args, **kwargs)
+            try:
+                return future.result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._replace_broken(future.executor)
+                raise
+
+        # The request is being traced. Record the task's stages in the worker and add them to the request's trace.
+        with benchmark("conversion_pool"):
+            _offset = time.perf_counter() - trace.start
+            _depth = trace.depth
+            future = self.submit(_traced, fn, args, kwargs)
+            try:
+                result, spans = future.result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._replace_broken(future.executor)
+                raise
+            trace.add(spans, _offset, _depth)
+        return result
+
+    def run_many(self, fn, tasks):
+        """
+        Run the same function over many argument tuples, spread across the workers. At most one task per worker is
+        queued at a time, so a large batch doesn't take every queue slot from single requests.
+
+        :param callable fn: Module-level function to run in a worker
+        :param list tasks: Argument tuple for each task
+        :return list: Result for each task, in order. A task that failed has its exception in place of a result.
+        """
+        trace = current_trace()
+        results = [None] * len(tasks)
+        # Each running task's index and the time it has to finish by, counted from when it was submitted
+        _pending = {}
+        _next = 0
+        while _next < len(tasks) or _pending:
+            while _next < len(tasks) and len(_pending) < self.size:
+                try:
+                    if trace is None:
+                        future = self.submit(fn, *tasks[_next], block=True)
+                    else:
+                        future = self.submit(_traced, fn, tasks[_next], {}, block=True)
+                        future.trace_offset = time.perf_counter() - trace.start
+                    _pending[future] = (_next, time.monotonic() + self.timeout)
+                except Exception as e:
+                    results[_next] = e
+                _next += 1
+            if not _pending:
+                continue
+            _wait = max(0, min(deadline for _, deadline in _pending.values()) - time.monotonic())
+            _done, _ = wait_futures(list(_pending), timeout=_wait, return_when=FIRST_COMPLETED)
+            for future in _done:
+                idx, _ = _pending.pop(future)
+                try:
+                    results[idx] = future.result()
+                    if trace is not None:
+                        results[idx], spans = results[idx]
+                        trace.add(spans, future.trace_offset, trace.depth)
+                except BrokenProcessPool as e:
+                    self._replace_broken(future.executor)
+                    results[idx] = e
+                except Exception as e:
+                    results[idx] = e
+            # Give up on each task that has run past its own timeout, while the others carry on
+            _now = time.monotonic()
+            for future, (idx, deadline) in list(_pending.items()):
+                if deadline <= _now and not future.done():
+                    del _pending[future]
+                    future.cancel()
+                    results[idx] = TimeoutError("conversion took longer than {} seconds".format(self.timeout))
+        return results
+
+    def _replace_broken(self, broken):
+        """
+        A worker died (out of memory, killed), which breaks the whole executor. Drop it and shut it down, so the next
+        task starts a new one and still has somewhere to run. Every task on the broken executor sees the failure, and
+        only the first one to get here replaces it: the executor the others find may already be its healthy
+        replacement.
+
+        :param ProcessPoolExecutor broken: The executor the failed task was submitted to
+        :return none:
+        """
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        logger_workers.error("replace_broken: conversion pool is broken, starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+        return
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker processes.
+        :param bool wait: Wait for running tasks to finish
+        :return none:
+        """
+        with self._lock:
+            _executor, self._executor = self._executor, None
+        if _executor:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+        return
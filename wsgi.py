@@ -0,0 +1,6 @@
+"""
+Entry point for the WSGI server: point it at wsgi:app, or at wsgi:application.
+"""
+from flask_app import create_app
+
+app = application = create_app()